@@ -0,0 +1,53 @@
+"""Precompute which places overlap each other
+
+Revision ID: 2d9f6a41b7c3
+Revises: e71b4d0c8a26
+Create Date: 2026-10-17 15:03:18.771952+00:00
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "2d9f6a41b7c3"
+down_revision = "e71b4d0c8a26"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "placeoverlaps",
+        sa.Column(
+            "place_id",
+            sa.Integer(),
+            sa.ForeignKey("places.id", ondelete="CASCADE"),
+            primary_key=True,
+        ),
+        sa.Column(
+            "overlapping_place_id",
+            sa.Integer(),
+            sa.ForeignKey("places.id", ondelete="CASCADE"),
+            primary_key=True,
+        ),
+    )
+    op.create_index(
+        "ix_placeoverlaps_overlapping_place_id",
+        "placeoverlaps",
+        ["overlapping_place_id"],
+    )
+    # Nations overlap nearly everything, so they're left out. Searches
+    # check them separately.
+    op.execute(
+        """INSERT INTO placeoverlaps (place_id, overlapping_place_id)
+        SELECT a.id, b.id FROM places a
+        JOIN places b ON ST_Intersects(a.geometry, b.geometry)
+        WHERE a.type NOT IN ('nation', 'everywhere')
+        AND b.type NOT IN ('nation', 'everywhere');"""
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_placeoverlaps_overlapping_place_id", table_name="placeoverlaps")
+    op.drop_table("placeoverlaps")
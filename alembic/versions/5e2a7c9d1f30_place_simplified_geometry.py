@@ -0,0 +1,41 @@
+"""Add simplified geometries to places
+
+Revision ID: 5e2a7c9d1f30
+Revises: c3d8f1a2b6e7
+Create Date: 2026-10-17 13:41:09.227815+00:00
+
+"""
+import sqlalchemy as sa
+from geoalchemy2 import Geometry
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "5e2a7c9d1f30"
+down_revision = "c3d8f1a2b6e7"
+branch_labels = None
+depends_on = None
+
+# These must match Place.SIMPLIFIED_TOLERANCE and Place.COARSE_TOLERANCE.
+COLUMNS = dict(simplified_geometry=0.001, coarse_geometry=0.01)
+
+
+def upgrade() -> None:
+    for column, tolerance in COLUMNS.items():
+        op.add_column(
+            "places",
+            sa.Column(column, Geometry(srid=4326, spatial_index=False), nullable=True),
+        )
+        op.execute(
+            f"UPDATE places SET {column} = ST_SimplifyPreserveTopology(geometry, {tolerance}) "
+            "WHERE geometry IS NOT NULL;"
+        )
+        op.create_index(
+            f"idx_places_{column}", "places", [column], postgresql_using="gist"
+        )
+
+
+def downgrade() -> None:
+    for column in COLUMNS:
+        op.drop_index(f"idx_places_{column}", table_name="places")
+        op.drop_column("places", column)
@@ -0,0 +1,31 @@
+"""Store each place's geometry as GeoJSON
+
+Revision ID: 7a3c5e9b2f14
+Revises: 2d9f6a41b7c3
+Create Date: 2026-10-17 16:02:37.518204+00:00
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "7a3c5e9b2f14"
+down_revision = "2d9f6a41b7c3"
+branch_labels = None
+depends_on = None
+
+# This must match Place.GEOJSON_PRECISION.
+PRECISION = 6
+
+
+def upgrade() -> None:
+    op.add_column("places", sa.Column("geojson", sa.Unicode(), nullable=True))
+    op.execute(
+        f"UPDATE places SET geojson = ST_AsGeoJSON(geometry, {PRECISION}) "
+        "WHERE geometry IS NOT NULL;"
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("places", "geojson")
@@ -0,0 +1,43 @@
+"""Index for paging through library feeds
+
+Revision ID: 9b5e1c7d3a42
+Revises: 4f716132bf58
+Create Date: 2026-10-17 09:12:44.318207+00:00
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "9b5e1c7d3a42"
+down_revision = "4f716132bf58"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # For the production feed, which matches each stage exactly.
+    op.create_index(
+        "ix_libraries_stages_name_id",
+        "libraries",
+        ["registry_stage", "library_stage", "name", "id"],
+    )
+
+    # For the QA feed, which allows either stage. This must match
+    # Library._feed_restriction(production=False), or the index won't
+    # be used.
+    op.create_index(
+        "ix_libraries_qa_feed_name_id",
+        "libraries",
+        ["name", "id"],
+        postgresql_where=sa.text(
+            "library_stage IN ('production', 'testing') "
+            "AND registry_stage IN ('production', 'testing')"
+        ),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_libraries_qa_feed_name_id", table_name="libraries")
+    op.drop_index("ix_libraries_stages_name_id", table_name="libraries")
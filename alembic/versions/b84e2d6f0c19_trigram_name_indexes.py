@@ -0,0 +1,40 @@
+"""Add trigram indexes for fuzzy name matching
+
+Revision ID: b84e2d6f0c19
+Revises: 7a3c5e9b2f14
+Create Date: 2026-10-17 16:48:12.093561+00:00
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "b84e2d6f0c19"
+down_revision = "7a3c5e9b2f14"
+branch_labels = None
+depends_on = None
+
+# The columns searched by Library.fuzzy_match and Library.partial_match.
+COLUMNS = [
+    ("libraries", "name"),
+    ("libraries", "description"),
+    ("libraryalias", "name"),
+    ("places", "external_name"),
+    ("placealiases", "name"),
+]
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for table, column in COLUMNS:
+        op.create_index(
+            f"ix_{table}_{column}_trgm",
+            table,
+            [column],
+            postgresql_using="gin",
+            postgresql_ops={column: "gin_trgm_ops"},
+        )
+
+
+def downgrade() -> None:
+    for table, column in COLUMNS:
+        op.drop_index(f"ix_{table}_{column}_trgm", table_name=table)
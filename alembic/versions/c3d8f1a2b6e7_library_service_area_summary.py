@@ -0,0 +1,133 @@
+"""Store a summary of each library's service area
+
+Revision ID: c3d8f1a2b6e7
+Revises: 9b5e1c7d3a42
+Create Date: 2026-10-17 11:02:37.504119+00:00
+
+"""
+from collections import defaultdict
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "c3d8f1a2b6e7"
+down_revision = "9b5e1c7d3a42"
+branch_labels = None
+depends_on = None
+
+
+# It is not recommended to use models in the migration scripts, so the
+# logic that summarizes a service area is copied here as it stood when
+# this migration was written.
+FOCUS = "focus"
+ELIGIBILITY = "eligibility"
+
+EVERYWHERE = "everywhere"
+NATION = "nation"
+STATE = "state"
+COUNTY = "county"
+CITY = "city"
+
+ADMINISTRATIVE_DIVISION_TYPES = {"US": "state", "CA": "province"}
+
+
+def service_area(service_areas, places):
+    """Find the one place a library serves, if there is one.
+
+    :param service_areas: A list of 2-tuples (service area type, place ID).
+    :param places: A dictionary mapping place ID to a dictionary of
+        the place's fields.
+    :return: A place dictionary, or None.
+    """
+    everywhere = None
+    by_type = defaultdict(list)
+    for type, place_id in service_areas:
+        place = places.get(place_id)
+        if not place:
+            continue
+        if place["type"] == EVERYWHERE:
+            everywhere = place
+            continue
+        by_type[type].append(place)
+
+    for area_type in FOCUS, ELIGIBILITY:
+        if len(by_type[area_type]) == 1:
+            return by_type[area_type][0]
+    return everywhere
+
+
+def library_type(place, places):
+    if place["type"] == EVERYWHERE:
+        return "universal"
+    elif place["type"] == NATION:
+        return "national"
+    elif place["type"] == STATE:
+        parent = places.get(place["parent_id"])
+        if parent and parent["type"] == NATION:
+            return ADMINISTRATIVE_DIVISION_TYPES.get(
+                parent["abbreviated_name"], "state"
+            )
+        return "state"
+    elif place["type"] == COUNTY:
+        return "county"
+    return "local"
+
+
+def human_friendly_name(place, places):
+    if place["type"] == EVERYWHERE:
+        return None
+    parent = places.get(place["parent_id"])
+    if parent and parent["type"] == STATE:
+        parent_name = parent["abbreviated_name"] or parent["external_name"]
+        if place["type"] == COUNTY:
+            return f"{place['external_name']} County, {parent_name}"
+        elif place["type"] == CITY:
+            return f"{place['external_name']}, {parent_name}"
+    return place["external_name"]
+
+
+def upgrade() -> None:
+    op.add_column("libraries", sa.Column("service_area_name", sa.Unicode()))
+    op.add_column("libraries", sa.Column("library_type", sa.Unicode()))
+
+    connection = op.get_bind()
+    places = {}
+    for (id, type, external_name, abbreviated_name, parent_id) in connection.execute(
+        """SELECT DISTINCT p.id, p.type, p.external_name, p.abbreviated_name, p.parent_id
+        FROM places p
+        WHERE p.id IN (SELECT place_id FROM serviceareas)
+        OR p.id IN (
+            SELECT parent_id FROM places
+            WHERE id IN (SELECT place_id FROM serviceareas)
+        );"""
+    ):
+        places[id] = dict(
+            type=type,
+            external_name=external_name,
+            abbreviated_name=abbreviated_name,
+            parent_id=parent_id,
+        )
+
+    service_areas = defaultdict(list)
+    for (library_id, type, place_id) in connection.execute(
+        "SELECT library_id, type, place_id FROM serviceareas WHERE library_id IS NOT NULL;"
+    ):
+        service_areas[library_id].append((type, place_id))
+
+    for library_id, areas in service_areas.items():
+        place = service_area(areas, places)
+        if not place:
+            continue
+        connection.execute(
+            "UPDATE libraries SET service_area_name=%s, library_type=%s WHERE id=%s;",
+            human_friendly_name(place, places),
+            library_type(place, places),
+            library_id,
+        )
+
+
+def downgrade() -> None:
+    op.drop_column("libraries", "library_type")
+    op.drop_column("libraries", "service_area_name")
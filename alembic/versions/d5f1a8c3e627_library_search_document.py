@@ -0,0 +1,36 @@
+"""Add a full-text search index over library names and descriptions
+
+Revision ID: d5f1a8c3e627
+Revises: b84e2d6f0c19
+Create Date: 2026-10-17 17:35:44.861270+00:00
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "d5f1a8c3e627"
+down_revision = "b84e2d6f0c19"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # This must match the expression in Library.search_document(), or
+    # the index won't be used.
+    op.create_index(
+        "ix_libraries_search_document",
+        "libraries",
+        [
+            sa.text(
+                "(setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+                "setweight(to_tsvector('english', coalesce(description, '')), 'B'))"
+            )
+        ],
+        postgresql_using="gin",
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_libraries_search_document", table_name="libraries")
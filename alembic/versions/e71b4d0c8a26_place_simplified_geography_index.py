@@ -0,0 +1,31 @@
+"""Index places by their simplified geometry as a geography
+
+Revision ID: e71b4d0c8a26
+Revises: 5e2a7c9d1f30
+Create Date: 2026-10-17 14:26:51.604318+00:00
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = "e71b4d0c8a26"
+down_revision = "5e2a7c9d1f30"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # This must match the expression in Place.simplified_geography(),
+    # or the index won't be used.
+    op.create_index(
+        "ix_places_simplified_geography",
+        "places",
+        [sa.text("CAST(simplified_geometry AS geography(GEOMETRY,4326))")],
+        postgresql_using="gist",
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_places_simplified_geography", table_name="places")
@@ -1,14 +1,31 @@
 import gzip
+import hashlib
+import zlib
 from functools import wraps
 from io import BytesIO
 
+import brotli
 import flask
 
+from config import Configuration
 from model import Admin
 from util import GeometryUtility
+from util.cache import LRUCache
 from util.flask_util import originating_ip
 from util.problem_detail import ProblemDetail
 
+# Compressed versions of recently sent responses, keyed by the
+# response's ETag (or a hash of its content), the encoding and the
+# compression level. A feed's ETag identifies the version of the feed
+# that the response body was built from, so a stored representation
+# can't be sent with the ETag of a newer version. Serving an unchanged
+# feed again doesn't cost any compression work; representations that
+# nobody has asked for in a while are dropped.
+COMPRESSED_REPRESENTATION_MAX_AGE = 300
+compressed_representations = LRUCache(
+    max_size=32, max_age=COMPRESSED_REPRESENTATION_MAX_AGE
+)
+
 
 def has_library_factory(app):
     """Create a decorator that extracts a library uuid from request arguments."""
@@ -58,9 +75,9 @@ def compressible(f):
     """Decorate a function to make it transparently handle whatever
     compression the client has announced it supports.
 
-    Currently the only form of compression supported is
-    representation-level gzip compression requested through the
-    Accept-Encoding header.
+    Representation-level compression can be requested through the
+    Accept-Encoding header. gzip and brotli are supported, and brotli
+    is preferred if the client accepts both.
 
     This code was modified from
     http://kb.sites.apiit.edu.my/knowledge-base/how-to-gzip-response-in-flask/,
@@ -83,7 +100,8 @@ def compressible(f):
                 return response
 
             accept_encoding = flask.request.headers.get("Accept-Encoding", "")
-            if "gzip" not in accept_encoding.lower():
+            encoding = _choose_encoding(accept_encoding)
+            if not encoding:
                 return response
 
             # At this point we know we're going to be changing the
@@ -95,16 +113,43 @@ def compressible(f):
             # fail. This is pure copy-and-paste magic.
             response.direct_passthrough = False
 
-            buffer = BytesIO()
-            gzipped = gzip.GzipFile(mode="wb", fileobj=buffer)
-            gzipped.write(response.data)
-            gzipped.close()
-            response.data = buffer.getvalue()
-
-            response.headers["Content-Encoding"] = "gzip"
+            level = Configuration.compression_level(COMPRESSION_LEVELS[encoding])
+            etag, weak = response.get_etag()
+            if etag:
+                key = (etag, encoding, level)
+            elif not response.is_streamed:
+                key = (hashlib.sha1(response.data).hexdigest(), encoding, level)
+            else:
+                # We can't tell whether we've seen this content before
+                # without reading the whole thing.
+                key = None
+
+            compressed = None
+            if key:
+                compressed = compressed_representations.get(key)
+            if compressed is not None:
+                response.data = compressed
+            elif response.is_streamed:
+                # Compress the response as it's streamed out, rather
+                # than gathering it all up first.
+                chunks = _compress_stream(response.iter_encoded(), encoding, level)
+                if key:
+                    chunks = _store_when_complete(chunks, key)
+                response.response = chunks
+                response.headers.pop("Content-Length", None)
+            else:
+                response.data = compressed_representations.set(
+                    key, _compress(response.data, encoding, level)
+                )
+
+            if etag:
+                # The compressed representation isn't byte-for-byte
+                # identical to the original, so its ETag can only be
+                # a weak validator.
+                response.set_etag(etag, weak=True)
+            response.headers["Content-Encoding"] = encoding
             # TODO: This is bad if Vary is already set.
             response.headers["Vary"] = "Accept-Encoding"
-            response.headers["Content-Length"] = len(response.data)
 
             return response
 
@@ -113,6 +158,68 @@ def compressible(f):
     return compressor
 
 
+# The environment variable that sets the compression level for each
+# supported encoding.
+COMPRESSION_LEVELS = {
+    "br": Configuration.BROTLI_COMPRESSION_LEVEL,
+    "gzip": Configuration.GZIP_COMPRESSION_LEVEL,
+}
+
+
+def _choose_encoding(accept_encoding):
+    """Choose the best encoding the client will accept.
+
+    :return: "br", "gzip", or None if the client doesn't accept any
+        encoding we support.
+    """
+    accept_encoding = accept_encoding.lower()
+    if "br" in [x.split(";")[0].strip() for x in accept_encoding.split(",")]:
+        return "br"
+    if "gzip" in accept_encoding:
+        return "gzip"
+    return None
+
+
+def _compress(data, encoding, level):
+    """Compress a bytestring in its entirety."""
+    if encoding == "br":
+        return brotli.compress(data, quality=level)
+    buffer = BytesIO()
+    gzipped = gzip.GzipFile(mode="wb", fileobj=buffer, compresslevel=level)
+    gzipped.write(data)
+    gzipped.close()
+    return buffer.getvalue()
+
+
+def _compress_stream(chunks, encoding, level):
+    """Compress a sequence of bytestrings, yielding compressed data as
+    it becomes available.
+    """
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=level)
+        compress, flush = compressor.process, compressor.finish
+    else:
+        # The extra 16 tells zlib to write a gzip header and trailer.
+        compressor = zlib.compressobj(level, wbits=16 + zlib.MAX_WBITS)
+        compress, flush = compressor.compress, compressor.flush
+    for chunk in chunks:
+        compressed = compress(chunk)
+        if compressed:
+            yield compressed
+    yield flush()
+
+
+def _store_when_complete(chunks, key):
+    """Pass through a sequence of compressed bytestrings, storing the
+    complete representation once the last one has been sent.
+    """
+    sent = []
+    for chunk in chunks:
+        sent.append(chunk)
+        yield chunk
+    compressed_representations.set(key, b"".join(sent))
+
+
 def require_admin_authentication(func):
     """Test authentication on the request.
     The request session should have previously authenticatated as an admin."""
@@ -5,7 +5,7 @@ from flask_babel import lazy_gettext as _
 from sqlalchemy.orm.exc import MultipleResultsFound, NoResultFound
 from sqlalchemy.orm.session import Session
 
-from model import Audience, CollectionSummary, Place, ServiceArea, get_one_or_create
+from model import Audience, CollectionSummary, Place, ServiceArea
 from problem_details import INVALID_INTEGRATION_DOCUMENT
 
 
@@ -210,18 +210,20 @@ class AuthenticationDocument:
                         # This is invalid -- you're supposed to always
                         # pass in a list -- but we can support it.
                         places = [places]
+                    # Look up all the places at once.
+                    found, ignore, ambiguously_named = nation_obj.lookup_many_inside(
+                        places
+                    )
                     for place in places:
-                        try:
-                            place_obj = nation_obj.lookup_inside(place)
-                            if place_obj:
-                                # We found it.
-                                place_objs.append(place_obj)
-                            else:
-                                # We couldn't find any place with this name.
-                                unknown[nation].append(place)
-                        except MultipleResultsFound:
+                        if place in found:
+                            # We found it.
+                            place_objs.append(found[place])
+                        elif place in ambiguously_named:
                             # The place was ambiguously named.
                             ambiguous[nation].append(place)
+                        else:
+                            # We couldn't find any place with this name.
+                            unknown[nation].append(place)
             except MultipleResultsFound:
                 # A nation was ambiguously named -- not very likely.
                 ambiguous[nation] = places
@@ -402,6 +404,7 @@ class AuthenticationDocument:
         # Delete any ServiceAreas associated with the given library
         # which are not mentioned in the list we just gathered.
         library.service_areas = service_areas
+        library.update_service_area_summary()
 
     @classmethod
     def _update_service_areas(cls, library, areas, type, service_areas):
@@ -442,11 +445,7 @@ class AuthenticationDocument:
                 )
             return INVALID_INTEGRATION_DOCUMENT.detailed(" ".join(msgs))
 
-        for place in places:
-            service_area, is_new = get_one_or_create(
-                _db, ServiceArea, library_id=library.id, place_id=place.id, type=type
-            )
-            service_areas.append(service_area)
+        service_areas.extend(ServiceArea.bulk_create(_db, library, places, type))
 
     def update_collection_size(self, library):
         return self._update_collection_size(library, self.collection_size)
@@ -0,0 +1,85 @@
+"""Measure the per-request cost of guessing a client's location from
+its IP address.
+
+Run from the top-level directory with:
+
+    python -m benchmarks.geoip
+
+This compares a lookup made directly against the GeoIP database with
+GeometryUtility.point_from_ip, which caches its results, for a stream
+of requests drawn from a limited number of client networks. Both open
+the database only once, so the difference comes from the cache alone.
+"""
+import argparse
+import random
+import timeit
+
+from geolite2 import geolite2
+
+from util import GeometryUtility
+
+
+def client_addresses(count, networks, seed=0):
+    """Generate IPv4 addresses as though `count` requests came from
+    clients on `networks` different /24 networks.
+    """
+    rng = random.Random(seed)
+    prefixes = [
+        "%d.%d.%d" % (rng.randint(1, 223), rng.randint(0, 255), rng.randint(0, 255))
+        for i in range(networks)
+    ]
+    return ["%s.%d" % (rng.choice(prefixes), rng.randint(1, 254)) for i in range(count)]
+
+
+def uncached_point_from_ip(ip_address):
+    """Look up an address the way point_from_ip did before it kept a
+    cache. geolite2.reader() opens the database the first time it's
+    called and returns the same reader after that.
+    """
+    reader = geolite2.reader()
+    if not ip_address:
+        return None
+    match = reader.get(ip_address)
+    if match is None or "location" not in match:
+        return None
+    latitude, longitude = (match["location"][x] for x in ("latitude", "longitude"))
+    return GeometryUtility.point(latitude, longitude)
+
+
+def run(lookup, addresses, repeat):
+    """Time `lookup` over every address, returning the best
+    per-request time in microseconds.
+    """
+
+    def requests():
+        for address in addresses:
+            lookup(address)
+
+    best = min(timeit.repeat(requests, number=1, repeat=repeat))
+    return best / len(addresses) * 1000000
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=100000)
+    parser.add_argument("--networks", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parsed = parser.parse_args(args)
+
+    addresses = client_addresses(parsed.requests, parsed.networks)
+
+    # Open both readers before timing anything.
+    uncached_point_from_ip(addresses[0])
+    GeometryUtility.geoip_reader()
+
+    before = run(uncached_point_from_ip, addresses, parsed.repeat)
+    GeometryUtility.IP_LOCATION_CACHE.clear()
+    after = run(GeometryUtility.point_from_ip, addresses, parsed.repeat)
+
+    print("Uncached lookup:  %.2f us/request" % before)
+    print("point_from_ip:    %.2f us/request" % after)
+    print("Cache: %r" % GeometryUtility.IP_LOCATION_CACHE.stats)
+
+
+if __name__ == "__main__":
+    main()
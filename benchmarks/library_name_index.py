@@ -0,0 +1,71 @@
+"""Measure how many library name searches one worker can answer per
+second from the in-memory LibraryNameIndex.
+
+Run from the top-level directory with:
+
+    python -m benchmarks.library_name_index
+
+This doesn't need a database: the index is built from generated
+library names, a few of which have aliases. Only the name matching is
+timed, not the database query that loads the matching libraries.
+"""
+import argparse
+import random
+import time
+import timeit
+
+from benchmarks.library_search import library_names
+from model import LibraryNameIndex
+
+
+def build_index(count, seed=0):
+    rng = random.Random(seed)
+    names = dict()
+    for library_id, name in enumerate(library_names(count, seed), 1):
+        library_names_ = [(name, False)]
+        if rng.random() < 0.2:
+            initials = "".join(word[0] for word in name.split())
+            library_names_.append((initials, True))
+        names[library_id] = library_names_
+    return LibraryNameIndex(names)
+
+
+def queries(index, count, seed=1):
+    """Choose some names from the index and introduce a typo into each
+    one, the way a patron might.
+    """
+    rng = random.Random(seed)
+    names = [names[0][0].lower() for names in index.names.values()]
+    result = []
+    for name in rng.sample(names, min(count, len(names))):
+        i = rng.randrange(len(name))
+        result.append(name[:i] + name[i + 1 :])
+    return result
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    parsed = parser.parse_args(args)
+
+    for size in parsed.sizes:
+        start = time.time()
+        index = build_index(size)
+        built = time.time() - start
+        searches = queries(index, parsed.queries)
+
+        def search():
+            for query in searches:
+                index.find(query)
+
+        best = min(timeit.repeat(search, number=1, repeat=parsed.repeat))
+        print(
+            "%6d libraries: built in %.2fs, %8.0f queries/second"
+            % (size, built, len(searches) / best)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Measure how long it takes to match a library name as the number of
+libraries grows.
+
+Run from the top-level directory with:
+
+    python -m benchmarks.library_search
+
+This needs the test database (SIMPLIFIED_TEST_DATABASE). Libraries are
+created inside a transaction that is rolled back at the end, so the
+database is left as it was found.
+
+This compares Library.fuzzy_match and Library.partial_match, which can
+use trigram indexes, with the Levenshtein-only clause fuzzy_match used
+before the indexes existed, at 1,000, 10,000 and 100,000 libraries.
+"""
+import argparse
+import random
+import string
+import timeit
+
+from sqlalchemy import func, or_, select
+
+from config import Configuration
+from model import Library, SessionManager
+
+WORDS = [
+    "public",
+    "county",
+    "regional",
+    "memorial",
+    "free",
+    "city",
+    "township",
+    "district",
+    "community",
+    "university",
+]
+
+
+def library_names(count, seed=0):
+    """Generate plausible library names, such as "Qoravel Memorial
+    Library".
+    """
+    rng = random.Random(seed)
+    for i in range(count):
+        place = "".join(rng.choice(string.ascii_lowercase) for i in range(7))
+        yield "%s %s Library" % (place.capitalize(), rng.choice(WORDS).capitalize())
+
+
+def levenshtein_match(field, value):
+    """Match a field the way Library.fuzzy_match did before it used a
+    trigram index.
+    """
+    is_long = func.length(field) >= 6
+    close_enough = func.levenshtein(func.lower(field), value) <= 2
+    return or_(is_long & close_enough, field.ilike(value))
+
+
+def add_libraries(connection, names):
+    connection.execute(
+        Library.__table__.insert(),
+        [dict(name=name, description="Serving %s." % name) for name in names],
+    )
+    connection.execute("ANALYZE libraries")
+
+
+def run(connection, clause, queries, repeat):
+    """Time a search for each query, returning the best per-query time
+    in milliseconds.
+    """
+
+    def search():
+        for query in queries:
+            connection.execute(select([Library.id]).where(clause(query))).fetchall()
+
+    best = min(timeit.repeat(search, number=1, repeat=repeat))
+    return best / len(queries) * 1000
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3)
+    parsed = parser.parse_args(args)
+
+    url = Configuration.database_url(test=True)
+    engine, connection = SessionManager.initialize(url, testing=True)
+    transaction = connection.begin()
+
+    names = list(library_names(max(parsed.sizes)))
+    rng = random.Random(1)
+    clauses = [
+        ("Levenshtein only", lambda q: levenshtein_match(Library.name, q)),
+        ("fuzzy_match", lambda q: Library.fuzzy_match(Library.name, q)),
+        ("partial_match", lambda q: Library.partial_match(Library.name, q.split()[0])),
+    ]
+    try:
+        loaded = 0
+        for size in sorted(parsed.sizes):
+            add_libraries(connection, names[loaded:size])
+            loaded = size
+
+            # Search for existing names with a typo in them.
+            queries = []
+            for name in rng.sample(names[:size], parsed.queries):
+                name = name.lower()
+                i = rng.randrange(len(name))
+                queries.append(name[:i] + name[i + 1 :])
+
+            print("%d libraries:" % size)
+            for label, clause in clauses:
+                print(
+                    "  %-17s %8.2f ms/query"
+                    % (label + ":", run(connection, clause, queries, parsed.repeat))
+                )
+    finally:
+        transaction.rollback()
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
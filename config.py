@@ -81,10 +81,28 @@ class Configuration:
     # The name of the sitewide secret used for admin login.
     SECRET_KEY = "secret_key"
 
+    # When places were last loaded into the database. This is set by
+    # the script that loads places, so that other processes can tell
+    # that anything they've worked out from the old places is stale.
+    PLACES_LOADED_AT = "places_loaded_at"
+
     # AWS credentials
     AWS_S3_BUCKET_NAME = "SIMPLIFIED_AWS_S3_BUCKET_NAME"
     AWS_S3_ENDPOINT_URL = "SIMPLIFIED_AWS_S3_ENDPOINT_URL"
 
+    # Environment variables that control how hard we try to compress
+    # responses: 1-9 for gzip, 0-11 for brotli. Responses are
+    # compressed while the client waits, so brotli's default quality
+    # is kept low: quality 5 generally compresses at least as well
+    # as gzip at level 9, at a small fraction of the cost of quality
+    # 11.
+    GZIP_COMPRESSION_LEVEL = "SIMPLIFIED_GZIP_COMPRESSION_LEVEL"
+    BROTLI_COMPRESSION_LEVEL = "SIMPLIFIED_BROTLI_COMPRESSION_LEVEL"
+    DEFAULT_COMPRESSION_LEVELS = {
+        GZIP_COMPRESSION_LEVEL: 9,
+        BROTLI_COMPRESSION_LEVEL: 5,
+    }
+
     @classmethod
     def database_url(cls, test=False):
         """Find the URL to the database so that other configuration
@@ -109,6 +127,15 @@ class Configuration:
 
         :return: a 3-tuple (vendor ID, node value, [delegates])
         """
+        from model import ConfigurationSetting
+
+        return ConfigurationSetting.cached(
+            _db, cls.ADOBE_VENDOR_ID, lambda: cls._vendor_id(_db)
+        )
+
+    @classmethod
+    def _vendor_id(cls, _db):
+        """Look up the Adobe Vendor ID configuration in the database."""
         from model import ExternalIntegration
 
         integration = ExternalIntegration.lookup(
@@ -132,6 +159,25 @@ class Configuration:
             delegates,
         )
 
+    @classmethod
+    def compression_level(cls, environment_variable):
+        """Find the compression level to use for an encoding.
+
+        :param environment_variable: Either GZIP_COMPRESSION_LEVEL or
+            BROTLI_COMPRESSION_LEVEL.
+        :return: An integer.
+        """
+        value = os.environ.get(environment_variable)
+        if not value:
+            return cls.DEFAULT_COMPRESSION_LEVELS[environment_variable]
+        try:
+            return int(value)
+        except ValueError:
+            raise CannotLoadConfiguration(
+                "Compression level in environment variable (%s) is not an integer: %s"
+                % (environment_variable, value)
+            )
+
     @classmethod
     def aws_config(cls) -> "AWSConfig":
         """Return the AWS configurations setup in the environment"""
@@ -20,10 +20,12 @@ from config import CannotLoadConfiguration, CannotSendEmail, Configuration
 from emailer import Emailer
 from model import (
     Admin,
+    ChangeCounter,
     ConfigurationSetting,
     Hyperlink,
     Library,
     Place,
+    PlaceAlias,
     Resource,
     ServiceArea,
     Validation,
@@ -31,18 +33,25 @@ from model import (
     get_one_or_create,
     production_session,
 )
-from opds import Annotator, OPDSCatalog
+from opds import Annotator, OPDSCatalog, SerializedCatalog
 from problem_details import (
     AUTHENTICATION_FAILURE,
     INTEGRATION_ERROR,
     INVALID_CONTACT_URI,
     INVALID_CREDENTIALS,
+    INVALID_PAGINATION,
     LIBRARY_NOT_FOUND,
     NO_AUTH_URL,
     UNABLE_TO_NOTIFY,
 )
 from registrar import LibraryRegistrar
-from util.app_server import ApplicationVersionController, catalog_response
+from util.app_server import (
+    ApplicationVersionController,
+    FeedVersion,
+    catalog_response,
+    not_modified_response,
+)
+from util.cache import LRUCache
 from util.http import HTTP
 from util.problem_detail import ProblemDetail
 from util.string_helpers import base64, random_string
@@ -174,9 +183,22 @@ class LibraryRegistryController(BaseController):
    <Url type="application/atom+xml;profile=opds-catalog" template="%(url_template)s"/>
  </OpenSearchDescription>"""
 
+    # The feeds of all libraries are built once for each version of
+    # their contents, and then served from memory. A version that's
+    # been replaced is dropped once it gets this old.
+    LIBRARIES_FEED_MAX_AGE = 300
+
+    # The default and maximum number of libraries on one page of a
+    # paginated libraries feed.
+    LIBRARIES_PAGE_SIZE = 100
+    MAX_LIBRARIES_PAGE_SIZE = 1000
+
     def __init__(self, app, emailer_class=Emailer):
         super().__init__(app)
         self.annotator = LibraryRegistryAnnotator(app)
+        self.libraries_feed_cache = LRUCache(
+            max_size=4, max_age=self.LIBRARIES_FEED_MAX_AGE
+        )
         self.log = self.app.log
         emailer = None
         try:
@@ -188,9 +210,48 @@ class LibraryRegistryController(BaseController):
             )
         self.emailer = emailer
 
+    def contents_version(self, live=True, library=None):
+        """Identify the current version of the libraries that go into an
+        OPDS feed, whatever URL the feed is served from.
+
+        :param live: If this is True, the feed only contains production
+            libraries.
+        :param library: If this is set, the feed only contains this library.
+        :return: A FeedVersion.
+        """
+        count, last_modified = Library.feed_version(
+            self._db, production=live, library=library
+        )
+        # These settings change the contents of every feed.
+        settings = [
+            ConfigurationSetting.sitewide_value(self._db, key)
+            for key in (Configuration.WEB_CLIENT_URL, Configuration.LARGE_FEED_SIZE)
+        ]
+        vendor_id, ignore, ignore = Configuration.vendor_id(self._db)
+        return FeedVersion(last_modified, live, count, vendor_id, *settings)
+
+    def feed_version(self, live=True, library=None, *extra):
+        """Identify the current version of an OPDS feed of libraries,
+        without building the feed.
+
+        :param live: If this is True, the feed only contains production
+            libraries.
+        :param library: If this is set, the feed only contains this library.
+        :param extra: Any other values (e.g. the client's location) that
+            affect which libraries are in the feed.
+        :return: A FeedVersion.
+        """
+        return self.contents_version(live, library).extend(request.url, *extra)
+
     def nearby(self, location, live=True):
-        qu = Library.nearby(self._db, location, production=live)
-        qu = qu.limit(5)
+        contents = self.contents_version(live)
+        version = contents.extend(request.url, location).undated()
+        if version.not_modified():
+            return not_modified_response(version)
+        qu = Library.cached_nearby(
+            self._db, location, 5, production=live, version=contents.etag
+        )
+        qu = qu.options(*Library.catalog_loading_options())
         if live:
             nearby_controller = "nearby"
         else:
@@ -203,8 +264,9 @@ class LibraryRegistryController(BaseController):
             qu,
             annotator=self.annotator,
             live=live,
+            stream=True,
         )
-        return catalog_response(catalog)
+        return catalog_response(catalog, version=version)
 
     def search(self, location, live=True):
         query = request.args.get("q")
@@ -213,8 +275,21 @@ class LibraryRegistryController(BaseController):
         else:
             search_controller = "search_qa"
         if query:
-            # Run the query and send the results.
-            results = Library.search(self._db, location, query, production=live)
+            contents = self.contents_version(live)
+            version = contents.extend(request.url, location, query).undated()
+            if version.not_modified():
+                return not_modified_response(version)
+
+            # Run the query and send the results. They're cached under
+            # the version of the feed's contents, so they're never
+            # older than the ETag they're sent with.
+            results = Library.cached_search(
+                self._db, location, query, production=live, version=contents.etag
+            )
+            self.log.debug(
+                "Search cache: %(size)d entries, %(hits)d hits, %(misses)d misses",
+                Library.SEARCH_CACHE.stats,
+            )
 
             this_url = self.app.url_for(search_controller, q=query)
             catalog = OPDSCatalog(
@@ -224,8 +299,9 @@ class LibraryRegistryController(BaseController):
                 results,
                 annotator=self.annotator,
                 live=live,
+                stream=True,
             )
-            return catalog_response(catalog)
+            return catalog_response(catalog, version=version)
         else:
             # Send the search form.
             body = self.OPENSEARCH_TEMPLATE % dict(
@@ -293,6 +369,128 @@ class LibraryRegistryController(BaseController):
         :param location: If this is set, then libraries near this point will be
            promoted out of the alphabetical list.
         """
+        if "after" in request.args or "size" in request.args:
+            # The client wants one page of the list.
+            return self.libraries_opds_page(live)
+
+        # If the client already has the current version of the feed,
+        # there's no need to build it. A feed that depends on the
+        # client's location can only be checked by its ETag.
+        contents = self.contents_version(live)
+        version = contents.extend(request.url, location)
+        if location is not None:
+            version = version.undated()
+        if version.not_modified():
+            return not_modified_response(version)
+
+        feed = self.libraries_feed(live, contents)
+        if location is None:
+            # No location data is available. Serve the alphabetical
+            # list as-is.
+            return catalog_response(feed.data, version=version)
+
+        # Location data is available. Get the list of nearby
+        # libraries and put them in front of the alphabetical list.
+        a = time.time()
+        nearby_libraries = (
+            Library.cached_nearby(
+                self._db, location, 5, production=live, version=contents.etag
+            )
+            .options(*Library.catalog_loading_options())
+            .all()
+        )
+        b = time.time()
+        self.log.info(f"Fetched libraries near {location} in {b - a:.2f}sec")
+        return catalog_response(feed.chunks(first=nearby_libraries), version=version)
+
+    def libraries_opds_page(self, live=True):
+        """Return one page of the alphabetical list of libraries in OPDS
+        format.
+
+        The page is controlled by two query parameters: `size`, the
+        number of libraries on the page, and `after`, the name and ID
+        (separated by a comma) of the last library on the previous
+        page. If there are more libraries, the page links to the next
+        page.
+
+        :param live: If this is True, then only production libraries are shown.
+        """
+        size = request.args.get("size", self.LIBRARIES_PAGE_SIZE)
+        after = request.args.get("after")
+        try:
+            size = int(size)
+            if size < 1:
+                raise ValueError()
+            size = min(size, self.MAX_LIBRARIES_PAGE_SIZE)
+            if after:
+                # Library names may contain commas, but IDs can't.
+                name, library_id = after.rsplit(",", 1)
+                after = (name, int(library_id))
+        except ValueError:
+            return INVALID_PAGINATION.detailed(
+                _(
+                    "size must be a positive integer, and after must look like 'name,id'."
+                )
+            )
+
+        version = self.feed_version(live)
+        if version.not_modified():
+            return not_modified_response(version)
+
+        # Ask for one extra library, to find out whether there's
+        # another page after this one.
+        qu = Library.feed_page(self._db, production=live, after=after, size=size + 1)
+        qu = qu.options(*Library.catalog_loading_options())
+        libraries = qu.all()
+        libraries, next_libraries = libraries[:size], libraries[size:]
+
+        if live:
+            route = "libraries_opds"
+        else:
+            route = "libraries_qa"
+        kwargs = dict(size=size)
+        if after:
+            kwargs["after"] = "%s,%d" % after
+        catalog = OPDSCatalog(
+            self._db,
+            "Libraries",
+            self.app.url_for(route, **kwargs),
+            libraries,
+            annotator=self.annotator,
+            live=live,
+            stream=True,
+        )
+        if next_libraries:
+            last = libraries[-1]
+            catalog.add_link_to_catalog(
+                catalog.catalog,
+                rel="next",
+                href=self.app.url_for(
+                    route, size=size, after="%s,%d" % (last.name, last.id)
+                ),
+                type=OPDSCatalog.OPDS_TYPE,
+            )
+        return catalog_response(catalog, version=version)
+
+    def libraries_feed(self, live=True, version=None):
+        """Find or build the alphabetical OPDS feed of all libraries.
+
+        :param live: If this is True, then only production libraries are shown.
+        :param version: The FeedVersion returned by contents_version()
+            for this feed. The feed is cached under this version, so a
+            feed sent with an ETag made from the version is never older
+            than the version.
+        :return: A SerializedCatalog.
+        """
+        if version is None:
+            version = self.contents_version(live)
+        url = self.app.url_for("libraries_opds")
+        key = (url, version.etag)
+        return self.libraries_feed_cache.get_or_set(
+            key, lambda: self._build_libraries_feed(live, url)
+        )
+
+    def _build_libraries_feed(self, live, url):
         alphabetical = self._db.query(Library).order_by(Library.name)
 
         # We always want to filter out cancelled libraries.  If live, we also filter out
@@ -302,52 +500,32 @@ class LibraryRegistryController(BaseController):
         # Pick up each library's hyperlinks and validation
         # information; this will save database queries when building
         # the feed.
-        alphabetical = alphabetical.options(
-            joinedload("hyperlinks"),
-            joinedload("hyperlinks", "resource"),
-            joinedload("hyperlinks", "resource", "validation"),
-        )
+        alphabetical = alphabetical.options(*Library.catalog_loading_options())
         alphabetical = alphabetical.options(defer("logo"))
-        if location is None:
-            # No location data is available. Use the alphabetical list as
-            # the list of libraries.
-            a = time.time()
-            libraries = alphabetical.all()
-            b = time.time()
-            self.log.info(
-                "Built alphabetical list of all libraries in %.2fsec" % (b - a)
-            )
-        else:
-            # Location data is available. Get the list of nearby libraries, then get
-            # the rest of the list in alphabetical order.
-
-            # We can't easily do the joindeload() thing for this
-            # query, because it doesn't simply return Library objects,
-            # but it won't return more than five results.
-            a = time.time()
-            nearby_libraries = (
-                Library.nearby(self._db, location, production=live).limit(5).all()
-            )
-            b = time.time()
-            self.log.info(f"Fetched libraries near {location} in {b - a:.2f}sec")
-
-            # Exclude nearby libraries from the alphabetical query
-            # to get a list of faraway libraries.
-            faraway_libraries = alphabetical.filter(
-                ~Library.id.in_([x.id for x, distance in nearby_libraries])
-            )
-            c = time.time()
-            libraries = nearby_libraries + faraway_libraries.all()
-            self.log.info(f"Fetched libraries far from {location} in {c - b:.2f}sec")
-
-        url = self.app.url_for("libraries_opds")
         a = time.time()
+        libraries = alphabetical.all()
+        b = time.time()
+        self.log.info("Built alphabetical list of all libraries in %.2fsec" % (b - a))
+
+        # Each library's entry is serialized as soon as it's built, so
+        # the whole catalog never has to be in memory as a dictionary.
         catalog = OPDSCatalog(
-            self._db, "Libraries", url, libraries, annotator=self.annotator, live=live
+            self._db,
+            "Libraries",
+            url,
+            libraries,
+            annotator=self.annotator,
+            live=live,
+            stream=True,
         )
-        b = time.time()
-        self.log.info("Built library catalog in %.2fsec" % (b - a))
-        return catalog_response(catalog)
+        feed = SerializedCatalog(catalog)
+        c = time.time()
+        self.log.info("Built library catalog in %.2fsec" % (c - b))
+        self.log.info(
+            "Library entry cache: %(size)d entries, %(hits)d hits, %(misses)d misses"
+            % OPDSCatalog.FRAGMENT_CACHE.stats
+        )
+        return feed
 
     def library_details(self, uuid, library=None, patron_count=None):
         """Return complete information about one specific library.
@@ -550,6 +728,9 @@ class LibraryRegistryController(BaseController):
 
     def library(self):
         library = request.library
+        version = self.feed_version(False, library)
+        if version.not_modified():
+            return not_modified_response(version)
         this_url = self.app.url_for("library", uuid=library.internal_urn)
         catalog = OPDSCatalog(
             self._db,
@@ -559,7 +740,7 @@ class LibraryRegistryController(BaseController):
             annotator=self.annotator,
             live=False,
         )
-        return catalog_response(catalog)
+        return catalog_response(catalog, version=version)
 
     def render(self):
         response = Response(render_template_string(admin_template))
@@ -577,9 +758,9 @@ class LibraryRegistryController(BaseController):
 
         # The terms of service may be encapsulated in a link to
         # a web page.
-        terms_of_service_url = ConfigurationSetting.sitewide(
+        terms_of_service_url = ConfigurationSetting.sitewide_value(
             self._db, Configuration.REGISTRATION_TERMS_OF_SERVICE_URL
-        ).value
+        )
         type = "text/html"
         rel = "terms-of-service"
         if terms_of_service_url:
@@ -592,9 +773,9 @@ class LibraryRegistryController(BaseController):
 
         # And/or the terms of service may be described in
         # human-readable HTML, which we'll present as a data: link.
-        terms_of_service_html = ConfigurationSetting.sitewide(
+        terms_of_service_html = ConfigurationSetting.sitewide_value(
             self._db, Configuration.REGISTRATION_TERMS_OF_SERVICE_HTML
-        ).value
+        )
         if terms_of_service_html:
             encoded = base64.b64encode(terms_of_service_html)
             terms_of_service_link = f"data:{type};base64,{encoded}"
@@ -899,6 +1080,31 @@ class CoverageController(BaseController):
     so they can be visualized.
     """
 
+    # The GeoJSON for a coverage document is kept in memory until this
+    # process changes one of these classes. (The default nation is a
+    # ConfigurationSetting.)
+    COVERAGE_DEPENDENCIES = (Place, PlaceAlias, ConfigurationSetting)
+
+    # Places loaded by another process (such as a script) are picked
+    # up right away, since the documents are also cached for each
+    # version of the places in the database. Other changes made by
+    # another process are picked up when a cached document gets this
+    # old.
+    COVERAGE_CACHE_MAX_AGE = 3600
+
+    # A document covering a state or a nation can be several megabytes,
+    # so the cache is limited by the total size of its documents, in
+    # bytes, rather than by their number.
+    COVERAGE_CACHE_SIZE = 64 * 1024 * 1024
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.coverage_cache = LRUCache(
+            max_size=self.COVERAGE_CACHE_SIZE,
+            max_age=self.COVERAGE_CACHE_MAX_AGE,
+            sizeof=len,
+        )
+
     def geojson_response(self, document):
         if isinstance(document, dict):
             document = json.dumps(document)
@@ -911,19 +1117,42 @@ class CoverageController(BaseController):
             coverage = json.loads(coverage)
         except ValueError:
             pass
+
+        # Coverage documents that differ only in formatting or in the
+        # order of their keys are the same document.
+        key = (
+            json.dumps(coverage, sort_keys=True, separators=(",", ":")),
+            Place.loaded_version(self._db),
+            ChangeCounter.count(*self.COVERAGE_DEPENDENCIES),
+        )
+        document = self.coverage_cache.get(key)
+        if document is None:
+            document = self._coverage_geojson(coverage)
+
+            # GeoJSON built from changes this request hasn't committed
+            # can't be shared with other requests.
+            if not ChangeCounter.has_uncommitted_changes(
+                self._db, *self.COVERAGE_DEPENDENCIES
+            ):
+                self.coverage_cache.set(key, document)
+        return self.geojson_response(document)
+
+    def _coverage_geojson(self, coverage):
+        """Convert a coverage object to a serialized GeoJSON document."""
         places, unknown, ambiguous = AuthenticationDocument.parse_coverage(
             self._db, coverage
         )
-        document = Place.to_geojson(self._db, *places)
 
         # Extend the GeoJSON with extra information about parts of the
         # coverage document we found ambiguous or couldn't associate
         # with a Place.
+        extensions = dict()
         if unknown:
-            document["unknown"] = unknown
+            extensions["unknown"] = unknown
         if ambiguous:
-            document["ambiguous"] = ambiguous
-        return self.geojson_response(document)
+            extensions["ambiguous"] = ambiguous
+        document = Place.geojson_document(self._db, *places, **extensions)
+        return document.encode("utf8")
 
     def _geojson_for_service_area(self, service_type):
         """Serve a GeoJSON document describing some subset of the active
@@ -932,7 +1161,7 @@ class CoverageController(BaseController):
         areas = [
             x.place for x in request.library.service_areas if x.type == service_type
         ]
-        return self.geojson_response(Place.to_geojson(self._db, *areas))
+        return self.geojson_response(Place.geojson_document(self._db, *areas))
 
     def eligibility_for_library(self):
         """Serve a GeoJSON document representing the eligibility area
@@ -13,9 +13,11 @@ psql -v ON_ERROR_STOP=1 --username="$POSTGRES_USER" --dbname "$POSTGRES_DB" <<-E
 
     \c simplified_registry_dev
     CREATE EXTENSION fuzzystrmatch;
+    CREATE EXTENSION pg_trgm;
     CREATE EXTENSION postgis;
 
     \c simplified_registry_test
     CREATE EXTENSION fuzzystrmatch;
+    CREATE EXTENSION pg_trgm;
     CREATE EXTENSION postgis;
 EOSQL
@@ -53,6 +53,8 @@ class GeometryLoader:
         # changed.
         place.external_name = name
         place.abbreviated_name = abbreviated_name
+        # Changing the geometry also has the database recalculate the
+        # simplified geometries when the place is flushed.
         place.geometry = geometry
 
         # We only ever add aliases. If the database contains an alias
@@ -1,11 +1,14 @@
 from __future__ import annotations
 
+import bisect
 import datetime
 import json
 import logging
 import random
 import re
 import string
+import threading
+import time
 import uuid
 import warnings
 from collections import Counter, defaultdict
@@ -17,6 +20,7 @@ from flask_bcrypt import check_password_hash, generate_password_hash
 from geoalchemy2 import Geography, Geometry
 from psycopg2.extensions import adapt as sqlescape
 from sqlalchemy import (
+    DDL,
     Boolean,
     Column,
     DateTime,
@@ -29,13 +33,24 @@ from sqlalchemy import (
     Unicode,
     UniqueConstraint,
     create_engine,
+    event,
 )
 from sqlalchemy import exc as sa_exc
-from sqlalchemy import func
+from sqlalchemy import func, inspect
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy.orm import aliased, backref, relationship, sessionmaker, validates
+from sqlalchemy.orm import (
+    aliased,
+    backref,
+    deferred,
+    lazyload,
+    relationship,
+    selectinload,
+    sessionmaker,
+    validates,
+)
 from sqlalchemy.orm.exc import MultipleResultsFound, NoResultFound
 from sqlalchemy.orm.session import Session
 from sqlalchemy.sql import compiler
@@ -44,16 +59,22 @@ from sqlalchemy.sql.expression import (
     case,
     cast,
     join,
+    literal,
     literal_column,
     or_,
     outerjoin,
     select,
+    tuple_,
+    type_coerce,
+    union,
+    union_all,
 )
 
 from config import Configuration
 from db_migration import migrate
 from emailer import Emailer
 from util import GeometryUtility
+from util.cache import LRUCache
 from util.language import LanguageCodes
 from util.short_client_token import ShortClientTokenTool
 from util.string_helpers import random_string
@@ -95,7 +116,22 @@ class SessionManager:
     @classmethod
     def engine(cls, url=None):
         url = url or Configuration.database_url()
-        return create_engine(url, echo=DEBUG)
+        engine = create_engine(url, echo=DEBUG)
+        event.listen(engine, "connect", cls.configure_connection)
+        return engine
+
+    @classmethod
+    def configure_connection(cls, dbapi_connection, connection_record):
+        """Apply settings that every database connection needs."""
+        autocommit = dbapi_connection.autocommit
+        dbapi_connection.autocommit = True
+        cursor = dbapi_connection.cursor()
+        cursor.execute(
+            "SET pg_trgm.similarity_threshold = %s",
+            (Library.FUZZY_MATCH_SIMILARITY_THRESHOLD,),
+        )
+        cursor.close()
+        dbapi_connection.autocommit = autocommit
 
     @classmethod
     def sessionmaker(cls, url=None):
@@ -207,8 +243,155 @@ def create(db, model, create_method="", create_method_kwargs=None, **kwargs):
     return created, True
 
 
+class ChangeCounter:
+    """Keep track of how many times rows of each mapped class have
+    been changed by this process.
+
+    Anything that caches information derived from the database can
+    remember the counts for the classes it depends on, and treat its
+    cached information as stale once any of those counts goes up.
+
+    Only changes made through a Session in this process are counted,
+    so caches that must eventually notice changes made by other
+    processes should also put a limit on the age of their entries.
+    """
+
+    _counts = Counter()
+    _lock = threading.Lock()
+
+    @classmethod
+    def count(cls, *models):
+        """How many times have rows of these classes changed?
+
+        :return: A tuple containing one count for each class, suitable
+            for comparing against a tuple obtained earlier.
+        """
+        return tuple(cls._counts[model] for model in models)
+
+    @classmethod
+    def increment(cls, *models):
+        with cls._lock:
+            for model in models:
+                cls._counts[model] += 1
+
+    @classmethod
+    def note_changes(cls, session, *models):
+        """Count changes made through `session` to rows of these
+        classes.
+
+        This is done automatically when a session is flushed, but
+        changes made with a bulk INSERT or UPDATE have to be counted
+        explicitly.
+        """
+        session.info.setdefault("changed_models", set()).update(models)
+        cls.increment(*models)
+
+    @classmethod
+    def has_uncommitted_changes(cls, session, *models):
+        """Has this session changed rows of any of these classes without
+        committing the changes?
+
+        Such changes aren't visible to other sessions, so anything
+        calculated from them shouldn't be shared.
+        """
+        changed = set(session.info.get("changed_models", ()))
+        changed.update(
+            type(obj)
+            for obj in list(session.new) + list(session.dirty) + list(session.deleted)
+        )
+        return any(model in changed for model in models)
+
+
+@event.listens_for(Session, "after_flush")
+def _count_flushed_changes(session, flush_context):
+    """Note which classes were changed by a flush.
+
+    The changes are counted immediately, since they're now visible to
+    anyone using this session, and counted again when the transaction
+    is committed or rolled back, since at that point they become
+    visible to everyone or disappear.
+    """
+    changed = {
+        type(obj)
+        for obj in list(session.new) + list(session.dirty) + list(session.deleted)
+    }
+    ChangeCounter.note_changes(session, *changed)
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _count_finished_changes(session):
+    ChangeCounter.increment(*session.info.pop("changed_models", ()))
+
+
+@event.listens_for(Session, "before_flush")
+def _touch_changed_libraries(session, flush_context, instances):
+    """Update the timestamp of any Library whose OPDS entry will look
+    different because of a change to one of its related objects.
+
+    Library.timestamp is updated automatically when one of the
+    library's own fields changes, but not when (e.g.) one of its
+    Hyperlinks is validated. Keeping the timestamp up to date means it
+    can be used to tell whether a library's entry needs to be rebuilt,
+    or whether it needs to be reindexed by LibraryNameIndex.
+    """
+    libraries = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (Hyperlink, LibraryAlias, ServiceArea)):
+            libraries.add(obj.library)
+        elif isinstance(obj, (Resource, Validation)):
+            resource = obj if isinstance(obj, Resource) else obj.resource
+            if resource:
+                libraries.update(hyperlink.library for hyperlink in resource.hyperlinks)
+    now = datetime.datetime.utcnow()
+    for library in libraries:
+        if library is None or library in session.new or library in session.deleted:
+            continue
+        library.timestamp = now
+
+
+@event.listens_for(Session, "before_flush")
+def _update_service_area_summaries(session, flush_context, instances):
+    """Keep each Library's summary of its service area up to date
+    as its ServiceAreas change.
+    """
+    libraries = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, ServiceArea):
+            # A ServiceArea that was moved from one library to another
+            # (or to no library) changes both libraries.
+            history = inspect(obj).attrs.library.history
+            libraries.update(history.added or [obj.library])
+            libraries.update(history.deleted or [])
+            if obj in session.deleted and obj.library is not None:
+                # A deleted ServiceArea stays in its library's
+                # collection until the library is expired.
+                obj.library.service_areas.remove(obj)
+    for library in libraries:
+        if library is not None and library not in session.deleted:
+            library.update_service_area_summary()
+
+
 Base = declarative_base()
 
+# Library.fuzzy_match and Library.partial_match use trigram indexes,
+# which need the pg_trgm extension.
+event.listen(
+    Base.metadata, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+)
+
+
+def trigram_index(column):
+    """Create a GIN index that supports similarity (%) and ILIKE
+    comparisons against a text column.
+    """
+    return Index(
+        f"ix_{column.table.name}_{column.name}_trgm",
+        column,
+        postgresql_using="gin",
+        postgresql_ops={column.name: "gin_trgm_ops"},
+    )
+
 
 class LibraryType:
     """Constant container for library types.
@@ -306,6 +489,14 @@ class Library(Base):
     # The library's logo, as a web url
     logo_url = Column(Unicode)
 
+    # A short description of the library's service area, e.g. "Kern
+    # County, CA", and the type of library that serving that area
+    # makes it (one of the LibraryType constants). These are derived
+    # from the library's ServiceAreas whenever they change, so that
+    # they don't have to be worked out every time the library is shown.
+    service_area_name = Column(Unicode)
+    library_type = Column(Unicode)
+
     # Constants for determining which stage a library is in.
     #
     # Which stage the library is actually in depends on the
@@ -536,12 +727,8 @@ class Library(Base):
 
         :yield: A sequence of code constants from LibraryTypes.
         """
-        service_area = self.service_area
-        if not service_area:
-            return
-        code = service_area.library_type
-        if code:
-            yield code
+        if self.library_type:
+            yield self.library_type
 
         # TODO: in the future, more types, e.g. audience-based, can go
         # here.
@@ -585,25 +772,22 @@ class Library(Base):
         # This library does not have one ServiceArea that stands out.
         return None
 
-    @property
-    def service_area_name(self):
-        """Describe the library's service area in a short string a human would
-        understand, e.g. "Kern County, CA".
+    def update_service_area_summary(self):
+        """Recalculate service_area_name and library_type from the
+        library's ServiceAreas.
 
         This library does the best it can to express a library's service
         area as the name of a single place, but it's not always possible
-        since libraries can have multiple service areas.
-
-        TODO: We'll want to fetch a library's ServiceAreas (and their
-        Places) as part of the query that fetches libraries, so that
-        this doesn't result in extra DB queries per library.
-
-        :return: A string, or None if the library's service area can't be
-           described as a short string.
+        since libraries can have multiple service areas. In that case
+        service_area_name and library_type are both None.
         """
-        if self.service_area:
-            return self.service_area.human_friendly_name
-        return None
+        service_area = self.service_area
+        if service_area:
+            self.service_area_name = service_area.human_friendly_name
+            self.library_type = service_area.library_type
+        else:
+            self.service_area_name = None
+            self.library_type = None
 
     @classmethod
     def _feed_restriction(cls, production, library_field=None, registry_field=None):
@@ -638,6 +822,79 @@ class Library(Base):
                 library_field.in_((prod, test)), registry_field.in_((prod, test))
             )
 
+    @classmethod
+    def feed_version(cls, _db, production=True, library=None):
+        """Summarize the state of the libraries that would go into a feed,
+        in a way that changes whenever the feed would change.
+
+        :param production: If True, only libraries that are ready for
+            production are considered.
+        :param library: If this is set, only this library is considered,
+            whatever stage it's in.
+
+        :return: A 2-tuple (number of libraries, last modified). The
+            last modified time is a datetime, or None if there are
+            no libraries. It's the last time any library changed,
+            including one that has since left the feed, so a feed
+            only changes when its last modified time does.
+        """
+        if library:
+            qu = _db.query(func.count(Library.id), func.max(Library.timestamp))
+            qu = qu.filter(Library.id == library.id)
+        else:
+            in_feed = func.count(Library.id).filter(cls._feed_restriction(production))
+            qu = _db.query(in_feed, func.max(Library.timestamp))
+        count, last_modified = qu.one()
+
+        # A Validation can expire without anything being written to the
+        # database, but that changes how it's shown in the feed.
+        last_expiration = Validation.last_expiration(_db)
+        if last_expiration and (not last_modified or last_expiration > last_modified):
+            last_modified = last_expiration
+        return count, last_modified
+
+    @classmethod
+    def catalog_loading_options(cls):
+        """Query options that load everything needed to build the OPDS
+        entries for a list of libraries, in a constant number of
+        queries however many libraries there are.
+
+        Each relationship is loaded with a separate SELECT ... IN
+        query, so these options can be used on queries that are
+        grouped or limited. A library's service area is summarized in
+        its own columns, so its ServiceAreas and Places don't need to
+        be loaded at all.
+
+        :return: A list of options for Query.options().
+        """
+        return [
+            selectinload("hyperlinks").joinedload("resource").joinedload("validation"),
+        ]
+
+    @classmethod
+    def feed_page(cls, _db, production=True, after=None, size=100):
+        """Find one page of the alphabetical list of libraries in a feed.
+
+        Libraries are ordered by name, then by ID, so that libraries with
+        the same name always come out in the same order. A library that
+        doesn't have a name yet can't be placed in this order, so it's
+        left out.
+
+        :param production: If True, only libraries that are ready for
+            production are included.
+        :param after: A 2-tuple (name, ID). If this is set, the page
+            starts with the first library that comes after this one.
+        :param size: The maximum number of libraries on the page.
+
+        :return: A Query.
+        """
+        qu = _db.query(Library).filter(cls._feed_restriction(production))
+        qu = qu.filter(Library.name != None)
+        if after:
+            name, library_id = after
+            qu = qu.filter(tuple_(Library.name, Library.id) > tuple_(name, library_id))
+        return qu.order_by(Library.name, Library.id).limit(size)
+
     @classmethod
     def relevant(cls, _db, target, language, audiences=None, production=True):
         """Find libraries that are most relevant for a user.
@@ -779,7 +1036,13 @@ class Library(Base):
         # Create a subquery for a type of service area.
         def service_area_subquery(type):
             return (
-                select([Place.geometry, Place.type])
+                select(
+                    [
+                        Place.simplified_geometry.label("geometry"),
+                        Place.coarse_geometry,
+                        Place.type,
+                    ]
+                )
                 .where(
                     and_(
                         ServiceArea.library_id == libraries_collections.c.libraries_id,
@@ -838,7 +1101,7 @@ class Library(Base):
                             literal_column(str(510000000000000)),
                         )
                     ],
-                    else_=func.ST_Area(focus_areas_subquery.c.geometry),
+                    else_=func.ST_Area(focus_areas_subquery.c.coarse_geometry),
                 )
             )
             / 1000000
@@ -911,32 +1174,30 @@ class Library(Base):
         (library, distance from starting point). Distances are
         measured in meters.
         """
-        # We start with a single point on the globe. Call this Point
-        # A.
         if isinstance(target, tuple):
             target = GeometryUtility.point(*target)
-        target_geography = cast(target, Geography)
-
-        # Find another point on the globe that's 150 kilometers
-        # northeast of Point A. Call this Point B.
-        other_point = func.ST_Project(
-            target_geography, max_radius * 1000, func.radians(90.0)
+        target_geography = cast(target, Place.GEOGRAPHY)
+
+        # Find all Places within `max_radius` kilometers of the
+        # starting point. Comparing geographies means the radius is
+        # measured in meters everywhere in the world, and the
+        # comparison can be done with the index on
+        # Place.simplified_geography(). Measuring on a sphere rather
+        # than a spheroid is faster, and it's how distances are
+        # measured below.
+        nearby = func.ST_DWithin(
+            Place.simplified_geography(),
+            target_geography,
+            max_radius * 1000,
+            False,
         )
-        other_point = cast(other_point, Geometry)
-
-        # Determine the distance between Point A and Point B, in
-        # radians. (150 kilometers is a different number of radians in
-        # different parts of the world.)
-        distance_to_other_point = func.ST_Distance(target, other_point)
-
-        # Find all Places that are no further away from A than that
-        # number of radians.
-        nearby = func.ST_DWithin(target, Place.geometry, distance_to_other_point)
 
         # For each library served by such a place, calculate the
         # minimum distance between the library's service area and
-        # Point A in meters.
-        min_distance = func.min(func.ST_DistanceSphere(target, Place.geometry))
+        # the starting point in meters.
+        min_distance = func.min(
+            func.ST_DistanceSphere(target, Place.simplified_geometry)
+        )
 
         qu = _db.query(Library).join(Library.service_areas).join(ServiceArea.place)
         qu = qu.filter(cls._feed_restriction(production))
@@ -948,6 +1209,79 @@ class Library(Base):
         )
         return qu
 
+    # The results of nearby() are cached for each geohash cell of this
+    # length, roughly 5 kilometers on a side.
+    NEARBY_GEOHASH_PRECISION = 5
+
+    # When finding libraries near a geohash cell, this many times as
+    # many libraries as were asked for are kept as candidates. Ranking
+    # the candidates by their distance from the exact starting point
+    # then gives the same answer as if the cache weren't there, unless
+    # a huge number of libraries are crowded together.
+    NEARBY_CANDIDATE_FACTOR = 4
+
+    # Changes made in this process are seen immediately. Changes made
+    # in another process are seen as soon as they change the version
+    # of the feed (see feed_version()), and otherwise once the cached
+    # value expires.
+    NEARBY_CACHE_MAX_AGE = 600
+    NEARBY_CACHE = LRUCache(max_size=5000, max_age=NEARBY_CACHE_MAX_AGE)
+
+    @classmethod
+    def cached_nearby(
+        cls, _db, target, limit, max_radius=150, production=True, version=None
+    ):
+        """Find the libraries closest to the given point, as nearby()
+        does, reusing the work done for other points close to it.
+
+        nearby() looks at the geometry of every Place. This method
+        instead looks up candidate libraries for the geohash cell
+        containing the starting point, once, and then calls nearby()
+        to rank only the candidates by their exact distance from the
+        starting point.
+
+        :param target: The starting point. May be a string created by
+            GeometryUtility.point() or a 2-tuple (latitude, longitude).
+        :param limit: Return at most this many libraries.
+        :param version: A value that changes whenever the libraries in
+            the feed do, such as the ETag of the feed. If this is None,
+            the value returned by feed_version() is used.
+
+        :return: A database query that returns 2-tuples (library,
+        distance from starting point), like nearby().
+        """
+        coordinates = GeometryUtility.coordinates(target)
+        models = (Library, ServiceArea, Place)
+        if coordinates is None or ChangeCounter.has_uncommitted_changes(_db, *models):
+            return cls.nearby(_db, target, max_radius, production).limit(limit)
+        if version is None:
+            version = cls.feed_version(_db, production)
+
+        geohash = GeometryUtility.geohash(*coordinates, cls.NEARBY_GEOHASH_PRECISION)
+
+        def candidates():
+            # Any library within `max_radius` of a point in the cell is
+            # within `max_radius` plus half the cell's diagonal of its
+            # center.
+            south, west, north, east = GeometryUtility.geohash_bounds(geohash)
+            center = ((south + north) / 2, (west + east) / 2)
+            radius = max_radius + GeometryUtility.distance(center, (north, east))
+            qu = cls.nearby(_db, center, radius, production)
+            qu = qu.with_entities(Library.id)
+            return tuple(id for [id] in qu.limit(limit * cls.NEARBY_CANDIDATE_FACTOR))
+
+        key = (
+            geohash,
+            production,
+            limit,
+            max_radius,
+            version,
+            ChangeCounter.count(*models),
+        )
+        library_ids = cls.NEARBY_CACHE.get_or_set(key, candidates)
+        qu = cls.nearby(_db, target, max_radius, production)
+        return qu.filter(Library.id.in_(library_ids)).limit(limit)
+
     @classmethod
     def search(cls, _db, target, query, production=True):
         """Try as hard as possible to find a small number of libraries
@@ -981,44 +1315,149 @@ class Library(Base):
             here = None
 
         library_query, place_query, place_type = cls.query_parts(query)
-        # We start with libraries that match the name query.
+
+        # We start with libraries that match the name query, tack on
+        # any additional libraries that match a place query, and then
+        # check the description for the search term, since a lot of
+        # libraries list their locations only within their
+        # description. Descriptions are searched for whole words
+        # first, then for part of a word or a close misspelling of
+        # the whole description. Each of these searches is ranked by
+        # its position in this list.
+        searches = []
         if library_query:
-            libraries_for_name = (
+            searches.append(
                 cls.search_by_library_name(_db, library_query, here, production)
-                .limit(max_libraries)
-                .all()
             )
-        else:
-            libraries_for_name = []
-
-        # We tack on any additional libraries that match a place query.
         if place_query:
-            libraries_for_location = (
+            searches.append(
                 cls.search_by_location_name(
                     _db, place_query, place_type, here, production
                 )
-                .limit(max_libraries)
-                .all()
             )
-        else:
-            libraries_for_location = []
+        searches.append(cls.search_within_description(_db, query, here, production))
+        searches.append(
+            cls.approximate_search_within_description(_db, query, here, production)
+        )
 
-        if libraries_for_name and libraries_for_location:
-            # Filter out any libraries that show up in both lists.
-            for_name = set(libraries_for_name)
-            libraries_for_location = [
-                x for x in libraries_for_location if x not in for_name
+        # All the searches are run as a single UNION ALL query. Each
+        # row is numbered by its position in its own search's order
+        # (e.g. by distance, or by how well a description matches),
+        # so that order is kept when the searches are merged.
+        matches = []
+        for rank, search in enumerate(searches):
+            order_by = list(search._order_by or []) + [Library.id]
+            position = func.row_number().over(order_by=order_by)
+            search = search.add_columns(position.label("position"))
+            search = search.limit(max_libraries).subquery()
+            columns = [
+                search.c.id.label("library_id"),
+                literal(rank, Integer).label("source_rank"),
+                search.c.position,
             ]
-
-        # A lot of libraries list their locations only within their description, so it's worth
-        # checking the description for the search term.
-        libraries_for_description = (
-            cls.search_within_description(_db, query, here, production)
-            .limit(max_libraries)
-            .all()
+            if here:
+                columns.append(search.c.distance)
+            matches.append(select(columns))
+        matches = union_all(*matches).alias("matches")
+
+        # A library that shows up in more than one search is only
+        # listed once, in the position given by its best-ranked search.
+        best = select(matches.c).distinct(matches.c.library_id)
+        best = best.order_by(
+            matches.c.library_id, matches.c.source_rank, matches.c.position
         )
+        best = best.alias("best")
+        if here:
+            qu = _db.query(Library, best.c.distance)
+        else:
+            qu = _db.query(Library)
+        qu = qu.order_by(best.c.source_rank, best.c.position, Library.id)
+        return qu.join(best, Library.id == best.c.library_id).all()
+
+    # The results of search() are cached for each normalized query, and
+    # for each geohash cell of the same size as nearby() uses, and for
+    # each version of the feed (see feed_version()). Changes made in
+    # another process that don't change the feed's version are seen
+    # once the cached value expires.
+    SEARCH_CACHE_MAX_AGE = 600
+    SEARCH_CACHE = LRUCache(max_size=5000, max_age=SEARCH_CACHE_MAX_AGE)
 
-        return libraries_for_name + libraries_for_location + libraries_for_description
+    @classmethod
+    def cached_search(cls, _db, target, query, production=True, version=None):
+        """Find libraries that match the given query, as search() does,
+        reusing the results found for the same query from nearby.
+
+        Queries are normalized with query_cleanup() before they're used
+        as a cache key, so "Springfield  Library" and "springfield
+        library" share an entry. When there's a starting point, the
+        search is run from the center of its geohash cell, so the
+        distances returned may be off by up to half the cell's
+        diagonal -- about three kilometers.
+
+        :param target: The starting point. May be a string created by
+            GeometryUtility.point() or a 2-tuple (latitude, longitude).
+        :param version: A value that changes whenever the libraries in
+            the feed do, such as the ETag of the feed. If this is None,
+            the value returned by feed_version() is used.
+
+        :return: A list of Libraries or, if there's a starting point,
+        2-tuples (library, distance), like search().
+        """
+        if not query:
+            return []
+        query = cls.query_cleanup(query)
+        coordinates = GeometryUtility.coordinates(target) if target else None
+        models = (Library, LibraryAlias, ServiceArea, Place, PlaceAlias)
+        if (target and coordinates is None) or ChangeCounter.has_uncommitted_changes(
+            _db, *models
+        ):
+            return cls.search(_db, target, query, production)
+        if version is None:
+            version = cls.feed_version(_db, production)
+
+        if coordinates:
+            geohash = GeometryUtility.geohash(
+                *coordinates, cls.NEARBY_GEOHASH_PRECISION
+            )
+            south, west, north, east = GeometryUtility.geohash_bounds(geohash)
+            center = ((south + north) / 2, (west + east) / 2)
+        else:
+            geohash = center = None
+
+        key = (
+            query,
+            production,
+            geohash,
+            version,
+            ChangeCounter.count(*models),
+        )
+        matches = cls.SEARCH_CACHE.get(key)
+        if matches is None:
+            results = cls.search(_db, center, query, production)
+            if center:
+                matches = tuple((library.id, distance) for library, distance in results)
+            else:
+                matches = tuple((library.id, None) for library in results)
+            cls.SEARCH_CACHE.set(key, matches)
+            return results
+
+        # Load the libraries, keeping them in the order they were found.
+        # A library that has since been taken out of the feed (possibly
+        # by another process) is left out.
+        libraries = dict()
+        if matches:
+            ids = [id for id, distance in matches]
+            qu = _db.query(Library).filter(Library.id.in_(ids))
+            qu = qu.filter(cls._feed_restriction(production))
+            for library in qu:
+                libraries[library.id] = library
+        results = []
+        for id, distance in matches:
+            library = libraries.get(id)
+            if library is None:
+                continue
+            results.append((library, distance) if center else library)
+        return results
 
     @classmethod
     def search_by_library_name(cls, _db, name, here=None, production=True):
@@ -1029,12 +1468,18 @@ class Library(Base):
         :param production: If True, only libraries that are ready for
             production are shown.
         """
-        name_matches = cls.fuzzy_match(Library.name, name)
-        alias_matches = cls.fuzzy_match(LibraryAlias.name, name)
-        partial_matches = cls.partial_match(Library.name, name)
-        return cls.create_query(
-            _db, here, production, name_matches, alias_matches, partial_matches
-        )
+        # The names are usually matched in memory, so the database
+        # only has to look up the matching libraries.
+        index = LibraryNameIndex.current(_db)
+        if index:
+            matches = [Library.id.in_(index.find(name))]
+        else:
+            matches = [
+                cls.fuzzy_match(Library.name, name),
+                cls.fuzzy_match(LibraryAlias.name, name),
+                cls.partial_match(Library.name, name),
+            ]
+        return cls.create_query(_db, here, production, *matches)
 
     @classmethod
     def search_by_location_name(cls, _db, query, type=None, here=None, production=True):
@@ -1048,23 +1493,58 @@ class Library(Base):
             production are shown.
         """
         # For a library to match, the Place named by the query must
-        # intersect a Place served by that library.
+        # intersect a Place served by that library. First, find the
+        # places with the given name.
+        named = select([Place.id]).select_from(outerjoin(Place, PlaceAlias))
+        named = named.where(
+            or_(
+                cls.fuzzy_match(Place.external_name, query),
+                cls.fuzzy_match(PlaceAlias.name, query),
+            )
+        )
+        if type:
+            named = named.where(Place.type == type)
+
+        # Which places intersect has been worked out ahead of time,
+        # except for nations (see Place.OVERLAP_EXCLUDED_TYPES). When a
+        # nation is named or served, its geometry is checked here
+        # instead. There are only a few nations, so this is only slow
+        # when the query names one.
+        precomputed = select(
+            [
+                place_overlaps.c.place_id,
+                place_overlaps.c.overlapping_place_id.label("named_place_id"),
+            ]
+        ).where(place_overlaps.c.overlapping_place_id.in_(named))
+        served_place = aliased(Place)
+        nation_place = aliased(Place)
+        with_nations = select(
+            [served_place.id, nation_place.id.label("named_place_id")]
+        ).where(
+            and_(
+                nation_place.id.in_(named),
+                served_place.id.in_(select([ServiceArea.place_id])),
+                or_(
+                    served_place.type == Place.NATION,
+                    nation_place.type == Place.NATION,
+                ),
+                func.ST_Intersects(served_place.geometry, nation_place.geometry),
+            )
+        )
+        overlaps = union_all(precomputed, with_nations).alias("place_matches")
+
         named_place = aliased(Place)
         qu = (
             _db.query(Library)
             .join(Library.service_areas)
-            .join(ServiceArea.place)
-            .join(named_place, func.ST_Intersects(Place.geometry, named_place.geometry))
-            .outerjoin(named_place.aliases)
+            .join(overlaps, overlaps.c.place_id == ServiceArea.place_id)
+            .join(named_place, named_place.id == overlaps.c.named_place_id)
         )
         qu = qu.filter(cls._feed_restriction(production))
-        name_match = cls.fuzzy_match(named_place.external_name, query)
-        alias_match = cls.fuzzy_match(PlaceAlias.name, query)
-        qu = qu.filter(or_(name_match, alias_match))
-        if type:
-            qu = qu.filter(named_place.type == type)
         if here:
-            min_distance = func.min(func.ST_DistanceSphere(here, named_place.geometry))
+            min_distance = func.min(
+                func.ST_DistanceSphere(here, named_place.simplified_geometry)
+            ).label("distance")
             qu = qu.add_columns(min_distance)
             qu = qu.group_by(Library.id)
             qu = qu.order_by(min_distance.asc())
@@ -1084,15 +1564,61 @@ class Library(Base):
         if here:
             # Order by the minimum distance between one of the
             # library's service areas and the current location.
-            min_distance = func.min(func.ST_DistanceSphere(here, Place.geometry))
+            min_distance = func.min(
+                func.ST_DistanceSphere(here, Place.simplified_geometry)
+            ).label("distance")
             qu = qu.add_columns(min_distance)
             qu = qu.group_by(Library.id)
             qu = qu.order_by(min_distance.asc())
         return qu
 
+    # The text search configuration used to find words in library
+    # names and descriptions.
+    TEXT_SEARCH_CONFIGURATION = "english"
+
+    @classmethod
+    def search_document(cls):
+        """A text search document made from a library's name and
+        description, with words from the name weighted more heavily.
+
+        There's an index on this expression, so it has to be written
+        exactly the same way everywhere it's used.
+        """
+
+        def words(field, weight):
+            vector = func.to_tsvector(
+                cls.TEXT_SEARCH_CONFIGURATION, func.coalesce(field, "")
+            )
+            return func.setweight(vector, weight, type_=postgresql.TSVECTOR)
+
+        return words(cls.name, "A").op("||")(words(cls.description, "B"))
+
     @classmethod
     def search_within_description(cls, _db, query, here=None, production=True):
-        """Find libraries whose descriptions include the search term.
+        """Find libraries whose names or descriptions include the words
+        in the search term.
+
+        :param query: The string to search for.
+        :param here: Order results by proximity to this location.
+            Otherwise, they're ordered by how well they match.
+        :param production: If True, only libraries that are ready for
+            production are shown.
+        """
+        document = cls.search_document()
+        query = func.plainto_tsquery(cls.TEXT_SEARCH_CONFIGURATION, query)
+        qu = cls.create_query(_db, here, production, document.op("@@")(query))
+        return qu.order_by(func.ts_rank(document, query).desc())
+
+    @classmethod
+    def approximate_search_within_description(
+        cls, _db, query, here=None, production=True
+    ):
+        """Find libraries whose descriptions contain the search term as
+        a substring (e.g. part of a word), or are a close misspelling
+        of it.
+
+        Full-text search only matches whole words, so this catches
+        what search_within_description() misses.
 
         :param query: The string to search for.
         :param here: Order results by proximity to this location.
@@ -1160,6 +1686,19 @@ class Library(Base):
 
         return library_query, place_query, place_type
 
+    # Before checking the Levenshtein distance between a field and a
+    # value, fuzzy_match() requires them to share at least this
+    # fraction of their trigrams. Strings two typos apart often share
+    # less than the pg_trgm default of 0.3 ("new york" and "now work"
+    # share 0.2), so this is set lower, on every connection.
+    FUZZY_MATCH_SIMILARITY_THRESHOLD = 0.15
+
+    # pg_trgm's % operator compares two strings by their trigrams.
+    # psycopg2 uses % to mark query parameters, and SQLAlchemy 1.3
+    # passes custom operators through as-is, so the operator has to be
+    # written with the percent sign already doubled.
+    TRIGRAM_SIMILARITY_OPERATOR = "%%"
+
     @classmethod
     def fuzzy_match(cls, field, value):
         """Create a SQL clause that attempts a fuzzy match of the given
@@ -1169,17 +1708,26 @@ class Library(Base):
         an exact (case-insensitive) match. Otherwise, we require a
         Levenshtein distance of less than two between the field value and
         the provided value.
+
+        Calculating the Levenshtein distance means reading every row,
+        so it's only done for rows that are already similar enough to
+        the value according to a trigram index on the field. See
+        FUZZY_MATCH_SIMILARITY_THRESHOLD.
         """
         is_long = func.length(field) >= 6
         close_enough = func.levenshtein(func.lower(field), value) <= 2
-        long_value_is_approximate_match = is_long & close_enough
+        similar = field.op(cls.TRIGRAM_SIMILARITY_OPERATOR, is_comparison=True)(value)
+        long_value_is_approximate_match = similar & is_long & close_enough
         exact_match = field.ilike(value)
         return or_(long_value_is_approximate_match, exact_match)
 
     @classmethod
     def partial_match(cls, field, value):
         """Create a SQL clause that attempts to match a partial value--e.g.
-        just one word of a library's name--against the given field."""
+        just one word of a library's name--against the given field.
+
+        This can use a trigram index on the field.
+        """
         return field.ilike(f"%{value}%")
 
     def set_hyperlink(self, rel, *hrefs):
@@ -1223,6 +1771,37 @@ class Library(Base):
             return link[0]
 
 
+# Support paging through the alphabetical list of libraries in a
+# feed. The production feed matches each stage exactly, so its
+# libraries are found by a prefix of the first index, already in order.
+# The QA feed allows more than one stage, which would need a sort
+# after scanning the first index, so it has a partial index of its own.
+Index(
+    "ix_libraries_stages_name_id",
+    Library.registry_stage,
+    Library.library_stage,
+    Library.name,
+    Library.id,
+)
+Index(
+    "ix_libraries_qa_feed_name_id",
+    Library.name,
+    Library.id,
+    postgresql_where=Library._feed_restriction(production=False),
+)
+
+# Support Library.fuzzy_match and Library.partial_match.
+trigram_index(Library.name)
+trigram_index(Library.description)
+
+# Supports Library.search_within_description.
+Index(
+    "ix_libraries_search_document",
+    Library.search_document(),
+    postgresql_using="gin",
+)
+
+
 class LibraryAlias(Base):
 
     """An alternate name for a library."""
@@ -1237,6 +1816,308 @@ class LibraryAlias(Base):
     __table_args__ = (UniqueConstraint("library_id", "name", "language"),)
 
 
+trigram_index(LibraryAlias.name)
+
+
+class LibraryNameIndex:
+    """An in-memory index of the names and aliases of every Library, so
+    that Library.search_by_library_name can find matching libraries
+    without asking the database to compare the query to every name.
+
+    Names are matched the same way Library.fuzzy_match and
+    Library.partial_match match them in the database.
+    """
+
+    # When Libraries or LibraryAliases change in this process, the
+    # index is brought up to date by reindexing the libraries whose
+    # timestamps have changed since it was built. Libraries changed by
+    # another process are picked up the same way every
+    # REFRESH_INTERVAL seconds. The whole index is rebuilt every
+    # MAX_AGE seconds, which is also how deleted libraries disappear
+    # from it.
+    REFRESH_INTERVAL = 60
+    MAX_AGE = 3600
+
+    # A library's timestamp is set when it's flushed, not when the
+    # change is committed, and another process's clock may be behind.
+    # So a refresh reindexes libraries with timestamps up to this many
+    # seconds older than the latest one already indexed. A change
+    # committed more than this long after it was flushed is missed
+    # until the next full rebuild, up to MAX_AGE seconds later.
+    REFRESH_OVERLAP = 60
+
+    _current = None
+    _lock = threading.Lock()
+
+    # Whether some thread is building a new index. Only one thread
+    # builds at a time; see current().
+    _building = False
+
+    # The greatest Levenshtein distance allowed by Library.fuzzy_match.
+    MAX_EDITS = 2
+
+    # pg_trgm treats anything other than a letter or digit as the end
+    # of a word.
+    WORD = re.compile(r"[^\W_]+")
+
+    def __init__(self, names, latest=None, postings=None):
+        """Constructor.
+
+        :param names: A dictionary mapping library IDs to lists of
+            (name, is_alias) 2-tuples.
+        :param latest: The most recent Library.timestamp seen when
+            gathering `names`.
+        :param postings: A dictionary mapping each trigram to the set
+            of (library ID, name, trigrams in name) 3-tuples whose name
+            contains it. This is calculated from `names` if it's not
+            provided.
+        """
+        self.names = names
+        self.latest = latest
+        if postings is None:
+            postings = defaultdict(set)
+            for library_id, library_names in names.items():
+                for entry, trigrams in self._entries(library_id, library_names):
+                    for trigram in trigrams:
+                        postings[trigram].add(entry)
+            postings = dict(postings)
+        self.postings = postings
+
+        # Exact matches are found by looking up the lowercased name.
+        # Partial matches are found by searching one long string made
+        # of all the lowercased library names.
+        self.exact = defaultdict(set)
+        self.offsets = []
+        self.ids = []
+        haystack = []
+        length = 0
+        for library_id, library_names in names.items():
+            for name, is_alias in library_names:
+                name = name.lower()
+                self.exact[name].add(library_id)
+                if not is_alias:
+                    self.offsets.append(length)
+                    self.ids.append(library_id)
+                    haystack.append(name)
+                    length += len(name) + 1
+        self.haystack = "\n".join(haystack)
+
+        self.built_at = self.refreshed_at = time.time()
+        self.change_count = None
+
+    @classmethod
+    def trigrams(cls, value):
+        """Find the trigrams in a string, the way pg_trgm does."""
+        trigrams = set()
+        for word in cls.WORD.findall(value.lower()):
+            word = "  " + word + " "
+            trigrams.update(word[i : i + 3] for i in range(len(word) - 2))
+        return trigrams
+
+    @classmethod
+    def _entries(cls, library_id, library_names):
+        """Yield a postings entry, and the trigrams to post it under,
+        for each of a library's names.
+        """
+        for name, is_alias in library_names:
+            trigrams = frozenset(cls.trigrams(name))
+            yield (library_id, name, trigrams), trigrams
+
+    @classmethod
+    def levenshtein(cls, a, b, limit):
+        """Calculate the Levenshtein distance between two strings, or
+        give up and return `limit` + 1 once it's clear the distance is
+        greater than `limit`.
+        """
+        if abs(len(a) - len(b)) > limit:
+            return limit + 1
+        previous = list(range(len(b) + 1))
+        for i, x in enumerate(a, 1):
+            current = [i]
+            for j, y in enumerate(b, 1):
+                current.append(
+                    min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (x != y))
+                )
+            if min(current) > limit:
+                return limit + 1
+            previous = current
+        return previous[-1]
+
+    @classmethod
+    def _gather(cls, libraries, aliases):
+        """Organize the names of some libraries.
+
+        :param libraries: Yields (id, name, timestamp) 3-tuples.
+        :param aliases: Yields (library ID, name) 2-tuples.
+        :return: A 2-tuple (names, latest) suitable for passing into
+            the constructor.
+        """
+        names = dict()
+        latest = None
+        for library_id, name, timestamp in libraries:
+            names[library_id] = [(name, False)] if name else []
+            if timestamp and (latest is None or timestamp > latest):
+                latest = timestamp
+        for library_id, name in aliases:
+            if name and library_id in names:
+                names[library_id].append((name, True))
+        return names, latest
+
+    @classmethod
+    def from_database(cls, _db):
+        """Build an index of every library."""
+        names, latest = cls._gather(
+            _db.query(Library.id, Library.name, Library.timestamp),
+            _db.query(LibraryAlias.library_id, LibraryAlias.name),
+        )
+        return cls(names, latest)
+
+    def refreshed(self, _db):
+        """Create an up-to-date copy of this index by reindexing the
+        libraries that have changed since it was built.
+
+        Unchanged parts of the index are shared with the copy, so this
+        index can still be used while the copy is being made.
+        """
+        libraries = _db.query(Library.id, Library.name, Library.timestamp)
+        if self.latest:
+            since = self.latest - datetime.timedelta(seconds=self.REFRESH_OVERLAP)
+            libraries = libraries.filter(Library.timestamp >= since)
+        libraries = libraries.all()
+        aliases = _db.query(LibraryAlias.library_id, LibraryAlias.name).filter(
+            LibraryAlias.library_id.in_([x[0] for x in libraries])
+        )
+        changed, latest = self._gather(libraries, aliases)
+
+        names = dict(self.names)
+        removed = defaultdict(set)
+        added = defaultdict(set)
+        for library_id, library_names in changed.items():
+            old_names = names.get(library_id, [])
+            for entry, trigrams in self._entries(library_id, old_names):
+                for trigram in trigrams:
+                    removed[trigram].add(entry)
+            for entry, trigrams in self._entries(library_id, library_names):
+                for trigram in trigrams:
+                    added[trigram].add(entry)
+            names[library_id] = library_names
+
+        # Replace the postings that changed, rather than modifying
+        # them, since they're shared with this index.
+        postings = dict(self.postings)
+        for trigram in set(removed) | set(added):
+            entries = postings.get(trigram, set())
+            postings[trigram] = (entries - removed[trigram]) | added[trigram]
+
+        if self.latest and (latest is None or self.latest > latest):
+            latest = self.latest
+        index = LibraryNameIndex(names, latest, postings)
+        index.built_at = self.built_at
+        return index
+
+    @classmethod
+    def current(cls, _db):
+        """Find an index that reflects everything this session can see.
+
+        :return: A LibraryNameIndex, or None if this session has changed
+            Libraries without committing the changes, since the index
+            can't see them.
+        """
+        models = (Library, LibraryAlias)
+        if ChangeCounter.has_uncommitted_changes(_db, *models):
+            return None
+
+        # The index is built without holding the lock, so that other
+        # threads don't wait for it. While one thread is building,
+        # the others keep using the old index, unless it's missing
+        # changes made in this process, in which case they search the
+        # database instead.
+        change_count = ChangeCounter.count(*models)
+        now = time.time()
+        with cls._lock:
+            index = cls._current
+            rebuild = index is None or now - index.built_at >= cls.MAX_AGE
+            if not rebuild and (
+                change_count == index.change_count
+                and now - index.refreshed_at < cls.REFRESH_INTERVAL
+            ):
+                return index
+            if cls._building:
+                if index is not None and change_count == index.change_count:
+                    return index
+                return None
+            cls._building = True
+
+        try:
+            if rebuild:
+                index = cls.from_database(_db)
+            else:
+                index = index.refreshed(_db)
+            index.change_count = change_count
+            with cls._lock:
+                cls._current = index
+        finally:
+            with cls._lock:
+                cls._building = False
+        return index
+
+    @classmethod
+    def clear_cache(cls):
+        with cls._lock:
+            cls._current = None
+
+    def find(self, value):
+        """Find the libraries whose name or alias fuzzy-matches `value`,
+        or whose name contains it.
+
+        :return: A set of library IDs.
+        """
+        lowercase = value.lower()
+        found = set(self.exact.get(lowercase, ()))
+
+        # Partial matches of library names.
+        if lowercase and "\n" not in lowercase:
+            position = self.haystack.find(lowercase)
+            while position != -1:
+                i = bisect.bisect_right(self.offsets, position) - 1
+                found.add(self.ids[i])
+                if i + 1 == len(self.offsets):
+                    break
+                position = self.haystack.find(lowercase, self.offsets[i + 1])
+
+        # Names that are long enough, and share enough trigrams with
+        # the value, are checked for a small Levenshtein distance.
+        #
+        # Each edit to a string changes at most three of its trigrams,
+        # so a name within MAX_EDITS edits of the value must share all
+        # but 3 * MAX_EDITS of the value's trigrams. That means it must
+        # contain at least one of any 3 * MAX_EDITS + 1 of them, and
+        # only the names containing the rarest ones need to be checked.
+        trigrams = self.trigrams(value)
+        misses = 3 * self.MAX_EDITS
+        rarest = sorted(trigrams, key=lambda x: len(self.postings.get(x, ())))
+        candidates = set()
+        for trigram in rarest[: misses + 1]:
+            candidates.update(self.postings.get(trigram, ()))
+        threshold = Library.FUZZY_MATCH_SIMILARITY_THRESHOLD
+        for library_id, name, name_trigrams in candidates:
+            if (
+                library_id in found
+                or len(name) < 6
+                or abs(len(name) - len(value)) > self.MAX_EDITS
+            ):
+                continue
+            shared = len(trigrams & name_trigrams)
+            size = len(name_trigrams)
+            if shared < max(len(trigrams), size) - misses:
+                continue
+            if shared / (len(trigrams) + size - shared) < threshold:
+                continue
+            if self.levenshtein(name.lower(), value, self.MAX_EDITS) <= self.MAX_EDITS:
+                found.add(library_id)
+        return found
+
+
 class ServiceArea(Base):
     """Designates a geographic area served by a Library.
 
@@ -1263,6 +2144,42 @@ class ServiceArea(Base):
 
     __table_args__ = (UniqueConstraint("library_id", "place_id", "type"),)
 
+    @classmethod
+    def bulk_create(cls, _db, library, places, type):
+        """Make sure `library` has a ServiceArea of the given type for
+        each of the given places, using a single INSERT.
+
+        :return: A list of ServiceAreas, one for each place.
+        """
+        place_ids = {place.id for place in places}
+        if not place_ids:
+            return []
+        _db.flush()
+        table = cls.__table__
+        insert = (
+            postgresql.insert(table)
+            .values(
+                [
+                    dict(library_id=library.id, place_id=place_id, type=type)
+                    for place_id in place_ids
+                ]
+            )
+            .on_conflict_do_nothing(index_elements=["library_id", "place_id", "type"])
+            .returning(table.c.id)
+        )
+        if _db.execute(insert).fetchall():
+            # The new rows didn't go through the ORM, so the hooks
+            # that would normally notice them need some help.
+            ChangeCounter.note_changes(_db, cls)
+            library.timestamp = datetime.datetime.utcnow()
+            _db.expire(library, ["service_areas"])
+        qu = _db.query(cls).filter(
+            cls.library_id == library.id,
+            cls.type == type,
+            cls.place_id.in_(place_ids),
+        )
+        return qu.all()
+
 
 class Place(Base):
     __tablename__ = "places"
@@ -1313,10 +2230,34 @@ class Place(Base):
     # calculations.
     geometry = Column(Geometry(srid=4326), nullable=True)
 
+    # Simplified versions of .geometry, for ranking and searching,
+    # where an error of a few hundred meters doesn't matter but
+    # comparing polygons with thousands of vertices is slow. These are
+    # calculated by the database whenever .geometry changes. The
+    # tolerances are in degrees: roughly 100 meters and 1 kilometer.
+    SIMPLIFIED_TOLERANCE = 0.001
+    COARSE_TOLERANCE = 0.01
+    simplified_geometry = deferred(Column(Geometry(srid=4326), nullable=True))
+    coarse_geometry = deferred(Column(Geometry(srid=4326), nullable=True))
+
+    GEOGRAPHY = Geography(srid=4326)
+
+    # .geometry as a GeoJSON string, ready to be served without
+    # involving PostGIS. This is calculated by the database whenever
+    # .geometry changes. Coordinates are rounded to this many decimal
+    # places, about ten centimeters.
+    GEOJSON_PRECISION = 6
+    geojson = deferred(Column(Unicode, nullable=True))
+
     aliases = relationship("PlaceAlias", backref="place")
 
     service_areas = relationship("ServiceArea", backref="place")
 
+    # The ZIP codes of every US city, according to uszipcode. See
+    # zip_codes_for_city().
+    _zip_codes_by_city = None
+    _zip_codes_lock = threading.Lock()
+
     @classmethod
     def everywhere(cls, _db):
         """Return a special Place that represents everywhere.
@@ -1344,9 +2285,9 @@ class Place(Base):
         :return: The default nation, if one can be found. Otherwise, None.
         """
         default_nation = None
-        abbreviation = ConfigurationSetting.sitewide(
+        abbreviation = ConfigurationSetting.sitewide_value(
             _db, Configuration.DEFAULT_NATION_ABBREVIATION
-        ).value
+        )
         if abbreviation:
             default_nation = get_one(
                 _db, Place, type=Place.NATION, abbreviated_name=abbreviation
@@ -1435,22 +2376,54 @@ class Place(Base):
         """Convert one or more Place objects to a dictionary that will become
         a GeoJSON document when converted to JSON.
         """
-        geojson = select([func.ST_AsGeoJSON(Place.geometry)]).where(
-            Place.id.in_([x.id for x in places])
+        return json.loads(cls.geojson_document(_db, *places))
+
+    @classmethod
+    def loaded_version(cls, _db):
+        """Summarize the Places in the database, in a way that changes
+        whenever places are added or reloaded, by this process or any
+        other.
+
+        :return: A 3-tuple (number of places, highest place ID, the
+            time places were last loaded by LoadPlacesScript).
+        """
+        loaded_at = (
+            select([ConfigurationSetting.value])
+            .where(ConfigurationSetting.key == Configuration.PLACES_LOADED_AT)
+            .where(ConfigurationSetting.library_id == None)
+            .where(ConfigurationSetting.external_integration_id == None)
+            .as_scalar()
+        )
+        return tuple(
+            _db.query(func.count(Place.id), func.max(Place.id), loaded_at).one()
+        )
+
+    @classmethod
+    def geojson_document(cls, _db, *places, **extensions):
+        """Build a GeoJSON document for one or more Place objects from
+        their stored GeoJSON, without parsing it.
+
+        :param extensions: Extra top-level fields to add to the document.
+        :return: A string.
+        """
+        geojson = select([Place.geojson]).where(
+            and_(Place.id.in_([x.id for x in places]), Place.geojson != None)
         )
         results = [x[0] for x in _db.execute(geojson)]
         if len(results) == 1:
             # There's only one item, and it is a valid
             # GeoJSON document on its own.
-            return json.loads(results[0])
-
-        # We have either more or less than one valid item.
-        # In either case, a GeometryCollection is appropriate.
-        body = {
-            "type": "GeometryCollection",
-            "geometries": [json.loads(x) for x in results],
-        }
-        return body
+            [document] = results
+        else:
+            # We have either more or less than one valid item.
+            # In either case, a GeometryCollection is appropriate.
+            document = '{"type": "GeometryCollection", "geometries": [%s]}' % (
+                ", ".join(results)
+            )
+        if extensions:
+            # Splice the extra fields into the end of the JSON object.
+            document = document.rstrip()[:-1] + ", " + json.dumps(extensions)[1:]
+        return document
 
     @classmethod
     def name_parts(cls, name):
@@ -1521,6 +2494,97 @@ class Place(Base):
         #  France
         return self.external_name
 
+    @classmethod
+    def simplified_geography(cls):
+        """Treat Place.simplified_geometry as a geography, so that
+        distances from it can be measured in meters.
+
+        There's an index on this expression, so it has to be written
+        exactly the same way everywhere it's used.
+        """
+        return cast(cls.simplified_geometry, cls.GEOGRAPHY)
+
+    def update_simplified_geometry(self):
+        """Have the database recalculate this Place's simplified
+        geometries from its current .geometry when the Place is next
+        flushed.
+        """
+        if self.geometry is None:
+            self.simplified_geometry = self.coarse_geometry = None
+            return
+        geometry = type_coerce(self.geometry, Geometry(srid=4326))
+        self.simplified_geometry = func.ST_SimplifyPreserveTopology(
+            geometry, self.SIMPLIFIED_TOLERANCE
+        )
+        self.coarse_geometry = func.ST_SimplifyPreserveTopology(
+            geometry, self.COARSE_TOLERANCE
+        )
+
+    def update_geojson(self):
+        """Have the database recalculate this Place's stored GeoJSON
+        from its current .geometry when the Place is next flushed.
+        """
+        if self.geometry is None:
+            self.geojson = None
+            return
+        geometry = type_coerce(self.geometry, Geometry(srid=4326))
+        self.geojson = func.ST_AsGeoJSON(geometry, self.GEOJSON_PRECISION)
+
+    # A nation overlaps nearly every other place, so recording its
+    # overlaps would make the placeoverlaps table many times bigger.
+    # Nations are left out of it on both sides, and
+    # Library.search_by_location_name() checks them separately.
+    # 'Everywhere' is left out too, since it has no geometry.
+    OVERLAP_EXCLUDED_TYPES = (NATION, EVERYWHERE)
+
+    @classmethod
+    def update_overlaps(cls, connection, place_ids):
+        """Recalculate which places overlap the given places.
+
+        This compares full geometries, which is slow, so it's done by
+        the script that loads places rather than whenever a place is
+        flushed. It runs in the database as a single INSERT ... SELECT.
+
+        :param connection: A database connection.
+        :param place_ids: The IDs of places whose geometries have
+            changed.
+        """
+        place_ids = list(place_ids)
+        if not place_ids:
+            return
+        table = place_overlaps
+        connection.execute(
+            table.delete().where(
+                or_(
+                    table.c.place_id.in_(place_ids),
+                    table.c.overlapping_place_id.in_(place_ids),
+                )
+            )
+        )
+
+        changed = aliased(Place)
+        other = aliased(Place)
+        overlapping = join(
+            changed,
+            other,
+            func.ST_Intersects(changed.geometry, other.geometry),
+        )
+        included = and_(
+            changed.id.in_(place_ids),
+            ~changed.type.in_(cls.OVERLAP_EXCLUDED_TYPES),
+            ~other.type.in_(cls.OVERLAP_EXCLUDED_TYPES),
+        )
+        pairs = select([changed.id, other.id]).select_from(overlapping).where(included)
+        reversed_pairs = (
+            select([other.id, changed.id]).select_from(overlapping).where(included)
+        )
+        connection.execute(
+            table.insert().from_select(
+                [table.c.place_id, table.c.overlapping_place_id],
+                union(pairs, reversed_pairs),
+            )
+        )
+
     def overlaps_not_counting_border(self, qu):
         """Modifies a filter to find places that have points inside this
         Place, not counting the border.
@@ -1529,6 +2593,8 @@ class Place(Base):
         share a border. This method creates a more real-world notion
         of 'inside' that does not count a shared border.
         """
+        # A shared border is very sensitive to simplification, so
+        # this uses the full geometries.
         intersects = Place.geometry.intersects(self.geometry)
         touches = func.ST_Touches(Place.geometry, self.geometry)
         return qu.filter(intersects).filter(touches == False)
@@ -1591,6 +2657,96 @@ class Place(Base):
         # "Springfield" or "Lake County" within the United States,
         # instead of specifying which state you're talking about.
         _db = Session.object_session(self)
+        places = []
+        if self.type != self.EVERYWHERE and not (
+            using_overlap and self.geometry is not None
+        ):
+            # This is a lookup by parent, which can usually be
+            # answered from memory.
+            places = PlaceNameIndex.lookup_inside(_db, self, name)
+
+        if not places:
+            places = self._lookup_inside_query(_db, name, using_overlap).all()
+
+        if len(places) == 0:
+            if using_external_source:
+                # We don't have any matching places in the database _now_,
+                # but there's a possibility we can find a representative
+                # postal code.
+                return self.lookup_one_through_external_source(name)
+            else:
+                # We're not allowed to use uszipcodes, probably
+                # because this method was called by
+                # lookup_through_external_source.
+                return None
+        if len(places) > 1:
+            raise MultipleResultsFound(
+                "More than one place called {} inside {}.".format(
+                    name, self.external_name
+                )
+            )
+        return places[0]
+
+    def lookup_many_inside(self, names):
+        """Look up a number of named Places inside this Place, the way
+        lookup_inside() would, using as few queries as possible.
+
+        :param names: A list of names, such as "Boston, MA" or "93203".
+        :return: A 3-tuple (found, unknown, ambiguous). `found` is a
+            dictionary mapping names to Places, `unknown` is a list of
+            names that didn't match any Place, and `ambiguous` is a list
+            of names that matched more than one.
+        """
+        _db = Session.object_session(self)
+        index = None
+        if self.type != self.EVERYWHERE:
+            index = PlaceNameIndex.current(_db)
+
+        # Most names can be resolved in memory, and the Places loaded
+        # all at once.
+        ids_by_name = dict()
+        unknown = []
+        ambiguous = []
+        look_up_individually = []
+        for name in names:
+            ids = index.find_scoped_inside(self, name) if index else []
+            if len(ids) == 1:
+                ids_by_name[name] = ids[0]
+            elif len(ids) > 1:
+                ambiguous.append(name)
+            else:
+                look_up_individually.append(name)
+        places = {
+            place.id: place
+            for place in PlaceNameIndex.load(_db, set(ids_by_name.values()))
+        }
+        found = dict()
+        for name, id in ids_by_name.items():
+            if id in places:
+                found[name] = places[id]
+            else:
+                look_up_individually.append(name)
+
+        # Anything else goes through lookup_inside(), which might
+        # have to ask the database or uszipcode.
+        for name in look_up_individually:
+            try:
+                place = self.lookup_inside(name)
+            except MultipleResultsFound:
+                ambiguous.append(name)
+                continue
+            if place:
+                found[name] = place
+            else:
+                unknown.append(name)
+        return found, unknown, ambiguous
+
+    def _lookup_inside_query(self, _db, name, using_overlap):
+        """Build a query that finds Places inside this one with the
+        given name.
+
+        :param name: An unscoped name, such as "Boston".
+        """
         qu = Place.lookup_by_name(_db, name).filter(Place.type != self.type)
 
         # Don't look in a place type known to be 'bigger' than this
@@ -1620,26 +2776,7 @@ class Place(Base):
                     grandparent.id == self.id,
                 )
                 qu = qu.filter(or_(Place.parent == self, postal_code_grandparent_match))
-
-        places = qu.all()
-        if len(places) == 0:
-            if using_external_source:
-                # We don't have any matching places in the database _now_,
-                # but there's a possibility we can find a representative
-                # postal code.
-                return self.lookup_one_through_external_source(name)
-            else:
-                # We're not allowed to use uszipcodes, probably
-                # because this method was called by
-                # lookup_through_external_source.
-                return None
-        if len(places) > 1:
-            raise MultipleResultsFound(
-                "More than one place called {} inside {}.".format(
-                    name, self.external_name
-                )
-            )
-        return places[0]
+        return qu
 
     def lookup_one_through_external_source(self, name):
         """Use an external source to find a Place that is a) inside `self`
@@ -1655,29 +2792,72 @@ class Place(Base):
             # uszipcodes keeps track of places in terms of their state.
             return None
 
+        zip_codes = Place.zip_codes_for_city(self.abbreviated_name, name)
+        if not zip_codes:
+            return None
+
+        # Look up all the ZIP codes at once, and return the first one
+        # we actually know about. As with lookup_inside(), a ZIP code
+        # may be inside the state or inside a place (such as a county)
+        # inside the state.
+        _db = Session.object_session(self)
+        parent = aliased(Place)
+        qu = (
+            _db.query(Place)
+            .options(lazyload(Place.children))
+            .join(parent, Place.parent_id == parent.id)
+            .filter(Place.type == Place.POSTAL_CODE)
+            .filter(Place.external_id.in_(zip_codes))
+            .filter(or_(Place.parent_id == self.id, parent.parent_id == self.id))
+        )
+        places = {place.external_id: place for place in qu}
+        for zip_code in zip_codes:
+            if zip_code in places:
+                return places[zip_code]
+        return None
+
+    @classmethod
+    def zip_codes_for_city(cls, state, city):
+        """Find the ZIP codes of a US city, according to uszipcode.
+
+        The first time this is called, the relevant part of the
+        uszipcode database is read into memory, so later calls don't
+        touch it.
+
+        :param state: A state abbreviation, such as "NY".
+        :param city: The exact name of a city, such as "Poughkeepsie".
+        :return: A tuple of ZIP codes, in order.
+        """
+        if cls._zip_codes_by_city is None:
+            with cls._zip_codes_lock:
+                if cls._zip_codes_by_city is None:
+                    cls._zip_codes_by_city = cls._load_zip_codes_by_city()
+        return cls._zip_codes_by_city.get((state, city), ())
+
+    @classmethod
+    def _load_zip_codes_by_city(cls):
+        """Read every standard ZIP code from uszipcode.
+
+        :return: A dictionary mapping (state abbreviation, city name)
+            to a tuple of ZIP codes.
+        """
         search = uszipcode.SearchEngine(
             db_file_dir=Configuration.DATADIR, simple_zipcode=True
         )
-        state = self.abbreviated_name
-        uszipcode_matches = []
-        if (
-            state in search.state_to_city_mapper
-            and name in search.state_to_city_mapper[state]
-        ):
-            # The given name is an exact match for one of the
-            # cities. Let's look up every ZIP code for that city.
-            uszipcode_matches = search.by_city_and_state(name, state, returns=None)
-
-        # Look up a Place object for each ZIP code and return the
-        # first one we actually know about.
-        #
-        # Set using_external_source to False to eliminate the
-        # possibility of wasted effort or (I don't think this can
-        # happen) infinite recursion.
-        for match in uszipcode_matches:
-            place = self.lookup_inside(match.zipcode, using_external_source=False)
-            if place:
-                return place
+        zipcode = search.zip_klass
+        qu = (
+            search.ses.query(zipcode.state, zipcode.major_city, zipcode.zipcode)
+            .filter(zipcode.zipcode_type == uszipcode.ZipcodeType.Standard)
+            .order_by(zipcode.zipcode)
+        )
+        zip_codes = defaultdict(list)
+        try:
+            for state, city, zip_code in qu:
+                if state and city:
+                    zip_codes[(state.upper(), city)].append(zip_code)
+        finally:
+            search.close()
+        return {key: tuple(value) for key, value in zip_codes.items()}
 
     def served_by(self):
         """Find all Libraries with a ServiceArea whose Place overlaps
@@ -1712,6 +2892,28 @@ class Place(Base):
         return str(output)
 
 
+@event.listens_for(Place, "before_insert")
+@event.listens_for(Place, "before_update")
+def _update_place_derived_geometry(mapper, connection, place):
+    """Keep a Place's simplified geometries and GeoJSON in sync with
+    its geometry.
+    """
+    if inspect(place).attrs.geometry.history.has_changes():
+        place.update_simplified_geometry()
+        place.update_geojson()
+
+
+# Supports finding places within a given distance of a point.
+Index(
+    "ix_places_simplified_geography",
+    Place.simplified_geography(),
+    postgresql_using="gist",
+)
+
+# Supports searching for libraries by location name.
+trigram_index(Place.external_name)
+
+
 class PlaceAlias(Base):
 
     """An alternate name for a place."""
@@ -1726,6 +2928,143 @@ class PlaceAlias(Base):
     __table_args__ = (UniqueConstraint("place_id", "name", "language"),)
 
 
+trigram_index(PlaceAlias.name)
+
+
+class PlaceNameIndex:
+    """An in-memory index of the names of every Place, organized by
+    parent, so that Place.lookup_inside can usually find a place
+    without going to the database.
+
+    The index only holds IDs, names and types, so it stays small even
+    with every ZIP code in the United States loaded.
+    """
+
+    # The index is rebuilt when Places or PlaceAliases change in this
+    # process. Places loaded by another process are found once the
+    # index expires, or by the database query that's run whenever the
+    # index can't find a place.
+    CACHE_MAX_AGE = 3600
+    CACHE = LRUCache(max_size=1, max_age=CACHE_MAX_AGE)
+
+    def __init__(self, _db):
+        parents = dict()
+        types = dict()
+        names = defaultdict(set)
+        qu = _db.query(
+            Place.id,
+            Place.type,
+            Place.parent_id,
+            Place.external_name,
+            Place.abbreviated_name,
+        )
+        for id, type, parent_id, external_name, abbreviated_name in qu:
+            parents[id] = parent_id
+            types[id] = type
+            names[id].update(x for x in (external_name, abbreviated_name) if x)
+        for place_id, name in _db.query(PlaceAlias.place_id, PlaceAlias.name):
+            if name:
+                names[place_id].add(name)
+
+        # Map (parent ID, name) to a list of (place ID, place type).
+        places = defaultdict(list)
+        for id, type in types.items():
+            # A postal code can be looked up inside its grandparent as
+            # well as its parent.
+            containers = [parents[id]]
+            if type == Place.POSTAL_CODE and parents[id] is not None:
+                containers.append(parents.get(parents[id]))
+            for container in containers:
+                if container is None:
+                    continue
+                for name in names[id]:
+                    places[(container, name)].append((id, type))
+        self.places = {key: tuple(value) for key, value in places.items()}
+        self.types = types
+
+    def find_inside(self, place, name):
+        """Find the IDs of Places with the given name inside `place`,
+        following the same rules as Place.lookup_inside.
+
+        :param name: An unscoped name, such as "Boston".
+        :return: A list of Place IDs.
+        """
+        return self._find_inside(place.id, place.type, name)
+
+    def find_scoped_inside(self, place, name):
+        """Find the IDs of Places with a name that may be scoped, such
+        as "Boston, MA", inside `place`.
+
+        :return: A list of Place IDs. If some part of the name
+            matched more than one place, those places' IDs are
+            returned; if some part matched nothing, the list is empty.
+        """
+        ids = []
+        container = (place.id, place.type)
+        for part in Place.name_parts(name):
+            ids = self._find_inside(*container, part)
+            if len(ids) != 1:
+                break
+            container = (ids[0], self.types[ids[0]])
+        return ids
+
+    def _find_inside(self, container_id, container_type, name):
+        name, place_type = Place.parse_name(name)
+        exclude_types = set(Place.larger_place_types(container_type))
+        exclude_types.add(container_type)
+        if not place_type:
+            # See Place.lookup_by_name for why counties are excluded.
+            exclude_types.add(Place.COUNTY)
+        return [
+            id
+            for id, type in self.places.get((container_id, name), ())
+            if type not in exclude_types and (not place_type or type == place_type)
+        ]
+
+    @classmethod
+    def current(cls, _db):
+        """Find an index that reflects everything this session can see.
+
+        :return: A PlaceNameIndex, or None if this session has changed
+            Places without committing the changes, since the index
+            can't see them.
+        """
+        models = (Place, PlaceAlias)
+        if ChangeCounter.has_uncommitted_changes(_db, *models):
+            return None
+        return cls.CACHE.get_or_set(ChangeCounter.count(*models), lambda: cls(_db))
+
+    @classmethod
+    def lookup_inside(cls, _db, place, name):
+        """Find Places with the given name whose parent is `place`.
+
+        :return: A list of Places. This will be empty if no match was
+            found, or if the index can't be used.
+        """
+        index = cls.current(_db)
+        if not index:
+            return []
+        return cls.load(_db, index.find_inside(place, name))
+
+    @classmethod
+    def load(cls, _db, ids):
+        """Load the Places with the given IDs, in a single query.
+
+        :return: A list of Places, in no particular order.
+        """
+        if not ids:
+            return []
+        # Places load their children eagerly by default, which isn't
+        # needed here.
+        qu = _db.query(Place).options(lazyload(Place.children))
+        return qu.filter(Place.id.in_(ids)).all()
+
+    @classmethod
+    def clear_cache(cls):
+        """Forget the index, so it will be rebuilt the next time it's needed."""
+        cls.CACHE.clear()
+
+
 class Audience(Base):
     """A class of person served by a library."""
 
@@ -1929,9 +3268,9 @@ class Hyperlink(Base):
             library=library.name,
             library_web_url=library.web_url,
             email=to_address,
-            registry_support=ConfigurationSetting.sitewide(
+            registry_support=ConfigurationSetting.sitewide_value(
                 _db, Configuration.REGISTRY_CONTACT_EMAIL
-            ).value,
+            ),
         )
         if email_type == Emailer.ADDRESS_NEEDS_CONFIRMATION:
             template_args["confirmation_link"] = url_for(
@@ -2021,6 +3360,23 @@ class Validation(Base):
             return None
         return self.started_at + self.EXPIRES_AFTER
 
+    @classmethod
+    def last_expiration(cls, _db):
+        """When did a Validation most recently expire?
+
+        :return: A datetime, or None if no Validation has expired.
+        """
+        expired_before = datetime.datetime.utcnow() - cls.EXPIRES_AFTER
+        started_at = (
+            _db.query(func.max(Validation.started_at))
+            .filter(Validation.success == False)
+            .filter(Validation.started_at < expired_before)
+            .scalar()
+        )
+        if started_at is None:
+            return None
+        return started_at + cls.EXPIRES_AFTER
+
     @property
     def active(self):
         """Is this Validation still active?
@@ -2477,9 +3833,64 @@ class ConfigurationSetting(Base):
 
     __table_args__ = (UniqueConstraint("external_integration_id", "library_id", "key"),)
 
+    # Site configuration is read on almost every request, and almost
+    # never changes, so values looked up through cached() are kept
+    # for this many seconds. Changes made in this process are seen
+    # immediately; changes made in another process (such as one of
+    # the configuration scripts) are seen once the cached value
+    # expires.
+    CACHE_MAX_AGE = 60
+    CACHE = LRUCache(max_size=100, max_age=CACHE_MAX_AGE)
+
     def __repr__(self):
         return "<ConfigurationSetting: key=%s, ID=%d>" % (self.key, self.id)
 
+    @classmethod
+    def cached(cls, _db, key, lookup):
+        """Look up some site configuration, reusing the result of an
+        earlier lookup if nothing has changed since then.
+
+        :param key: A hashable value identifying this piece of
+            configuration.
+        :param lookup: A function that looks up the configuration
+            using `_db`. Its return value may be shared between
+            requests, so it shouldn't be (or contain) an ORM object.
+        """
+        models = (ConfigurationSetting, ExternalIntegration)
+        if ChangeCounter.has_uncommitted_changes(_db, *models):
+            # This session can see configuration that no one else
+            # can see yet.
+            return lookup()
+        return cls.CACHE.get_or_set((key, ChangeCounter.count(*models)), lookup)
+
+    @classmethod
+    def clear_cache(cls):
+        """Forget all cached configuration."""
+        cls.CACHE.clear()
+
+    @classmethod
+    def sitewide_value(cls, _db, key):
+        """Find the value of a sitewide ConfigurationSetting.
+
+        Unlike sitewide(), this doesn't create the setting if it
+        doesn't exist, and in the steady state it doesn't touch the
+        database at all.
+
+        :return: A string, or None if the setting has no value.
+        """
+
+        def lookup():
+            setting = get_one(
+                _db,
+                ConfigurationSetting,
+                library_id=None,
+                external_integration_id=None,
+                key=key,
+            )
+            return setting.value if setting else None
+
+        return cls.cached(_db, ("sitewide", key), lookup)
+
     @classmethod
     def sitewide_secret(cls, _db, key):
         """Find or create a sitewide shared secret.
@@ -2691,6 +4102,27 @@ libraries_audiences = Table(
     UniqueConstraint("library_id", "audience_id"),
 )
 
+# Every pair of places whose geometries intersect, in both directions,
+# except for nations. A place with a geometry overlaps itself. See
+# Place.update_overlaps() and Library.search_by_location_name().
+place_overlaps = Table(
+    "placeoverlaps",
+    Base.metadata,
+    Column(
+        "place_id",
+        Integer,
+        ForeignKey("places.id", ondelete="CASCADE"),
+        primary_key=True,
+    ),
+    Column(
+        "overlapping_place_id",
+        Integer,
+        ForeignKey("places.id", ondelete="CASCADE"),
+        primary_key=True,
+        index=True,
+    ),
+)
+
 
 class Admin(Base):
     __tablename__ = "admins"
@@ -1,3 +1,4 @@
+import itertools
 import json
 
 import flask
@@ -6,6 +7,7 @@ from sqlalchemy.orm import Query
 from authentication_document import AuthenticationDocument
 from config import Configuration
 from model import ConfigurationSetting, Hyperlink, LibraryType, Validation
+from util.cache import LRUCache
 
 
 class Annotator:
@@ -37,6 +39,20 @@ class OPDSCatalog:
 
     CACHE_TIME = 3600 * 12
 
+    # When a catalog is streamed, its JSON is sent out in pieces of
+    # roughly this many characters.
+    STREAM_CHUNK_SIZE = 64 * 1024
+
+    # Each library's entry, serialized as JSON, is kept around so it
+    # doesn't have to be rebuilt until the library changes.
+    FRAGMENT_CACHE = LRUCache(max_size=5000)
+
+    # Entries that show a distance from the client are cached
+    # separately, since there's one for every kilometer, so that
+    # location-based traffic doesn't push out the entries used in the
+    # list of all libraries.
+    DISTANCE_FRAGMENT_CACHE = LRUCache(max_size=1000)
+
     @classmethod
     def _strftime(cls, date):
         """
@@ -55,9 +71,23 @@ class OPDSCatalog:
         catalog.setdefault("images", []).append(image)
 
     def __init__(
-        self, _db, title, url, libraries, annotator=None, live=True, url_for=None
+        self,
+        _db,
+        title,
+        url,
+        libraries,
+        annotator=None,
+        live=True,
+        url_for=None,
+        stream=False,
     ):
-        """Turn a list of libraries into a catalog."""
+        """Turn a list of libraries into a catalog.
+
+        :param stream: If this is True, the libraries' entries are not
+            built up front. Instead, each entry is built and serialized
+            as it's needed by chunks(), so that the entire catalog
+            never has to be in memory at once.
+        """
         if not annotator:
             annotator = Annotator()
 
@@ -74,23 +104,65 @@ class OPDSCatalog:
         self.add_link_to_catalog(
             self.catalog, rel="self", href=url, type=self.OPDS_TYPE
         )
-        web_client_uri_template = ConfigurationSetting.sitewide(
+        web_client_uri_template = ConfigurationSetting.sitewide_value(
             _db, Configuration.WEB_CLIENT_URL
-        ).value
-        for library in libraries:
-            if not isinstance(library, tuple):
-                library = (library,)
-            self.catalog["catalogs"].append(
-                self.library_catalog(
-                    *library,
-                    url_for=url_for,
-                    include_logo=include_logos,
-                    web_client_uri_template=web_client_uri_template,
-                    include_service_area=include_service_areas
-                )
-            )
+        )
+
+        # These arguments are used to build the entry for every
+        # library in the catalog.
+        self.library_catalog_kwargs = dict(
+            url_for=url_for,
+            include_logo=include_logos,
+            web_client_uri_template=web_client_uri_template,
+            include_service_area=include_service_areas,
+        )
+        if stream:
+            self.libraries = libraries
+        else:
+            self.libraries = None
+            for library in libraries:
+                self.catalog["catalogs"].append(self.entry_for(library))
         annotator.annotate_catalog(self, live=live)
 
+    @property
+    def streaming(self):
+        return self.libraries is not None
+
+    def entry_for(self, library):
+        """Build this catalog's entry for a library.
+
+        :param library: A Library, or a 2-tuple (Library, distance).
+        """
+        if not isinstance(library, tuple):
+            library = (library,)
+        return self.library_catalog(*library, **self.library_catalog_kwargs)
+
+    def entries(self):
+        """Yield this catalog's entry for each library, building them as
+        necessary.
+        """
+        if self.streaming:
+            for library in self.libraries:
+                yield self.entry_for(library)
+        else:
+            yield from self.catalog["catalogs"]
+
+    def serialized_entries(self):
+        """Yield this catalog's entry for each library as JSON.
+
+        :yield: A sequence of 2-tuples (library URN, JSON string).
+        """
+        if self.streaming:
+            for library in self.libraries:
+                if not isinstance(library, tuple):
+                    library = (library,)
+                yield library[0].internal_urn, self.serialized_library_catalog(
+                    *library, **self.library_catalog_kwargs
+                )
+        else:
+            for entry in self.catalog["catalogs"]:
+                yield entry["metadata"]["id"], json.dumps(entry)
+
     @classmethod
     def _feed_is_large(cls, _db, libraries):
         """Determine whether a prospective feed is 'large' per a sitewide setting.
@@ -99,12 +171,13 @@ class OPDSCatalog:
         :param libraries: A list of libraries (or anything else that might be
             going into a feed).
         """
-        large_feed_size = ConfigurationSetting.sitewide(
+        large_feed_size = ConfigurationSetting.sitewide_value(
             _db, Configuration.LARGE_FEED_SIZE
-        ).int_value
-        if large_feed_size is None:
+        )
+        if not large_feed_size:
             # No limit
             return False
+        large_feed_size = int(large_feed_size)
         if isinstance(libraries, Query):
             # This is a SQLAlchemy query.
             size = libraries.count()
@@ -242,6 +315,75 @@ class OPDSCatalog:
             )
         return catalog
 
+    @classmethod
+    def serialized_library_catalog(cls, library, distance=None, **kwargs):
+        """Create an OPDS catalog for a library, as JSON.
+
+        The JSON is cached, and reused until something changes that
+        would make the catalog look different. This takes the same
+        arguments as library_catalog().
+
+        :return: A string.
+        """
+        key = cls._fragment_cache_key(library, distance, **kwargs)
+        if key is None:
+            return json.dumps(cls.library_catalog(library, distance, **kwargs))
+        if distance is None:
+            cache = cls.FRAGMENT_CACHE
+        else:
+            cache = cls.DISTANCE_FRAGMENT_CACHE
+        return cache.get_or_set(
+            key, lambda: json.dumps(cls.library_catalog(library, distance, **kwargs))
+        )
+
+    @classmethod
+    def _fragment_cache_key(
+        cls,
+        library,
+        distance=None,
+        include_private_information=False,
+        include_logo=True,
+        url_for=None,
+        web_client_uri_template=None,
+        include_service_area=False,
+    ):
+        """Identify everything that goes into a library's catalog.
+
+        :return: A hashable value, or None if the catalog can't be cached.
+        """
+        if library.id is None or url_for is not None:
+            # Either the library hasn't been saved, or we can't tell
+            # what URLs will be generated for it.
+            return None
+        if not flask.has_request_context():
+            return None
+
+        # Changes to a library's hyperlinks and their validations
+        # update the library's timestamp, but a validation can also
+        # expire just because time has passed.
+        validations = []
+        for hyperlink in library.hyperlinks:
+            validation = hyperlink.resource and hyperlink.resource.validation
+            if validation:
+                validations.append(
+                    (hyperlink.id, validation.success, validation.active)
+                )
+
+        if distance is not None:
+            # Distances are only shown to the nearest kilometer.
+            distance = int(distance / 1000)
+        return (
+            library.id,
+            library.timestamp,
+            distance,
+            include_private_information,
+            include_logo,
+            include_service_area,
+            web_client_uri_template,
+            flask.request.url_root,
+            tuple(validations),
+        )
+
     @classmethod
     def _hyperlink_args(cls, hyperlink):
         """Turn a Hyperlink into a dictionary of arguments that can
@@ -273,8 +415,137 @@ class OPDSCatalog:
             args["properties"] = properties
         return args
 
+    @classmethod
+    def json_chunks(cls, catalog, serialized_catalogs):
+        """Turn a catalog into JSON a piece at a time, using JSON that
+        was generated separately for the entries in its "catalogs"
+        collection.
+
+        Put together, the pieces are the same as what json.dumps()
+        would produce for the complete catalog.
+
+        :param catalog: A dictionary like OPDSCatalog.catalog. Its
+            "catalogs" collection is ignored.
+        :param serialized_catalogs: An iterable of strings, each
+            containing one library's entry as JSON. This may be a
+            generator; it won't be consumed until it's needed.
+
+        :yield: A sequence of strings, most of them around
+            STREAM_CHUNK_SIZE characters long.
+        """
+        buffer = []
+        size = 0
+
+        def parts():
+            yield "{"
+            for i, (key, value) in enumerate(catalog.items()):
+                if i:
+                    yield ", "
+                yield json.dumps(key) + ": "
+                if key != "catalogs":
+                    yield json.dumps(value)
+                    continue
+                yield "["
+                for j, serialized in enumerate(serialized_catalogs):
+                    if j:
+                        yield ", "
+                    yield serialized
+                yield "]"
+            yield "}"
+
+        for part in parts():
+            buffer.append(part)
+            size += len(part)
+            if size >= cls.STREAM_CHUNK_SIZE:
+                yield "".join(buffer)
+                buffer = []
+                size = 0
+        if buffer:
+            yield "".join(buffer)
+
+    @classmethod
+    def serialize(cls, catalog, serialized_catalogs):
+        """Turn a catalog into JSON, using JSON that was generated earlier
+        for the entries in its "catalogs" collection.
+
+        :return: A string.
+        """
+        return "".join(cls.json_chunks(catalog, serialized_catalogs))
+
+    def chunks(self):
+        """Generate this catalog's JSON representation a piece at a time.
+
+        If this is a streaming catalog, each library's entry is built
+        just before it's serialized, and discarded afterwards.
+        """
+        serialized = (entry for urn, entry in self.serialized_entries())
+        return self.json_chunks(self.catalog, serialized)
+
     def __str__(self):
         if self.catalog is None:
             return None
 
+        if self.streaming:
+            return "".join(self.chunks())
         return json.dumps(self.catalog)
+
+
+class SerializedCatalog:
+    """An OPDSCatalog that has already been converted to JSON, so that
+    it can be served many times without being rebuilt.
+
+    Each library's entry is kept as a separate piece of JSON, so that
+    entries can be moved to the front of the list (e.g. because the
+    libraries are near the client) without rebuilding the others.
+    """
+
+    def __init__(self, catalog):
+        """Constructor.
+
+        :param catalog: An OPDSCatalog.
+        """
+        self.library_catalog_kwargs = catalog.library_catalog_kwargs
+        # Everything but the library entries. The "catalogs" key is
+        # kept, so that the keys are serialized in their original order.
+        self.envelope = dict(catalog.catalog, catalogs=None)
+        self.entries = list(catalog.serialized_entries())
+        self.data = self.serialize().encode("utf8")
+
+    def serialize(self, first=None):
+        """Convert this catalog to JSON.
+
+        :param first: See chunks().
+        :return: A string.
+        """
+        return "".join(self.chunks(first))
+
+    def chunks(self, first=None):
+        """Convert this catalog to JSON a piece at a time.
+
+        :param first: A list of libraries (or (library, distance)
+            2-tuples) whose entries should be built from scratch and
+            placed at the front of the list. If any of these libraries
+            are already in the catalog, their original entries are
+            omitted.
+
+        :yield: A sequence of strings.
+        """
+        first = first or []
+        first_entries = []
+        exclude = set()
+        for library in first:
+            if isinstance(library, tuple):
+                exclude.add(library[0].internal_urn)
+                args = library
+            else:
+                exclude.add(library.internal_urn)
+                args = (library,)
+            first_entries.append(
+                OPDSCatalog.serialized_library_catalog(
+                    *args, **self.library_catalog_kwargs
+                )
+            )
+        rest = (entry for urn, entry in self.entries if urn not in exclude)
+        return OPDSCatalog.json_chunks(
+            self.envelope, itertools.chain(first_entries, rest)
+        )
@@ -1,9 +1,14 @@
 import argparse
+import datetime
+import gzip
 import json
 import logging
 import os
+import shutil
 import sys
 
+import flask
+
 from adobe_vendor_id import AdobeVendorIDClient
 from authentication_document import AuthenticationDocument
 from config import Configuration
@@ -131,6 +136,7 @@ class LoadPlacesScript(Script):
         parsed, stdin = self.parse_command_line(self._db, cmd_args, stdin)
         loader = GeometryLoader(self._db)
         a = 0
+        place_ids = []
         for place, is_new in loader.load_ndjson(stdin):
             if is_new:
                 what = "NEW"
@@ -140,6 +146,18 @@ class LoadPlacesScript(Script):
             a += 1
             if not a % 1000:
                 self._db.commit()
+            place_ids.append(place.id)
+        self._db.commit()
+
+        # Now that every place is in the database, work out which
+        # places overlap the ones that were loaded.
+        Place.update_overlaps(self._db.connection(), place_ids)
+
+        # Let other processes know that anything they've worked out
+        # from the old places is stale.
+        ConfigurationSetting.sitewide(
+            self._db, Configuration.PLACES_LOADED_AT
+        ).value = datetime.datetime.utcnow().isoformat()
         self._db.commit()
 
 
@@ -334,6 +352,135 @@ class RegistrationRefreshScript(LibraryScript):
         return LibraryRegistrar(self._db)
 
 
+class SnapshotFeedsScript(LibraryScript):
+    """Write the production and QA library feeds, and the entry for each
+    library, to files that a web server can send without involving
+    the application.
+
+    A feed at /path is written to <directory>/path/index.json, with a
+    gzipped copy at index.json.gz. docker/nginx.conf serves these
+    files when they exist, and passes the request on to the
+    application when they don't.
+
+    The snapshots are only as fresh as the last time this script ran,
+    and the /libraries snapshot doesn't move libraries near the client
+    to the front of the list.
+    """
+
+    REQUIRES_SINGLE_LIBRARY = False
+
+    DEFAULT_DIRECTORY = "/var/lib/library_registry/snapshots"
+    FILENAME = "index.json"
+
+    @classmethod
+    def arg_parser(cls):
+        parser = super().arg_parser()
+        parser.add_argument(
+            "--directory",
+            help="Write snapshots to this directory.",
+            default=cls.DEFAULT_DIRECTORY,
+        )
+        parser.add_argument(
+            "--base-url",
+            help="The URL to the registry. Defaults to the base_url site-wide setting.",
+        )
+        return parser
+
+    def __init__(self, _db=None, app=None):
+        super().__init__(_db)
+        self._app = app
+
+    @property
+    def app(self):
+        if self._app is None:
+            # Importing the web application sets up its database
+            # connection, so only do it when necessary.
+            from app import app
+
+            self._app = app
+        return self._app
+
+    def run(self, cmd_args=None):
+        parsed = self.parse_command_line(self._db, cmd_args)
+        base_url = parsed.base_url or ConfigurationSetting.sitewide_value(
+            self._db, Configuration.BASE_URL
+        )
+        if not base_url:
+            raise ValueError(
+                "No base URL provided, and the base_url site-wide setting is not set."
+            )
+        controller = self.app.library_registry.registry_controller
+
+        self.snapshot(
+            parsed.directory,
+            "/libraries",
+            base_url,
+            lambda: controller.libraries_opds(live=True),
+        )
+        self.snapshot(
+            parsed.directory,
+            "/libraries/qa",
+            base_url,
+            lambda: controller.libraries_opds(live=False),
+        )
+
+        urns = set()
+        for library in self.libraries(parsed.library):
+
+            def library_feed():
+                flask.request.library = library
+                return controller.library()
+
+            self.snapshot(
+                parsed.directory,
+                "/library/" + library.internal_urn,
+                base_url,
+                library_feed,
+            )
+            urns.add(library.internal_urn)
+
+        if not parsed.library:
+            # Libraries that are no longer in the feeds shouldn't be
+            # served from stale snapshots.
+            self.remove_snapshots(os.path.join(parsed.directory, "library"), urns)
+
+    def snapshot(self, directory, path, base_url, render):
+        """Render a feed and write it to disk.
+
+        :param path: The path to the feed, as seen by a client.
+        :param render: A function that returns a Response containing
+            the feed. It will be called inside a request for `path`.
+        """
+        with self.app.test_request_context(path, base_url=base_url):
+            data = render().get_data()
+        self.write(os.path.join(directory, path.strip("/")), data)
+        self.log.info("Wrote snapshot of %s (%d bytes)", path, len(data))
+
+    def write(self, directory, data):
+        """Write a snapshot and its gzipped equivalent to a directory."""
+        os.makedirs(directory, exist_ok=True)
+        filename = os.path.join(directory, self.FILENAME)
+        for path, content in (
+            (filename, data),
+            (filename + ".gz", gzip.compress(data)),
+        ):
+            # Write to a temporary file first, so the web server
+            # never sends a half-written snapshot.
+            temporary = path + ".tmp"
+            with open(temporary, "wb") as out:
+                out.write(content)
+            os.replace(temporary, path)
+
+    def remove_snapshots(self, directory, keep):
+        """Remove every snapshot in `directory` except those in `keep`."""
+        if not os.path.isdir(directory):
+            return
+        for name in os.listdir(directory):
+            if name not in keep:
+                shutil.rmtree(os.path.join(directory, name))
+                self.log.info("Removed snapshot of /library/%s", name)
+
+
 class AdobeVendorIDAcceptanceTestScript(Script):
     """Verify basic Adobe Vendor ID functionality, the way Adobe does
     when testing compliance.
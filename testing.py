@@ -6,6 +6,7 @@ from io import BytesIO
 from sqlalchemy.orm.exc import MultipleResultsFound, NoResultFound
 from sqlalchemy.orm.session import Session
 
+import app_helpers
 from config import Configuration
 from log import LogConfiguration
 from model import (
@@ -16,12 +17,15 @@ from model import (
     ExternalIntegration,
     Hyperlink,
     Library,
+    LibraryNameIndex,
     Place,
     PlaceAlias,
+    PlaceNameIndex,
     ServiceArea,
     SessionManager,
     get_one_or_create,
 )
+from opds import OPDSCatalog
 from util import GeometryUtility
 from util.http import BadResponseException
 
@@ -74,7 +78,25 @@ class DatabaseTest:
         if "TESTING" in os.environ:
             del os.environ["TESTING"]
 
+    @classmethod
+    def clear_caches(cls):
+        """Forget everything cached for the whole process, so that no
+        test depends on what an earlier test happened to cache.
+        """
+        ConfigurationSetting.clear_cache()
+        Library.NEARBY_CACHE.clear()
+        Library.SEARCH_CACHE.clear()
+        LibraryNameIndex.clear_cache()
+        LibraryNameIndex._building = False
+        PlaceNameIndex.clear_cache()
+        OPDSCatalog.FRAGMENT_CACHE.clear()
+        OPDSCatalog.DISTANCE_FRAGMENT_CACHE.clear()
+        GeometryUtility.IP_LOCATION_CACHE.clear()
+        app_helpers.compressed_representations.clear()
+
     def setup_method(self):
+        self.clear_caches()
+
         # Create a new connection to the database.
         self._db = Session(self.connection)
         self.transaction = self.connection.begin_nested()
@@ -101,6 +123,10 @@ class DatabaseTest:
         # other session.
         self.transaction.rollback()
 
+        # Anything cached during the test may describe data that was
+        # just rolled back.
+        self.clear_caches()
+
     @property
     def _id(self):
         self.counter += 1
@@ -252,6 +278,8 @@ class DatabaseTest:
             parent=parent,
         )
         place.geometry = geometry
+        self._db.flush()
+        Place.update_overlaps(self._db.connection(), [place.id])
         self._db.commit()
         return place
 
@@ -602,6 +630,17 @@ class MockPlace:
             raise NoResultFound()
         return place
 
+    def lookup_many_inside(self, names):
+        found = dict()
+        unknown = []
+        ambiguous = []
+        for name in names:
+            try:
+                found[name] = self.lookup_inside(name)
+            except MultipleResultsFound:
+                ambiguous.append(name)
+        return found, unknown, ambiguous
+
     @classmethod
     def everywhere(cls, _db):
         return cls.EVERYWHERE
@@ -1,14 +1,22 @@
 import gzip
+import os
+import time
 from io import BytesIO
+from unittest import mock
 
+import brotli
 import flask
 
+import app_helpers
 from app_helpers import (
+    _choose_encoding,
+    compressed_representations,
     compressible,
     has_library_factory,
     require_admin_authentication,
     uses_location_factory,
 )
+from config import Configuration
 from model import Admin
 from problem_details import LIBRARY_NOT_FOUND
 
@@ -111,6 +119,111 @@ class TestAppHelpers(ControllerTest):
         assert response.data == value
         assert "Content-Encoding" not in response.headers
 
+    def test_compressible_streaming_response(self):
+        # A streaming response is compressed as it's streamed out.
+        chunks = [b"Compress ", b"me ", b"a piece at a time."]
+
+        @compressible
+        def function():
+            return flask.Response(iter(chunks))
+
+        with self.app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+            response = function()
+            self.app.process_response(response)
+            assert response.is_streamed
+            assert response.headers["Content-Encoding"] == "gzip"
+            assert "Content-Length" not in response.headers
+            assert gzip.decompress(response.data) == b"".join(chunks)
+
+    def test_compressible_caches_compressed_representation(self):
+        value = b"Compress me once."
+
+        @compressible
+        def function():
+            response = flask.Response(value)
+            response.set_etag("an-etag")
+            return response
+
+        def request():
+            with self.app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+                response = function()
+                self.app.process_response(response)
+                return response
+
+        with mock.patch("app_helpers._compress", wraps=app_helpers._compress) as m:
+            response1 = request()
+            response2 = request()
+
+        # The value was only compressed once.
+        assert m.call_count == 1
+        assert response1.data == response2.data
+        assert gzip.decompress(response2.data) == value
+        assert ("an-etag", "gzip", 9) in compressed_representations
+
+        # Since the representation was changed, the ETag became weak.
+        assert response2.headers["ETag"] == 'W/"an-etag"'
+
+        # A stored representation is eventually forgotten.
+        later = time.time() + app_helpers.COMPRESSED_REPRESENTATION_MAX_AGE
+        with mock.patch("util.cache.time.time", return_value=later):
+            assert compressed_representations.get(("an-etag", "gzip", 9)) is None
+
+        # The compression level can be configured.
+        with mock.patch.dict(
+            os.environ, {Configuration.GZIP_COMPRESSION_LEVEL: "1"}
+        ), mock.patch("app_helpers._compress", wraps=app_helpers._compress) as m:
+            response = request()
+        m.assert_called_once_with(value, "gzip", 1)
+        assert gzip.decompress(response.data) == value
+
+    def test_compressible_caches_streaming_response(self):
+        chunks = [b"Compress ", b"me ", b"a piece at a time."]
+
+        @compressible
+        def function():
+            response = flask.Response(iter(chunks))
+            response.set_etag("a-streaming-etag")
+            return response
+
+        def request():
+            with self.app.test_request_context(headers={"Accept-Encoding": "gzip"}):
+                response = function()
+                self.app.process_response(response)
+                return response
+
+        # The first time, the response is compressed as it's streamed,
+        # and the compressed representation is stored once it's complete.
+        response = request()
+        assert response.is_streamed
+        data = response.data
+        assert gzip.decompress(data) == b"".join(chunks)
+
+        # The second time, the stored representation is used.
+        response = request()
+        assert not response.is_streamed
+        assert response.data == data
+
+    def test_compressible_brotli(self):
+        value = b"Compress me with brotli."
+
+        @compressible
+        def function():
+            return value
+
+        with self.app.test_request_context(
+            headers={"Accept-Encoding": "gzip, deflate, br"}
+        ):
+            response = flask.Response(function())
+            self.app.process_response(response)
+        assert response.headers["Content-Encoding"] == "br"
+        assert brotli.decompress(response.data) == value
+
+    def test__choose_encoding(self):
+        assert _choose_encoding("gzip, deflate, br") == "br"
+        assert _choose_encoding("br;q=1.0") == "br"
+        assert _choose_encoding("gzip") == "gzip"
+        assert _choose_encoding("broken") is None
+
     def test_auth_admin_only(self):
         @require_admin_authentication
         def test_fn():
@@ -5,7 +5,8 @@ import os
 import random
 from contextlib import contextmanager
 from smtplib import SMTPException
-from urllib.parse import unquote
+from unittest import mock
+from urllib.parse import parse_qs, unquote, urlparse
 
 import flask
 from Crypto.Cipher import PKCS1_OAEP
@@ -45,6 +46,7 @@ from problem_details import (
     INTEGRATION_ERROR,
     INVALID_CREDENTIALS,
     INVALID_INTEGRATION_DOCUMENT,
+    INVALID_PAGINATION,
     LIBRARY_NOT_FOUND,
     NO_AUTH_URL,
     TIMEOUT,
@@ -525,6 +527,171 @@ class TestLibraryRegistryController(ControllerTest):
                 "NYPL",
             ]
 
+    def test_libraries_opds_cached(self):
+        # The feed of all libraries is built once, and served from
+        # memory until one of the things it depends on changes.
+        ks = self.kansas_state_library
+        self._db.commit()
+
+        def titles(response):
+            return [
+                x["metadata"]["title"] for x in json.loads(response.data)["catalogs"]
+            ]
+
+        with self.app.test_request_context("/libraries"):
+            response1 = self.controller.libraries_opds()
+            feed = self.controller.libraries_feed()
+            response2 = self.controller.libraries_opds()
+            assert response1.data == response2.data
+            assert feed.data == response2.data
+            assert self.controller.libraries_feed() is feed
+
+            # The production and QA feeds are cached separately.
+            assert self.controller.libraries_feed(live=False) is not feed
+
+            # A location-aware request uses the cached feed, with the
+            # nearby library moved to the front.
+            nypl = self.nypl
+            ct = self.connecticut_state_library
+            self._db.commit()
+            response = self.controller.libraries_opds(
+                location="SRID=4326;POINT(-98 39)"
+            )
+            assert titles(response) == [ks.name, ct.name, nypl.name]
+
+            # Creating the libraries invalidated the cached feed, and
+            # it was rebuilt.
+            assert self.controller.libraries_feed() is not feed
+            feed = self.controller.libraries_feed()
+
+            # Changing a library invalidates the cached feed.
+            ks.name = "Kansas Library"
+            self._db.commit()
+            assert self.controller.libraries_feed() is not feed
+            response = self.controller.libraries_opds()
+            assert titles(response) == [ct.name, ks.name, nypl.name]
+
+            # So does a change made by another process, which this
+            # process never hears about.
+            feed = self.controller.libraries_feed()
+            self._db.execute(
+                Library.__table__.update()
+                .where(Library.id == ct.id)
+                .values(name="Nutmeg Library", timestamp=datetime.datetime.utcnow())
+            )
+            self._db.expire_all()
+            response = self.controller.libraries_opds()
+            assert "Nutmeg Library" in titles(response)
+            assert self.controller.libraries_feed() is not feed
+
+    def test_libraries_opds_conditional_get(self):
+        ks = self.kansas_state_library
+        self._db.commit()
+
+        with self.app.test_request_context("/libraries"):
+            response = self.controller.libraries_opds()
+            assert response.status_code == 200
+            etag = response.headers["ETag"]
+            last_modified = response.headers["Last-Modified"]
+
+        # A client that has the current version of the feed gets a
+        # 304 response, and the feed isn't built.
+        self.controller.libraries_feed_cache.clear()
+        with self.app.test_request_context(
+            "/libraries", headers={"If-None-Match": etag}
+        ):
+            response = self.controller.libraries_opds()
+            assert response.status_code == 304
+            assert response.headers["ETag"] == etag
+        assert len(self.controller.libraries_feed_cache) == 0
+
+        # So does a client whose copy of the feed is as recent as the
+        # last change to any library.
+        with self.app.test_request_context(
+            "/libraries", headers={"If-Modified-Since": last_modified}
+        ):
+            response = self.controller.libraries_opds()
+            assert response.status_code == 304
+        assert len(self.controller.libraries_feed_cache) == 0
+
+        # But a feed that depends on the client's location can only be
+        # checked by its ETag, so it isn't sent with a Last-Modified
+        # header.
+        with self.app.test_request_context(
+            "/libraries", headers={"If-Modified-Since": last_modified}
+        ):
+            response = self.controller.libraries_opds(
+                location="SRID=4326;POINT(-98 39)"
+            )
+            assert response.status_code == 200
+            assert "Last-Modified" not in response.headers
+
+        # The QA feed has a different ETag.
+        with self.app.test_request_context(
+            "/libraries/qa", headers={"If-None-Match": etag}
+        ):
+            response = self.controller.libraries_opds(live=False)
+            assert response.status_code == 200
+
+        # So does a feed for a different location.
+        with self.app.test_request_context(
+            "/libraries", headers={"If-None-Match": etag}
+        ):
+            response = self.controller.libraries_opds(
+                location="SRID=4326;POINT(-98 39)"
+            )
+            assert response.status_code == 200
+
+        # Changing a library's hyperlinks changes its timestamp, and
+        # so the feed gets a new ETag.
+        ks.set_hyperlink("help", "mailto:help@library.org")
+        self._db.commit()
+        with self.app.test_request_context(
+            "/libraries", headers={"If-None-Match": etag}
+        ):
+            response = self.controller.libraries_opds()
+            assert response.status_code == 200
+            assert response.headers["ETag"] != etag
+
+    def test_libraries_opds_page(self):
+        ct = self.connecticut_state_library
+        ks = self.kansas_state_library
+        nypl = self.nypl
+
+        def page(**args):
+            with self.app.test_request_context("/libraries", query_string=args):
+                response = self.controller.libraries_opds()
+                if isinstance(response, ProblemDetail):
+                    return response
+                return json.loads(response.data)
+
+        def titles(feed):
+            return [x["metadata"]["title"] for x in feed["catalogs"]]
+
+        def next_link(feed):
+            [link] = [x["href"] for x in feed["links"] if x["rel"] == "next"] or [None]
+            return link
+
+        first = page(size=2)
+        assert titles(first) == [ct.name, ks.name]
+        # The next page starts after the last library on this page.
+        after = "%s,%d" % (ks.name, ks.id)
+        args = parse_qs(urlparse(next_link(first)).query)
+        assert args == dict(size=["2"], after=[after])
+
+        # Follow the link to the next page, which is the last one.
+        second = page(size=2, after=after)
+        assert titles(second) == [nypl.name]
+        assert next_link(second) is None
+
+        # Without a size, the default page size is used.
+        assert titles(page(after=after)) == [nypl.name]
+
+        # Bad pagination parameters are rejected.
+        for args in (dict(size="big"), dict(size=0), dict(after="no id")):
+            problem = page(**args)
+            assert problem.uri == INVALID_PAGINATION.uri
+
     def test_library_details(self):
         # Test that the controller can look up the complete information for one specific library.
         library = self.nypl
@@ -1050,6 +1217,13 @@ class TestLibraryRegistryController(ControllerTest):
         assert catalog_entry.get("metadata").get("title") == nypl.name
         assert catalog_entry.get("metadata").get("id") == nypl.internal_urn
 
+        # If the client already has this version of the entry, it
+        # gets a 304 response.
+        headers = {"If-None-Match": response.headers["ETag"]}
+        with self.request_context_with_library("/", library=nypl, headers=headers):
+            response = self.controller.library()
+        assert response.status_code == 304
+
     def queue_opds_success(
         self, auth_url="http://circmanager.org/authentication.opds", media_type=None
     ):
@@ -2172,6 +2346,54 @@ class TestCoverageController(ControllerTest):
         massachussets.external_name = "Kansas"
         self.parse_to("Kansas", [], ambiguous={"US": ["Kansas"]})
 
+    def test_lookup_is_cached(self):
+        boston = self.boston_ma
+        self._db.commit()
+
+        def lookup(coverage):
+            with self.app.test_request_context(
+                "/", query_string=dict(coverage=coverage)
+            ):
+                return json.loads(self.controller.lookup().data)
+
+        with mock.patch.object(
+            self.controller,
+            "_coverage_geojson",
+            wraps=self.controller._coverage_geojson,
+        ) as build:
+            expect = Place.to_geojson(self._db, boston)
+            assert expect == lookup('{"US": "Boston, MA"}')
+            assert 1 == build.call_count
+
+            # The same coverage document, formatted differently, is
+            # served from the cache.
+            assert expect == lookup('{ "US" :  "Boston, MA" }')
+            assert 1 == build.call_count
+
+            # A different document is not.
+            assert {"US": ["Nowhere"]} == lookup('{"US": "Nowhere"}')["unknown"]
+            assert 2 == build.call_count
+
+            # Once a Place changes, the cached document is rebuilt.
+            boston.abbreviated_name = "BOS"
+            self._db.commit()
+            assert expect == lookup('{"US": "Boston, MA"}')
+            assert 3 == build.call_count
+
+            # So it is once another process reloads the places.
+            self._db.execute(
+                ConfigurationSetting.__table__.insert().values(
+                    key=Configuration.PLACES_LOADED_AT, value="2026-01-01T00:00:00"
+                )
+            )
+            assert expect == lookup('{"US": "Boston, MA"}')
+            assert 4 == build.call_count
+
+        # The cache is limited by the total size of the documents in it.
+        cache = self.controller.coverage_cache
+        assert cache.sizeof is len
+        assert 0 < cache.total_size <= CoverageController.COVERAGE_CACHE_SIZE
+
     def test_library_eligibility_and_focus(self):
         # focus_for_library() and eligibility_for_library() represent
         # a library's service area as GeoJSON.
@@ -60,6 +60,36 @@ class TestGeometryLoader(DatabaseTest):
         [[distance]] = distance_qu.all()
         assert int(distance / 1000) == 2637
 
+    def test_simplified_geometry(self):
+        # When a place is loaded, the database calculates simplified
+        # versions of its geometry.
+        metadata = (
+            '{"parent_id": null, "name": "77977", "id": "77977", "type": "postal_code"}'
+        )
+        geography = '{"type": "Polygon", "coordinates": [[[-96.84, 28.68], [-96.8022, 28.7045], [-96.76, 28.72], [-96.79, 28.66], [-96.84, 28.68]]]}'
+        place, is_new = self.loader.load(metadata, geography)
+        self._db.flush()
+
+        def points(column):
+            qu = self._db.query(func.ST_NPoints(column)).filter(Place.id == place.id)
+            return qu.scalar()
+
+        # The second vertex is only about 500 meters from the line
+        # between its neighbors, so it survives the finer
+        # simplification but not the coarser one.
+        assert points(Place.geometry) == 5
+        assert points(Place.simplified_geometry) == 5
+        assert points(Place.coarse_geometry) == 4
+
+        # If the place is loaded again with a different geometry, the
+        # simplified geometries are recalculated.
+        geography = '{"type": "Point", "coordinates": [-96.8, 28.7]}'
+        self.loader.load(metadata, geography)
+        self._db.flush()
+        for column in Place.simplified_geometry, Place.coarse_geometry:
+            qu = self._db.query(func.ST_AsText(column)).filter(Place.id == place.id)
+            assert qu.scalar() == "POINT(-96.8 28.7)"
+
     def test_load_ndjson(self):
         # Create a preexisting Place with an alias.
         old_us, is_new = get_one_or_create(
@@ -5,7 +5,7 @@ from unittest import mock
 
 import psycopg2
 import pytest
-from sqlalchemy import func
+from sqlalchemy import event, func, select
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import MultipleResultsFound
 
@@ -17,6 +17,7 @@ from emailer import Emailer
 from model import (
     Admin,
     Audience,
+    ChangeCounter,
     CollectionSummary,
     ConfigurationSetting,
     DelegatedPatronIdentifier,
@@ -24,12 +25,17 @@ from model import (
     Hyperlink,
     Library,
     LibraryAlias,
+    LibraryNameIndex,
     LibraryType,
     Place,
     PlaceAlias,
+    PlaceNameIndex,
+    ServiceArea,
     Validation,
     create,
+    get_one,
     get_one_or_create,
+    place_overlaps,
 )
 from util import GeometryUtility
 
@@ -159,6 +165,29 @@ class TestPlace(DatabaseTest):
         for check in [self.zip_10018_geojson, self.zip_11212_geojson]:
             assert json.loads(check) in geojson["geometries"]
 
+        # geojson_document() builds the same documents as strings,
+        # spliced together from each Place's stored GeoJSON, and can
+        # add extra fields to them.
+        document = Place.geojson_document(self._db, zip1, unknown=["Nowhere"])
+        assert dict(json.loads(self.zip_10018_geojson), unknown=["Nowhere"]) == (
+            json.loads(document)
+        )
+        document = Place.geojson_document(self._db, zip1, zip2, ambiguous=["X"])
+        assert ["X"] == json.loads(document)["ambiguous"]
+        assert 2 == len(json.loads(document)["geometries"])
+
+        # GeoJSON is stored with reduced precision.
+        zip1.geometry = GeometryUtility.from_geojson(
+            '{"type": "Point", "coordinates": [-74.0072031234, 40.7592701234]}'
+        )
+        self._db.commit()
+        assert {"type": "Point", "coordinates": [-74.007203, 40.75927]} == (
+            Place.to_geojson(self._db, zip1)
+        )
+        assert '{"type": "GeometryCollection", "geometries": []}' == (
+            Place.geojson_document(self._db)
+        )
+
     def test_overlaps_not_counting_border(self):
         """Test that overlaps_not_counting_border does not count places
         that share a border as intersecting, the way the PostGIS
@@ -190,6 +219,41 @@ class TestPlace(DatabaseTest):
         assert s_i(new_york, connecticut) is False
         assert s_i(connecticut, new_york) is False
 
+    def test_update_overlaps(self):
+        nyc = self.new_york_city
+        new_york = self.new_york_state
+        connecticut = self.connecticut_state
+        us = self.crude_us
+        everywhere = Place.everywhere(self._db)
+        self._db.flush()
+
+        def overlaps(place):
+            qu = self._db.query(place_overlaps.c.overlapping_place_id).filter(
+                place_overlaps.c.place_id == place.id
+            )
+            return {self._db.query(Place).get(id) for [id] in qu}
+
+        # Which places overlap was calculated as the test places were
+        # created. Unlike overlaps_not_counting_border, this counts a
+        # shared border, the way PostGIS does.
+        assert {nyc, new_york} == overlaps(nyc)
+        assert {nyc, new_york, connecticut} == overlaps(new_york)
+        assert {new_york, connecticut} == overlaps(connecticut)
+
+        # Nations are left out, and a place with no geometry doesn't
+        # overlap anything.
+        assert set() == overlaps(us)
+        assert set() == overlaps(everywhere)
+
+        # Changing a place's geometry doesn't change its overlaps
+        # until they're recalculated, in both directions.
+        connecticut.geometry = "SRID=4326;POINT(-73.94 40.65)"
+        self._db.flush()
+        assert {new_york, connecticut} == overlaps(connecticut)
+        Place.update_overlaps(self._db.connection(), [connecticut.id])
+        assert {nyc, new_york, connecticut} == overlaps(connecticut)
+        assert {nyc, new_york, connecticut} == overlaps(nyc)
+
     def test_parse_name(self):
         m = Place.parse_name
         assert m("Kern County") == ("Kern", Place.COUNTY)
@@ -369,6 +433,94 @@ class TestPlace(DatabaseTest):
         assert zip_10018.lookup_inside("New York", using_overlap=True) == nyc
         assert zip_10018.lookup_inside("New York", using_overlap=False) is None
 
+    def test_place_name_index(self):
+        us = self.crude_us
+        new_york = self.new_york_state
+        nyc = self.new_york_city
+        zip_10018 = self.zip_10018
+        kings_county = self.crude_kings_county
+        alias = PlaceAlias(place=new_york, name="Empire", language="eng")
+        self._db.add(alias)
+        self._db.commit()
+
+        index = PlaceNameIndex(self._db)
+        m = index.find_inside
+        assert [new_york.id] == m(us, "NY")
+        assert [new_york.id] == m(us, "New York")
+        assert [new_york.id] == m(us, "New York State")
+        assert [new_york.id] == m(us, "Empire")
+        assert [nyc.id] == m(new_york, "New York")
+        assert [kings_county.id] == m(new_york, "Kings County")
+
+        # A postal code can be found inside its parent or grandparent.
+        assert [zip_10018.id] == m(new_york, "10018")
+        assert [zip_10018.id] == m(us, "10018")
+
+        # Counties are only found if asked for, and a place isn't found
+        # inside a smaller place.
+        assert [] == m(new_york, "Kings")
+        assert [] == m(new_york, "US")
+        assert [] == m(us, "New York, NY")
+
+        # lookup_inside uses the index rather than querying the
+        # database.
+        with mock.patch.object(
+            Place,
+            "_lookup_inside_query",
+            autospec=True,
+            side_effect=Place._lookup_inside_query,
+        ) as query:
+            assert nyc == us.lookup_inside("New York, NY")
+            assert zip_10018 == us.lookup_inside("10018")
+            assert 0 == query.call_count
+
+            # If the index can't find a place, the database is checked
+            # in case the place was loaded by another process.
+            assert None == us.lookup_inside("Nowhere", using_external_source=False)
+            assert 1 == query.call_count
+
+            # If this session has changed places, the index isn't used,
+            # since it can't see the changes.
+            nyc.abbreviated_name = "NYC"
+            assert nyc == new_york.lookup_inside("NYC")
+            assert 2 == query.call_count
+
+            # Once the change is committed, the index is rebuilt.
+            self._db.commit()
+            assert nyc == new_york.lookup_inside("NYC")
+            assert 2 == query.call_count
+
+    def test_lookup_many_inside(self):
+        us = self.crude_us
+        nyc = self.new_york_city
+        zip_10018 = self.zip_10018
+        self._db.commit()
+
+        # Two Places with the same name inside the same state are
+        # ambiguous.
+        for i in range(2):
+            self._place(
+                type=Place.CITY, parent=self.new_york_state, external_name="Springfield"
+            )
+        self._db.commit()
+
+        with mock.patch.object(
+            Place,
+            "_lookup_inside_query",
+            autospec=True,
+            side_effect=Place._lookup_inside_query,
+        ) as query:
+            found, unknown, ambiguous = us.lookup_many_inside(
+                ["New York, NY", "10018", "Nowhere", "Springfield, NY"]
+            )
+        assert dict(zip(["New York, NY", "10018"], [nyc, zip_10018])) == found
+        assert ["Nowhere"] == unknown
+        assert ["Springfield, NY"] == ambiguous
+
+        # Only the name that couldn't be found in the index was looked
+        # up individually.
+        assert 1 == query.call_count
+
     def test_lookup_one_through_external_source(self):
         # We're going to find the approximate location of Poughkeepsie
         # even though the database doesn't have a Place named
@@ -411,6 +563,55 @@ class TestPlace(DatabaseTest):
         # geographically inside the Place whose method you're calling.
         assert connecticut.lookup_one_through_external_source("Poughkeepsie") is None
 
+        # A ZIP code inside a county inside the state is found too.
+        dutchess = self._place("36027", "Dutchess", Place.COUNTY, None, new_york, None)
+        zip_12603 = self._place(
+            "12603", "12603", Place.POSTAL_CODE, None, dutchess, None
+        )
+        with mock.patch.object(
+            Place, "zip_codes_for_city", return_value=("12602", "12603")
+        ):
+            assert m("Poughkeepsie") == zip_12603
+            assert (
+                connecticut.lookup_one_through_external_source("Poughkeepsie") is None
+            )
+
+    def test_zip_codes_for_city(self):
+        zip_12601 = self.zip_12601
+        new_york = self.new_york_state
+        zip_codes = {
+            ("NY", "Poughkeepsie"): ("12601", "12602", "12603"),
+            ("NY", "Woodstock"): ("12498",),
+        }
+        with mock.patch.object(Place, "_zip_codes_by_city", None), mock.patch.object(
+            Place, "_load_zip_codes_by_city", return_value=zip_codes
+        ) as load:
+            m = Place.zip_codes_for_city
+            assert ("12601", "12602", "12603") == m("NY", "Poughkeepsie")
+            assert () == m("CT", "Poughkeepsie")
+
+            # The uszipcode data was only loaded once.
+            assert 1 == load.call_count
+
+            # Every candidate ZIP code is looked up with a single
+            # query.
+            self._db.refresh(new_york)
+            statements = []
+
+            def record(conn, cursor, statement, *args):
+                statements.append(statement)
+
+            event.listen(self.connection, "before_cursor_execute", record)
+            try:
+                assert zip_12601 == new_york.lookup_one_through_external_source(
+                    "Poughkeepsie"
+                )
+                assert None == new_york.lookup_one_through_external_source("Woodstock")
+            finally:
+                event.remove(self.connection, "before_cursor_execute", record)
+            assert 2 == len(statements)
+            assert 1 == load.call_count
+
     def test_served_by(self):
         zip = self.zip_10018
         nyc = self.new_york_city
@@ -450,6 +651,18 @@ class TestLibrary(DatabaseTest):
         self._db.commit()
         assert nypl.timestamp > first_modified
 
+        # Changing one of the library's hyperlinks, or validating one
+        # of its links, also changes the timestamp.
+        second_modified = nypl.timestamp
+        link, ignore = nypl.set_hyperlink("help", "mailto:help@library.org")
+        self._db.commit()
+        assert nypl.timestamp > second_modified
+
+        third_modified = nypl.timestamp
+        link.resource.restart_validation()
+        self._db.commit()
+        assert nypl.timestamp > third_modified
+
     def test_short_name(self):
         lib = self._library("A Library")
         lib.short_name = "abcd"
@@ -631,6 +844,145 @@ class TestLibrary(DatabaseTest):
         for production in (True, False):
             assert feed(production) == []
 
+    def test_feed_version(self):
+        assert Library.feed_version(self._db) == (0, None)
+
+        production = self._library()
+        testing = self._library()
+        testing.registry_stage = Library.TESTING_STAGE
+        self._db.commit()
+
+        # Only the libraries that would show up in the feed are counted.
+        assert Library.feed_version(self._db) == (1, production.timestamp)
+        count, last_modified = Library.feed_version(self._db, production=False)
+        assert count == 2
+        assert last_modified == max(production.timestamp, testing.timestamp)
+
+        # A single library can be considered on its own.
+        assert Library.feed_version(self._db, library=testing) == (
+            1,
+            testing.timestamp,
+        )
+
+        # If a validation expired after the library was last changed,
+        # the expiration time is used instead.
+        link, ignore = production.set_hyperlink("rel", "mailto:me@library.org")
+        validation = link.resource.restart_validation()
+        self._db.commit()
+
+        # Change the objects without going through the ORM, so that
+        # the library's timestamp isn't touched.
+        now = datetime.datetime.utcnow()
+        modified_at = now - datetime.timedelta(hours=1)
+        self._db.query(Library).filter(Library.id == production.id).update(
+            {"timestamp": modified_at}, synchronize_session=False
+        )
+
+        def expire_at(when):
+            self._db.query(Validation).filter(Validation.id == validation.id).update(
+                {"started_at": when - Validation.EXPIRES_AFTER},
+                synchronize_session=False,
+            )
+
+        expire_at(modified_at - datetime.timedelta(minutes=1))
+        assert Library.feed_version(self._db) == (1, modified_at)
+
+        expired_at = modified_at + datetime.timedelta(minutes=1)
+        expire_at(expired_at)
+        assert Library.feed_version(self._db) == (1, expired_at)
+
+    def test_catalog_loading_options(self):
+        state = self._place(type=Place.STATE, abbreviated_name="KS")
+
+        def make_library():
+            city = self._place(type=Place.CITY, parent=state)
+            library = self._library(focus_areas=[city], has_email=True)
+            library.set_hyperlink("help", "mailto:help@library.org")
+
+        def queries_to_build_entries():
+            """Load all the libraries and look up everything needed to
+            build their OPDS entries, counting the database queries.
+            """
+            self._db.flush()
+            self._db.expunge_all()
+            statements = []
+
+            def record(conn, cursor, statement, *args):
+                statements.append(statement)
+
+            event.listen(self.connection, "before_cursor_execute", record)
+            try:
+                qu = self._db.query(Library).options(*Library.catalog_loading_options())
+                for library in qu:
+                    assert library.service_area_name is not None
+                    assert list(library.types) == [LibraryType.LOCAL]
+                    for hyperlink in library.hyperlinks:
+                        hyperlink.resource.validation
+            finally:
+                event.remove(self.connection, "before_cursor_execute", record)
+
+            # No Place geometry was loaded.
+            assert not any("geometry" in x for x in statements)
+            return len(statements)
+
+        make_library()
+        one_library = queries_to_build_entries()
+
+        for i in range(5):
+            make_library()
+        assert queries_to_build_entries() == one_library
+
+    def test_feed_page(self):
+        b1 = self._library("B")
+        b2 = self._library("B")
+        a = self._library("A")
+        c = self._library("C")
+        testing = self._library("AA")
+        testing.registry_stage = Library.TESTING_STAGE
+
+        def page(**kwargs):
+            return Library.feed_page(self._db, **kwargs).all()
+
+        # Libraries are ordered by name, then ID.
+        assert page() == [a, b1, b2, c]
+        assert page(size=2) == [a, b1]
+
+        # The page can start after any library.
+        assert page(after=("B", b1.id), size=2) == [b2, c]
+        assert page(after=("B", b2.id)) == [c]
+        assert page(after=("C", c.id)) == []
+
+        # The usual feed restrictions apply.
+        assert page(production=False, size=2) == [a, testing]
+
+        # A library without a name is left out, rather than ending a
+        # page with a library that the next page can't start after.
+        nameless = self._library()
+        nameless.name = None
+        assert nameless not in page()
+        assert page(after=("B", b2.id)) == [c]
+
+    def test_feed_page_uses_index(self):
+        self._library("A")
+        self._db.flush()
+
+        # Rule out a sequential scan, as in
+        # test_nearby_uses_geography_index. Both feeds find a page in
+        # order from an index, without sorting.
+        self._db.execute("SET LOCAL enable_seqscan = off")
+        for production in (True, False):
+            qu = Library.feed_page(self._db, production, after=("A", 0), size=10)
+            statement = qu.with_entities(Library.id).statement
+            statement = statement.compile(dialect=self._db.bind.dialect)
+            plan = self._db.connection().execute(
+                "EXPLAIN " + str(statement), statement.params
+            )
+            plan = "\n".join(row[0] for row in plan)
+            assert "Index" in plan
+            assert "Sort" not in plan
+            if not production:
+                assert "ix_libraries_qa_feed_name_id" in plan
+
     def test_set_hyperlink(self):
         library = self._library()
 
@@ -791,6 +1143,55 @@ class TestLibrary(DatabaseTest):
         )
         assert None == library.service_area_name
 
+    def test_service_area_summary_is_kept_current(self):
+        # A library's service area name and type are stored in the
+        # database, and updated whenever its service areas change.
+        library = self._library(focus_areas=[self.new_york_city])
+        assert "New York, NY" == library.service_area_name
+        assert LibraryType.LOCAL == library.library_type
+
+        # Moving a service area to a different place changes the summary.
+        [area] = library.service_areas
+        area.place = self.new_york_state
+        self._db.flush()
+        assert "New York" == library.service_area_name
+        assert LibraryType.STATE == library.library_type
+
+        # So does removing it altogether.
+        self._db.delete(area)
+        self._db.flush()
+        assert None == library.service_area_name
+        assert None == library.library_type
+        assert [] == list(library.types)
+
+    def test_bulk_create(self):
+        library = self._library()
+        self._db.commit()
+        timestamp = library.timestamp
+        count = ChangeCounter.count(ServiceArea)
+        m = ServiceArea.bulk_create
+
+        # A ServiceArea is created for each Place.
+        places = [self.new_york_city, self.zip_10018]
+        areas = m(self._db, library, places, ServiceArea.FOCUS)
+        assert set(places) == {x.place for x in areas}
+        assert {ServiceArea.FOCUS} == {x.type for x in areas}
+        assert set(areas) == set(library.service_areas)
+
+        # Since the ServiceAreas were created without going through
+        # the ORM, the change was noted by hand.
+        assert library.timestamp > timestamp
+        assert count + 1 == ChangeCounter.count(ServiceArea)
+
+        # Calling the method again finds the existing ServiceAreas
+        # rather than creating new ones.
+        self._db.commit()
+        timestamp = library.timestamp
+        assert set(areas) == set(m(self._db, library, places, ServiceArea.FOCUS))
+        assert timestamp == library.timestamp
+        assert count + 1 == ChangeCounter.count(ServiceArea)
+        assert 2 == len(library.service_areas)
+
     def test_relevant_audience(self):
         research = self._library(
             "NYU Library",
@@ -1220,6 +1621,181 @@ class TestLibrary(DatabaseTest):
         # But we can run a search that includes libraries in the TESTING stage.
         assert m(False) == 2
 
+    def test_nearby_uses_geography_index(self):
+        self._library("New York Public Library", eligibility_areas=[self.new_york_city])
+        self._db.flush()
+
+        # With only a handful of places, a sequential scan would be
+        # the best plan, so rule it out to see which index the
+        # planner would use for a realistic number of places.
+        self._db.execute("SET LOCAL enable_seqscan = off")
+        qu = Library.nearby(self._db, (40.65, -73.94))
+        statement = qu.statement.compile(dialect=self._db.bind.dialect)
+        plan = self._db.connection().execute(
+            "EXPLAIN " + str(statement), statement.params
+        )
+        plan = "\n".join(row[0] for row in plan)
+        assert "ix_places_simplified_geography" in plan
+
+    def test_cached_nearby(self):
+        nypl = self._library(
+            "New York Public Library", eligibility_areas=[self.new_york_city]
+        )
+        ct_state = self._library(
+            "Connecticut State Library", eligibility_areas=[self.connecticut_state]
+        )
+        self._db.commit()
+        brooklyn = GeometryUtility.point(40.65, -73.94)
+
+        # cached_nearby() finds the same libraries as nearby(), in the
+        # same order, with the same distances.
+        expect = Library.nearby(self._db, brooklyn).limit(5).all()
+        assert [nypl, ct_state] == [library for library, distance in expect]
+        with mock.patch.object(Library, "nearby", wraps=Library.nearby) as nearby:
+            assert expect == Library.cached_nearby(self._db, brooklyn, 5).all()
+
+            # Both the geohash cell and the exact starting point were
+            # looked up.
+            assert 2 == nearby.call_count
+
+            # Another point in the same geohash cell reuses the cell's
+            # candidates, but its distances are calculated exactly.
+            nearby_point = (40.651, -73.941)
+            geohash = GeometryUtility.geohash(
+                40.65, -73.94, Library.NEARBY_GEOHASH_PRECISION
+            )
+            assert geohash == GeometryUtility.geohash(
+                *nearby_point, Library.NEARBY_GEOHASH_PRECISION
+            )
+            expect = Library.nearby(self._db, nearby_point).limit(5).all()
+            assert expect == Library.cached_nearby(self._db, nearby_point, 5).all()
+            assert 4 == nearby.call_count
+
+            # Asking for fewer libraries finds the closest ones.
+            [(library, distance)] = Library.cached_nearby(self._db, nearby_point, 1)
+            assert nypl == library
+
+            # Changing a service area makes the cached candidates
+            # stale.
+            nearby.reset_mock()
+            [area] = ct_state.service_areas
+            area.place = self.new_york_city
+            self._db.commit()
+            results = Library.cached_nearby(self._db, brooklyn, 5).all()
+            assert [0, 0] == [distance for library, distance in results]
+            assert 2 == nearby.call_count
+
+            # A starting point that isn't a simple pair of coordinates
+            # is looked up without the cache.
+            nearby.reset_mock()
+            point = func.ST_SetSRID(func.ST_MakePoint(-73.94, 40.65), 4326)
+            assert 2 == len(Library.cached_nearby(self._db, point, 5).all())
+            assert 1 == nearby.call_count
+
+        # Changes made by another process are seen as soon as they
+        # change the version of the feed.
+        def set_registry_stage(library, stage):
+            self._db.execute(
+                Library.__table__.update()
+                .where(Library.id == library.id)
+                .values(registry_stage=stage, timestamp=datetime.datetime.utcnow())
+            )
+
+        midtown = (40.75, -73.99)
+        set_registry_stage(nypl, Library.TESTING_STAGE)
+        results = Library.cached_nearby(self._db, midtown, 5).all()
+        assert [ct_state] == [library for library, distance in results]
+        set_registry_stage(nypl, Library.PRODUCTION_STAGE)
+        results = Library.cached_nearby(self._db, midtown, 5).all()
+        assert {nypl, ct_state} == {library for library, distance in results}
+
+    def test_cached_search(self):
+        nypl = self._library(
+            "New York Public Library", eligibility_areas=[self.new_york_city]
+        )
+        ct_state = self._library(
+            "Connecticut State Library",
+            eligibility_areas=[self.connecticut_state],
+            library_stage=Library.TESTING_STAGE,
+        )
+        self._db.commit()
+        brooklyn = (40.65, -73.94)
+        geohash = GeometryUtility.geohash(*brooklyn, Library.NEARBY_GEOHASH_PRECISION)
+        south, west, north, east = GeometryUtility.geohash_bounds(geohash)
+        center = ((south + north) / 2, (west + east) / 2)
+
+        # cached_search() finds what search() finds from the center
+        # of the starting point's geohash cell.
+        expect = Library.search(self._db, center, "new york")
+        assert [nypl] == [library for library, distance in expect]
+        with mock.patch.object(Library, "search", wraps=Library.search) as search:
+            assert expect == Library.cached_search(self._db, brooklyn, "New  York")
+            assert 1 == search.call_count
+
+            # The same query, normalized differently, from another
+            # point in the same cell, is answered from the cache.
+            hits = Library.SEARCH_CACHE.hits
+            assert expect == Library.cached_search(self._db, center, "new york ")
+            assert 1 == search.call_count
+            assert hits + 1 == Library.SEARCH_CACHE.hits
+
+            # Without a starting point, only libraries are returned.
+            # Production and non-production searches are cached
+            # separately.
+            for i in range(2):
+                assert [] == Library.cached_search(self._db, None, "connecticut")
+                assert [ct_state] == Library.cached_search(
+                    self._db, None, "connecticut", production=False
+                )
+            assert 3 == search.call_count
+
+            # Changing a service area makes the cached results stale.
+            def search_new_york():
+                results = Library.cached_search(
+                    self._db, brooklyn, "new york", production=False
+                )
+                return {library for library, distance in results}
+
+            assert {nypl} == search_new_york()
+            assert {nypl} == search_new_york()
+            assert 4 == search.call_count
+            [area] = ct_state.service_areas
+            area.place = self.new_york_city
+            self._db.commit()
+            assert {nypl, ct_state} == search_new_york()
+            assert 5 == search.call_count
+
+            # Uncommitted changes aren't cached.
+            nypl.name = "Brooklyn Public Library"
+            search_new_york()
+            search_new_york()
+            assert 7 == search.call_count
+            self._db.commit()
+
+        # A library that another process takes out of production is
+        # left out of cached production results right away.
+        results = Library.cached_search(self._db, brooklyn, "new york")
+        assert [nypl] == [library for library, distance in results]
+        self._db.execute(
+            Library.__table__.update()
+            .where(Library.id == nypl.id)
+            .values(registry_stage=Library.TESTING_STAGE)
+        )
+        assert [] == Library.cached_search(self._db, brooklyn, "new york")
+
+        # A library that another process puts into production is found
+        # right away too, since the version of the feed changes.
+        assert [] == Library.cached_search(self._db, None, "connecticut")
+        self._db.execute(
+            Library.__table__.update()
+            .where(Library.id == ct_state.id)
+            .values(
+                library_stage=Library.PRODUCTION_STAGE,
+                timestamp=datetime.datetime.utcnow(),
+            )
+        )
+        assert [ct_state] == Library.cached_search(self._db, None, "connecticut")
+
     def test_query_cleanup(self):
         m = Library.query_cleanup
 
@@ -1317,6 +1893,108 @@ class TestLibrary(DatabaseTest):
         # But you can find them by passing in production=False.
         assert len(search("bpl", production=False)) == 2
 
+    def test_library_name_index(self):
+        brooklyn = self._library(name="Brooklyn Public Library")
+        boston = self._library(name="Boston Public Library")
+        self._db.commit()
+
+        index = LibraryNameIndex.current(self._db)
+        m = index.find
+        assert {brooklyn.id} == m("broklyn public library")
+        assert {brooklyn.id} == m("BROOKLYN")
+        assert {brooklyn.id, boston.id} == m("public library")
+        assert set() == m("bpl")
+
+        # The index is used instead of comparing names in the
+        # database.
+        with mock.patch.object(
+            Library, "fuzzy_match", wraps=Library.fuzzy_match
+        ) as fuzzy_match:
+            results = Library.search_by_library_name(self._db, "boston").all()
+            assert [boston] == results
+            assert 0 == fuzzy_match.call_count
+
+            # But it's not used when this session has changes the index
+            # can't see.
+            alias, ignore = get_one_or_create(
+                self._db, LibraryAlias, name="BPL", language=None, library=boston
+            )
+            assert [boston] == Library.search_by_library_name(self._db, "bpl").all()
+            assert 2 == fuzzy_match.call_count
+
+        # Once the changes are committed, the libraries that changed
+        # are reindexed.
+        self._db.commit()
+        index = LibraryNameIndex.current(self._db)
+        assert {boston.id} == index.find("bpl")
+        brooklyn.name = "Kings County Library"
+        self._db.commit()
+        index = LibraryNameIndex.current(self._db)
+        assert {brooklyn.id} == index.find("kings county library")
+        assert set() == index.find("brooklyn")
+
+        # Changes made by another process are picked up every
+        # REFRESH_INTERVAL seconds.
+        self._db.execute(
+            Library.__table__.update()
+            .where(Library.id == boston.id)
+            .values(name="Hub Library")
+        )
+        assert index == LibraryNameIndex.current(self._db)
+        index.refreshed_at -= LibraryNameIndex.REFRESH_INTERVAL
+        index = LibraryNameIndex.current(self._db)
+        assert {boston.id} == index.find("hub library")
+
+        # While another thread is building a new index, the old one
+        # is used, unless it's missing changes made in this process.
+        LibraryNameIndex._building = True
+        try:
+            index.refreshed_at -= LibraryNameIndex.REFRESH_INTERVAL
+            assert index == LibraryNameIndex.current(self._db)
+            boston.name = "Boston Library"
+            self._db.commit()
+            assert None == LibraryNameIndex.current(self._db)
+        finally:
+            LibraryNameIndex._building = False
+        index = LibraryNameIndex.current(self._db)
+        assert {boston.id} == index.find("boston library")
+
+    def test_library_name_index_matching(self):
+        m = LibraryNameIndex.trigrams
+        assert {"  n", " no", "now", "ow ", "  w", " wo", "wor", "ork", "rk "} == m(
+            "Now-Work"
+        )
+
+        m = LibraryNameIndex.levenshtein
+        assert 0 == m("library", "library", 2)
+        assert 2 == m("now work", "new york", 2)
+        assert 3 == m("kitten", "sitting", 2)
+        assert 3 == m("a", "abcdef", 2)
+
+    def test_name_matches_use_trigram_index(self):
+        self._library(name="Brooklyn Public Library")
+        self._db.flush()
+
+        # Rule out a sequential scan, as in
+        # test_nearby_uses_geography_index.
+        self._db.execute("SET LOCAL enable_seqscan = off")
+        for clause in (
+            Library.fuzzy_match(Library.name, "broklyn public library"),
+            Library.partial_match(Library.name, "brooklyn"),
+        ):
+            statement = select([Library.id]).where(clause)
+            statement = statement.compile(dialect=self._db.bind.dialect)
+            plan = self._db.connection().execute(
+                "EXPLAIN " + str(statement), statement.params
+            )
+            plan = "\n".join(row[0] for row in plan)
+            assert "ix_libraries_name_trgm" in plan
+
+        # Every connection uses a lower similarity threshold than the
+        # pg_trgm default.
+        [threshold] = self._db.execute("SHOW pg_trgm.similarity_threshold").first()
+        assert Library.FUZZY_MATCH_SIMILARITY_THRESHOLD == float(threshold)
+
     def test_search_by_location(self):
         # We know about three libraries.
         nypl = self.nypl
@@ -1389,6 +2067,24 @@ class TestLibrary(DatabaseTest):
             == 1
         )
 
+        # Nations are left out of the precomputed overlaps, but they're
+        # still matched. A library that serves a whole nation is found
+        # by a search for a place inside it, and a search for a nation
+        # finds the libraries that serve places inside it.
+        national = self._library("National Library", eligibility_areas=[self.crude_us])
+        libraries = Library.search_by_location_name(
+            self._db, "manhattan", production=False
+        )
+        assert {x.name for x in libraries} == {
+            "NYPL",
+            "Kansas State Library",
+            "National Library",
+        }
+        libraries = Library.search_by_location_name(
+            self._db, "united states", production=False
+        )
+        assert {nypl, kansas_state, national} == set(libraries)
+
     def test_search_within_description(self):
         """Test searching for a phrase within a library's description."""
         library = self._library(
@@ -1398,6 +2094,67 @@ class TestLibrary(DatabaseTest):
         results = list(Library.search_within_description(self._db, "testing purposes"))
         assert results == [library]
 
+        # Words are matched regardless of their form or order, and
+        # words in the name count too.
+        results = Library.search_within_description(self._db, "purpose description")
+        assert results.all() == [library]
+        results = Library.search_within_description(self._db, "test library")
+        assert results.all() == [library]
+        assert Library.search_within_description(self._db, "testing xyzzy").all() == []
+
+        # A library that matches better is listed first.
+        other = self._library(
+            name="Testing Library", description="For testing, testing, testing."
+        )
+        results = Library.search_within_description(self._db, "testing")
+        assert results.all() == [other, library]
+
+        # But if a location is known, closer libraries come first.
+        near = self._library(
+            name="Near", description="Testing.", focus_areas=[self.new_york_city]
+        )
+        far = self._library(
+            name="Far Testing Library",
+            description="Testing, testing.",
+            focus_areas=[self.kansas_state],
+        )
+        here = GeometryUtility.point(40.7, -73.9)
+        results = Library.search_within_description(self._db, "testing", here)
+        assert [x[0] for x in results if x[0] in (near, far)] == [near, far]
+
+        # search() keeps this order when it merges its results with
+        # those of other searches, even when the better match has a
+        # higher ID.
+        weak = self._library(name="Riverside", description="We have a bookmobile.")
+        strong = self._library(
+            name="Hillside", description="Bookmobile, bookmobile, bookmobile."
+        )
+        assert weak.id < strong.id
+        assert Library.search(self._db, None, "bookmobile") == [strong, weak]
+
+    def test_approximate_search_within_description(self):
+        library = self._library(
+            name="Library With Description", description="Serving Brooklyn."
+        )
+
+        # Full-text search only matches whole words.
+        assert Library.search_within_description(self._db, "brook").all() == []
+        assert Library.search_within_description(self._db, "brooklyn").all() == [
+            library
+        ]
+
+        # Part of a word, or a close misspelling of the whole
+        # description, matches here instead.
+        m = Library.approximate_search_within_description
+        assert m(self._db, "brook").all() == [library]
+        assert m(self._db, "serving brookyln.").all() == [library]
+        assert m(self._db, "brookyln").all() == []
+
+        # search() tries this after the full-text search, so a
+        # library that matches a whole word is listed first.
+        other = self._library(name="Other", description="Brook Library.")
+        assert Library.search(self._db, None, "brook") == [other, library]
+
     def test_search(self):
         """Test the overall search method."""
 
@@ -1452,9 +2209,27 @@ class TestLibrary(DatabaseTest):
         assert Library.search_by_location_name(self._db, "kansas").all() == [library]
         assert Library.search_by_library_name(self._db, "kansas").all() == [library]
 
-        # But when we do the general search, the library only shows up once.
-        [(result, distance)] = Library.search(self._db, (0, 0), "Kansas")
+        # But when we do the general search, the library only shows up
+        # once. All the searches are done in a single query, once the
+        # in-memory name indexes have been built.
+        self._db.commit()
+        Library.search(self._db, (0, 0), "Kansas")
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(self.connection, "before_cursor_execute", record)
+        try:
+            [(result, distance)] = Library.search(self._db, (0, 0), "Kansas")
+        finally:
+            event.remove(self.connection, "before_cursor_execute", record)
         assert result == library
+        assert 1 == len(statements)
+
+        # Without a location to measure distance from, the libraries
+        # are returned on their own.
+        assert [library] == Library.search(self._db, None, "Kansas")
 
 
 class TestCollectionSummary(DatabaseTest):
@@ -1593,6 +2368,43 @@ class TestConfigurationSetting(DatabaseTest):
         assert ConfigurationSetting.sitewide(self._db, "secret_key").is_secret is True
         assert ConfigurationSetting.sitewide(self._db, "public_key").is_secret is False
 
+    def test_sitewide_value(self):
+        key = self._str
+
+        # Looking up the value of a setting that doesn't exist
+        # doesn't create it.
+        assert ConfigurationSetting.sitewide_value(self._db, key) is None
+        assert get_one(self._db, ConfigurationSetting, key=key) is None
+
+        setting = ConfigurationSetting.sitewide(self._db, key)
+        setting.value = "a value"
+        self._db.commit()
+
+        # Once the value has been looked up, it's cached, and the
+        # database isn't consulted again.
+        assert ConfigurationSetting.sitewide_value(self._db, key) == "a value"
+        with mock.patch("model.get_one", wraps=get_one) as lookup:
+            assert ConfigurationSetting.sitewide_value(self._db, key) == "a value"
+            assert lookup.call_count == 0
+
+            # An uncommitted change is seen immediately, but it isn't
+            # cached.
+            setting.value = "a new value"
+            assert ConfigurationSetting.sitewide_value(self._db, key) == "a new value"
+            assert ConfigurationSetting.sitewide_value(self._db, key) == "a new value"
+            assert lookup.call_count == 2
+
+            # Once the change is committed, the new value is cached.
+            self._db.commit()
+            assert ConfigurationSetting.sitewide_value(self._db, key) == "a new value"
+            assert ConfigurationSetting.sitewide_value(self._db, key) == "a new value"
+            assert lookup.call_count == 3
+
+        # The cache can also be cleared explicitly.
+        assert len(ConfigurationSetting.CACHE) > 0
+        ConfigurationSetting.clear_cache()
+        assert len(ConfigurationSetting.CACHE) == 0
+
     def test_value_or_default(self):
         integration, ignore = create(
             self._db, ExternalIntegration, goal=self._str, protocol=self._str
@@ -1914,6 +2726,24 @@ class TestValidation(DatabaseTest):
         # The secret has changed.
         assert old_secret != email_validation.secret
 
+    def test_last_expiration(self):
+        assert Validation.last_expiration(self._db) is None
+
+        now = datetime.datetime.utcnow()
+        active, ignore = create(self._db, Validation)
+        assert Validation.last_expiration(self._db) is None
+
+        expired, ignore = create(self._db, Validation)
+        expired.started_at = now - Validation.EXPIRES_AFTER * 2
+        assert (
+            Validation.last_expiration(self._db)
+            == expired.started_at + Validation.EXPIRES_AFTER
+        )
+
+        # A successful validation never expires.
+        expired.success = True
+        assert Validation.last_expiration(self._db) is None
+
     def test_mark_as_successful(self):
 
         validation, ignore = create(self._db, Validation)
@@ -1970,6 +2800,58 @@ class TestAdmin(DatabaseTest):
         assert another_admin is None
 
 
+class TestChangeCounter(DatabaseTest):
+    def test_changes_are_counted(self):
+        library = self._library()
+        self._db.commit()
+        before = ChangeCounter.count(Library, Place)
+
+        # Changing a Library and flushing the session counts as a
+        # change to the Library class.
+        library.name = "A new name"
+        self._db.flush()
+        after_flush = ChangeCounter.count(Library, Place)
+        assert after_flush[0] > before[0]
+        assert after_flush[1] == before[1]
+
+        # Committing the change counts again, since other sessions
+        # can now see it.
+        self._db.commit()
+        after_commit = ChangeCounter.count(Library, Place)
+        assert after_commit[0] > after_flush[0]
+        assert after_commit[1] == before[1]
+
+        # A rollback of flushed changes is also counted.
+        library.name = "Another new name"
+        self._db.flush()
+        after_flush = ChangeCounter.count(Library)
+        self._db.rollback()
+        assert ChangeCounter.count(Library)[0] > after_flush[0]
+
+        # A commit with no changes isn't counted.
+        before = ChangeCounter.count(Library)
+        self._db.commit()
+        assert ChangeCounter.count(Library) == before
+
+    def test_has_uncommitted_changes(self):
+        m = ChangeCounter.has_uncommitted_changes
+        library = self._library()
+        self._db.commit()
+        assert m(self._db, Library) is False
+
+        # A pending change is uncommitted.
+        library.name = "A new name"
+        assert m(self._db, Library) is True
+        assert m(self._db, Place) is False
+
+        # So is a change that's been flushed but not committed.
+        self._db.flush()
+        assert m(self._db, Library) is True
+
+        self._db.commit()
+        assert m(self._db, Library) is False
+
+
 class TestDBMigrate(DatabaseTest):
     @mock.patch("db_migration.psycopg2.connect")
     @mock.patch("db_migration.stamp")
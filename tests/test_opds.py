@@ -1,5 +1,8 @@
 import datetime
 import json
+from unittest import mock
+
+from flask import Flask
 
 from authentication_document import AuthenticationDocument
 from config import Configuration
@@ -11,7 +14,7 @@ from model import (
     Validation,
     create,
 )
-from opds import OPDSCatalog
+from opds import OPDSCatalog, SerializedCatalog
 
 from . import DatabaseTest
 
@@ -305,6 +308,64 @@ class TestOPDSCatalog(DatabaseTest):
         )
         assert catalog["images"][0]["href"] == "http://logourl"
 
+    def test_serialized_library_catalog(self):
+        library = self._library()
+        link, ignore = library.set_hyperlink("help", "mailto:help@library.org")
+        link.resource.restart_validation()
+        self._db.flush()
+        cache = OPDSCatalog.FRAGMENT_CACHE
+
+        def serialize(**kwargs):
+            return OPDSCatalog.serialized_library_catalog(library, **kwargs)
+
+        # Outside of a request, the URLs in the catalog can't be
+        # predicted, so nothing is cached.
+        serialized = serialize(url_for=self.mock_url_for)
+        assert json.loads(serialized) == OPDSCatalog.library_catalog(
+            library, url_for=self.mock_url_for
+        )
+        assert len(cache) == 0
+
+        app = Flask(__name__)
+        app.add_url_rule("/library/<uuid>/eligibility", "library_eligibility")
+        app.add_url_rule("/library/<uuid>/focus", "library_focus")
+        with app.test_request_context("/"):
+            serialized = serialize()
+            assert serialized == json.dumps(OPDSCatalog.library_catalog(library))
+            assert len(cache) == 1
+
+            # The second time, the cached JSON is used.
+            assert serialize() == serialized
+            assert cache.hits == 1
+
+            # Entries that show a distance are kept in a separate
+            # cache. Distances are only shown to the nearest kilometer,
+            # so nearby distances share an entry.
+            distance_cache = OPDSCatalog.DISTANCE_FRAGMENT_CACHE
+            serialize(distance=2100)
+            serialize(distance=2900)
+            assert len(distance_cache) == 1
+            serialize(distance=3100)
+            assert len(distance_cache) == 2
+            assert len(cache) == 1
+
+            # Different arguments mean different entries.
+            serialize(include_logo=False)
+            assert len(cache) == 2
+
+            # If a validation expires, the entry is rebuilt.
+            with mock.patch.object(
+                Validation, "active", new_callable=mock.PropertyMock
+            ) as active:
+                active.return_value = False
+                assert Validation.INACTIVE in serialize()
+            assert len(cache) == 3
+
+            # If the library changes, the entry is rebuilt.
+            library.name = "A new name"
+            self._db.flush()
+            assert "A new name" in serialize()
+
     def test__hyperlink_args(self):
         """Verify that _hyperlink_args generates arguments appropriate
         for an OPDS 2 link.
@@ -348,3 +409,110 @@ class TestOPDSCatalog(DatabaseTest):
         # _hyperlink_args stops working.
         hyperlink.resource = None
         assert m(hyperlink) is None
+
+    def test_streaming(self):
+        l1 = self._library("Library 1")
+        l2 = self._library("Library 2")
+        built = []
+
+        class Mock(OPDSCatalog):
+            @classmethod
+            def library_catalog(cls, library, **kwargs):
+                built.append(library)
+                return OPDSCatalog.library_catalog(library, **kwargs)
+
+        normal = Mock(
+            self._db, "title", "http://url/", [l1, l2], url_for=self.mock_url_for
+        )
+        assert normal.streaming is False
+        assert built == [l1, l2]
+
+        # A streaming catalog doesn't build any entries up front.
+        built = []
+        streaming = Mock(
+            self._db,
+            "title",
+            "http://url/",
+            [l1, l2],
+            url_for=self.mock_url_for,
+            stream=True,
+        )
+        assert streaming.streaming is True
+        assert built == []
+        assert streaming.catalog["catalogs"] == []
+
+        # Each entry is built as the catalog is serialized.
+        chunks = streaming.chunks()
+        assert built == []
+        serialized = "".join(chunks)
+        assert built == [l1, l2]
+
+        # The result is the same as serializing the whole catalog at once.
+        assert serialized == str(normal)
+        assert str(streaming) == str(normal)
+
+    def test_json_chunks(self):
+        catalog = dict(
+            metadata=dict(title="A catalog"),
+            catalogs=[],
+            links=[dict(rel="self", href="http://url/")],
+        )
+        entries = [json.dumps(dict(metadata=dict(title=str(x)))) for x in range(100)]
+        catalog_with_entries = dict(catalog, catalogs=[json.loads(x) for x in entries])
+
+        # The JSON is split into pieces of about STREAM_CHUNK_SIZE characters.
+        class Mock(OPDSCatalog):
+            STREAM_CHUNK_SIZE = 500
+
+        chunks = list(Mock.json_chunks(catalog, iter(entries)))
+        assert len(chunks) > 1
+        assert all(len(chunk) < 600 for chunk in chunks)
+        assert "".join(chunks) == json.dumps(catalog_with_entries)
+
+
+class TestSerializedCatalog(DatabaseTest):
+    def mock_url_for(self, route, uuid, **kwargs):
+        return f"http://{route}/{uuid}"
+
+    def test_serialize(self):
+        # OPDSCatalog.serialize generates the same JSON as json.dumps,
+        # but uses pre-generated JSON for the library entries.
+        catalog = dict(
+            metadata=dict(title="A catalog"),
+            catalogs=[dict(metadata=dict(title="A library"))],
+            links=[dict(rel="self", href="http://url/")],
+        )
+        entries = [json.dumps(x) for x in catalog["catalogs"]]
+        assert OPDSCatalog.serialize(catalog, entries) == json.dumps(catalog)
+
+    def test_serialized_catalog(self):
+        l1 = self._library("Library 1")
+        l2 = self._library("Library 2")
+        l3 = self._library("Library 3")
+        catalog = OPDSCatalog(
+            self._db,
+            "A Catalog!",
+            "http://url/",
+            [l1, l2, l3],
+            url_for=self.mock_url_for,
+        )
+        serialized = SerializedCatalog(catalog)
+
+        # The serialized catalog is the same as the original.
+        assert serialized.data == str(catalog).encode("utf8")
+        assert json.loads(serialized.serialize()) == catalog.catalog
+
+        # Libraries can be moved to the front of the list, with or
+        # without a distance.
+        parsed = json.loads(serialized.serialize(first=[(l3, 2000), l2]))
+        assert [x["metadata"]["title"] for x in parsed["catalogs"]] == [
+            l3.name,
+            l2.name,
+            l1.name,
+        ]
+        assert parsed["catalogs"][0]["metadata"]["distance"] == "2 km."
+        assert "".join(serialized.chunks(first=[(l3, 2000), l2])) == (
+            serialized.serialize(first=[(l3, 2000), l2])
+        )
+        assert "distance" not in parsed["catalogs"][1]["metadata"]
+        assert parsed["links"] == catalog.catalog["links"]
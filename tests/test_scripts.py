@@ -1,5 +1,9 @@
+import gzip
+import os
 from io import StringIO
+from types import SimpleNamespace
 
+import flask
 import pytest
 
 from config import Configuration
@@ -12,6 +16,7 @@ from model import (
     ServiceArea,
     create,
     get_one,
+    place_overlaps,
 )
 from problem_details import INVALID_INTEGRATION_DOCUMENT
 from registrar import LibraryRegistrar
@@ -28,6 +33,7 @@ from scripts import (
     SearchPlacesScript,
     SetCoverageAreaScript,
     ShowIntegrationsScript,
+    SnapshotFeedsScript,
 )
 from testing import MockPlace
 
@@ -96,6 +102,23 @@ class TestLoadPlacesScript(DatabaseTest):
         }
         assert {x.external_id for x in places} == {"US", "01", "0151000"}
 
+        # The places' overlaps were calculated. Each point only
+        # overlaps itself, and nations are left out.
+        overlaps = self._db.query(
+            place_overlaps.c.place_id, place_overlaps.c.overlapping_place_id
+        ).all()
+        by_id = {x.id: x.external_id for x in places}
+        assert sorted((by_id[a], by_id[b]) for a, b in overlaps) == [
+            ("01", "01"),
+            ("0151000", "0151000"),
+        ]
+
+        # The time the places were loaded was recorded, so other
+        # processes know the places have changed.
+        assert ConfigurationSetting.sitewide_value(
+            self._db, Configuration.PLACES_LOADED_AT
+        )
+
 
 class TestSearchPlacesScript(DatabaseTest):
     def test_run(self):
@@ -568,3 +591,59 @@ class TestConfigureVendorIDScript(DatabaseTest):
         with pytest.raises(ValueError) as exc:
             script.do_run(self._db, cmd_args=cmd_args)
         assert "Invalid delegate: http://random-site/" in str(exc.value)
+
+
+class TestSnapshotFeedsScript(DatabaseTest):
+    def test_run(self, tmpdir):
+        production = self._library(name="Production")
+        testing = self._library(name="Testing")
+        testing.registry_stage = Library.TESTING_STAGE
+        cancelled = self._library(name="Cancelled")
+        cancelled.registry_stage = Library.CANCELLED_STAGE
+
+        class MockController:
+            def libraries_opds(self, live=True):
+                return flask.Response(
+                    "%s feed from %s" % ("live" if live else "QA", flask.request.url)
+                )
+
+            def library(self):
+                return flask.Response(flask.request.library.name)
+
+        app = flask.Flask(__name__)
+        app.library_registry = SimpleNamespace(registry_controller=MockController())
+        directory = str(tmpdir)
+
+        # There's an old snapshot for a library that's no longer in
+        # the feeds.
+        old = os.path.join(directory, "library", cancelled.internal_urn)
+        os.makedirs(old)
+
+        script = SnapshotFeedsScript(self._db, app=app)
+        script.run(
+            cmd_args=["--directory", directory, "--base-url", "http://registry/"]
+        )
+
+        def snapshot(path):
+            filename = os.path.join(directory, path, SnapshotFeedsScript.FILENAME)
+            with open(filename, "rb") as f:
+                data = f.read()
+            with open(filename + ".gz", "rb") as f:
+                assert gzip.decompress(f.read()) == data
+            return data.decode("utf8")
+
+        # Each feed was rendered in the context of a request for the
+        # feed's URL.
+        assert snapshot("libraries") == "live feed from http://registry/libraries"
+        assert snapshot("libraries/qa") == "QA feed from http://registry/libraries/qa"
+        for library in production, testing:
+            assert snapshot("library/" + library.internal_urn) == library.name
+
+        # The out-of-date snapshot was removed, and nothing was
+        # written for the cancelled library.
+        assert not os.path.exists(old)
+
+        # Without a base URL, the script can't run.
+        with pytest.raises(ValueError) as exc:
+            script.run(cmd_args=["--directory", directory])
+        assert "No base URL provided" in str(exc.value)
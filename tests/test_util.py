@@ -1,3 +1,5 @@
+from unittest import mock
+
 from util import GeometryUtility
 
 
@@ -13,6 +15,52 @@ class TestGeometryUtility:
         point = GeometryUtility.point_from_ip("127.0.0.1")
         assert point is None
 
+        assert GeometryUtility.point_from_ip(None) is None
+        assert GeometryUtility.point_from_ip("") is None
+
+    def test_point_from_ip_cache(self):
+        cache = GeometryUtility.IP_LOCATION_CACHE
+        cache.clear()
+        reader = mock.Mock(wraps=GeometryUtility.geoip_reader())
+        lookup = reader.get_with_prefix_len
+        with mock.patch.object(GeometryUtility, "_geoip_reader", reader):
+            manhattan = GeometryUtility.point_from_ip("65.88.88.124")
+            assert 1 == lookup.call_count
+
+            # The GeoIP database treats the whole /24 network alike, so
+            # any other address in the network is looked up in the cache.
+            assert manhattan == GeometryUtility.point_from_ip("65.88.88.124")
+            assert manhattan == GeometryUtility.point_from_ip("65.88.88.7")
+            assert 1 == lookup.call_count
+
+            # A failed lookup is cached too.
+            assert GeometryUtility.point_from_ip("127.0.0.1") is None
+            assert GeometryUtility.point_from_ip("127.0.0.2") is None
+            assert 2 == lookup.call_count
+
+            # If a network is split up in the GeoIP database, its
+            # addresses are cached individually.
+            lookup.return_value = ({"location": dict(latitude=1, longitude=2)}, 32)
+            assert "SRID=4326;POINT(2 1)" == GeometryUtility.point_from_ip("10.0.0.1")
+            assert "SRID=4326;POINT(2 1)" == GeometryUtility.point_from_ip("10.0.0.1")
+            assert 3 == lookup.call_count
+            lookup.return_value = (None, 32)
+            assert GeometryUtility.point_from_ip("10.0.0.2") is None
+            assert 4 == lookup.call_count
+        cache.clear()
+
+    def test_geoip_reader(self):
+        # The GeoIP database is opened once per process.
+        reader = GeometryUtility.geoip_reader()
+        assert reader is GeometryUtility.geoip_reader()
+
+        # A forked process opens it again rather than using its
+        # parent's reader.
+        GeometryUtility._forget_geoip_reader()
+        new_reader = GeometryUtility.geoip_reader()
+        assert new_reader is not reader
+        assert new_reader.get("65.88.88.124") == reader.get("65.88.88.124")
+
     def test_point_from_string(self):
         m = GeometryUtility.point_from_string
 
@@ -26,3 +74,34 @@ class TestGeometryUtility:
         # Here are some strings that do.
         for coords in ("40.7769, -73.9813", "40.7769,-73.9813"):
             assert m(coords) == "SRID=4326;POINT(-73.9813 40.7769)"
+
+    def test_coordinates(self):
+        m = GeometryUtility.coordinates
+        assert m(GeometryUtility.point(40.5, -73.25)) == (40.5, -73.25)
+        assert m(("40.5", -73)) == (40.5, -73.0)
+        assert m("SRID=4326;POINT(a b)") is None
+        assert m("POINT(-73.25 40.5)") is None
+        assert m(None) is None
+
+    def test_geohash(self):
+        m = GeometryUtility.geohash
+        assert m(57.64911, 10.40744, 11) == "u4pruydqqvj"
+        assert m(40.65, -73.94, 5) == "dr5rm"
+
+        # A geohash's bounds contain every point with that geohash.
+        south, west, north, east = GeometryUtility.geohash_bounds("dr5rm")
+        assert south <= 40.65 <= north
+        assert west <= -73.94 <= east
+        assert m(south, west, 5) == "dr5rm"
+
+        # Shorter geohashes cover bigger areas.
+        assert m(40.65, -73.94, 3) == "dr5"
+        assert GeometryUtility.geohash_bounds("") == (-90, -180, 90, 180)
+
+    def test_distance(self):
+        m = GeometryUtility.distance
+        assert m((40.65, -73.94), (40.65, -73.94)) == 0
+        assert int(m((40.65, -73.94), (41.3, -73.3))) == 90
+
+        # A degree of latitude is about 111 kilometers.
+        assert int(m((0, 0), (1, 0))) == 111
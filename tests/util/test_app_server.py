@@ -1,9 +1,17 @@
+import datetime
+
 import pytest
 from flask import Flask, make_response
 
 import admin
 from admin.config import Configuration as AdminUiConfig
-from util.app_server import ApplicationVersionController
+from opds import OPDSCatalog
+from util.app_server import (
+    ApplicationVersionController,
+    FeedVersion,
+    _make_response,
+    not_modified_response,
+)
 
 
 @pytest.mark.parametrize(
@@ -51,3 +59,112 @@ def test_application_version_controller(
         if ui_version
         else AdminUiConfig.PACKAGE_VERSION
     )
+
+
+def test_make_response():
+    with Flask(__name__).test_request_context("/"):
+        response = _make_response("a string", "text/plain", 100)
+        assert response.data == b"a string"
+        assert response.headers["Content-Type"] == "text/plain"
+        assert (
+            response.headers["Cache-Control"]
+            == "public, no-transform, max-age: 100, s-maxage: 50"
+        )
+        assert not response.is_streamed
+
+        response = _make_response(b"bytes", "text/plain", None)
+        assert response.data == b"bytes"
+        assert response.headers["Cache-Control"] == "private, no-cache"
+
+        # A generator becomes the body of a streaming response.
+        def chunks():
+            yield "a "
+            yield "stream"
+
+        response = _make_response(chunks(), OPDSCatalog.OPDS_TYPE, 100)
+        assert response.is_streamed
+        assert response.headers["Content-Type"] == OPDSCatalog.OPDS_TYPE
+        assert response.data == b"a stream"
+
+
+def test_feed_version():
+    last_modified = datetime.datetime(2021, 1, 1, 12, 30, 15, 500)
+    version = FeedVersion(last_modified, "a", 1)
+
+    # The ETag depends on everything passed in to the constructor.
+    assert version.etag == FeedVersion(last_modified, "a", 1).etag
+    assert version.etag != FeedVersion(last_modified, "a", 2).etag
+    assert version.etag != FeedVersion(None, "a", 1).etag
+
+    app = Flask(__name__)
+    with app.test_request_context("/"):
+        assert not version.not_modified()
+
+    headers = {"If-None-Match": '"%s"' % version.etag}
+    with app.test_request_context("/", headers=headers):
+        assert version.not_modified()
+
+    with app.test_request_context("/", headers={"If-None-Match": '"other"'}):
+        assert not version.not_modified()
+
+    # A weak ETag, such as one sent with a compressed representation,
+    # also matches.
+    headers = {"If-None-Match": 'W/"%s"' % version.etag}
+    with app.test_request_context("/", headers=headers):
+        assert version.not_modified()
+
+    # Without If-None-Match, If-Modified-Since is compared with the
+    # last modified time, to the second.
+    headers = {"If-Modified-Since": "Fri, 01 Jan 2021 12:30:15 GMT"}
+    with app.test_request_context("/", headers=headers):
+        assert version.not_modified()
+    headers = {"If-Modified-Since": "Fri, 01 Jan 2021 12:30:14 GMT"}
+    with app.test_request_context("/", headers=headers):
+        assert not version.not_modified()
+
+    # If-None-Match takes precedence over If-Modified-Since.
+    headers = {
+        "If-None-Match": '"other"',
+        "If-Modified-Since": "Fri, 01 Jan 2021 12:30:15 GMT",
+    }
+    with app.test_request_context("/", headers=headers):
+        assert not version.not_modified()
+
+    # An undated version has a different ETag, and If-Modified-Since
+    # is ignored.
+    undated = version.undated()
+    assert undated.last_modified is None
+    assert undated.etag != version.etag
+    headers = {"If-Modified-Since": "Fri, 01 Jan 2021 12:30:15 GMT"}
+    with app.test_request_context("/", headers=headers):
+        assert not undated.not_modified()
+
+    # A version can be extended with other values, giving it a
+    # different ETag.
+    extended = version.extend("b")
+    assert extended.last_modified == last_modified
+    assert extended.etag == FeedVersion(last_modified, "a", 1, "b").etag
+    headers = {"If-None-Match": '"%s"' % version.etag}
+    with app.test_request_context("/", headers=headers):
+        assert not extended.not_modified()
+
+    # The version's identifying headers can be set on a response,
+    # including a 304 response.
+    with app.test_request_context("/"):
+        response = _make_response("a string", "text/plain", 100, version)
+        assert response.headers["ETag"] == '"%s"' % version.etag
+        assert response.headers["Last-Modified"] == "Fri, 01 Jan 2021 12:30:15 GMT"
+
+        # An undated version doesn't send a Last-Modified header.
+        response = _make_response("a string", "text/plain", 100, undated)
+        assert response.headers["ETag"] == '"%s"' % undated.etag
+        assert "Last-Modified" not in response.headers
+
+        response = not_modified_response(version, 100)
+        assert response.status_code == 304
+        assert response.data == b""
+        assert response.headers["ETag"] == '"%s"' % version.etag
+        assert (
+            response.headers["Cache-Control"]
+            == "public, no-transform, max-age: 100, s-maxage: 50"
+        )
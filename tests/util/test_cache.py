@@ -0,0 +1,107 @@
+from unittest import mock
+
+from util.cache import LRUCache
+
+
+class TestLRUCache:
+    def test_get_and_set(self):
+        cache = LRUCache(max_size=2)
+        assert cache.get("a") is None
+        assert cache.get("a", "default") == "default"
+
+        assert cache.set("a", 1) == 1
+        assert cache.get("a") == 1
+        assert "a" in cache
+        assert len(cache) == 1
+
+        cache.remove("a")
+        assert "a" not in cache
+
+    def test_least_recently_used_item_is_evicted(self):
+        cache = LRUCache(max_size=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+
+        # Looking up "a" makes "b" the least recently used item.
+        cache.get("a")
+        cache.set("c", 3)
+        assert "b" not in cache
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+
+    def test_sizeof(self):
+        # The cache can be limited by the total size of its values
+        # rather than their number.
+        cache = LRUCache(max_size=10, sizeof=len)
+        cache.set("a", b"1234")
+        cache.set("b", b"1234")
+        assert cache.total_size == 8
+
+        # Replacing a value replaces its size.
+        cache.set("b", b"12")
+        assert cache.total_size == 6
+
+        # Storing a value that doesn't fit evicts the least recently
+        # used values until it does.
+        cache.set("c", b"123456")
+        assert "a" not in cache
+        assert cache.get("b") == b"12"
+        assert cache.total_size == 8
+
+        # A value bigger than the whole cache isn't stored.
+        assert cache.set("d", b"12345678901") == b"12345678901"
+        assert "d" not in cache
+        assert cache.total_size == 8
+
+        cache.remove("b")
+        assert cache.total_size == 6
+        cache.clear()
+        assert cache.total_size == 0
+
+    def test_max_age(self):
+        cache = LRUCache(max_age=10)
+        with mock.patch("util.cache.time.time", return_value=1000):
+            cache.set("a", 1)
+        with mock.patch("util.cache.time.time", return_value=1009):
+            assert cache.get("a") == 1
+        with mock.patch("util.cache.time.time", return_value=1010):
+            assert cache.get("a") is None
+
+        # The stale item was removed.
+        assert "a" not in cache
+
+    def test_get_or_set(self):
+        cache = LRUCache()
+        calls = []
+
+        def create():
+            calls.append(1)
+            return "value"
+
+        assert cache.get_or_set("key", create) == "value"
+        assert cache.get_or_set("key", create) == "value"
+        assert len(calls) == 1
+
+        # A cached value of None is still a cached value.
+        assert cache.get_or_set("none", lambda: None) is None
+        assert cache.get_or_set("none", create) is None
+
+    def test_stats(self):
+        cache = LRUCache(max_size=5)
+        assert cache.hit_ratio is None
+
+        cache.get("a")
+        cache.set("a", 1)
+        cache.get("a")
+        cache.get("a")
+        cache.get("b")
+        assert cache.hits == 2
+        assert cache.misses == 2
+        assert cache.hit_ratio == 0.5
+        assert cache.stats == dict(size=1, max_size=5, hits=2, misses=2, hit_ratio=0.5)
+
+        # Clearing the cache also resets its statistics.
+        cache.clear()
+        assert len(cache) == 0
+        assert cache.hits == 0
+        assert cache.misses == 0
@@ -1,8 +1,36 @@
+import math
+import os
+import re
+import threading
+
+import maxminddb
 from geolite2 import geolite2
 from sqlalchemy import func
 
+from util.cache import LRUCache
+
 
 class GeometryUtility:
+
+    # The results of IP geolocation. An IPv4 address is cached under
+    # its /24 network if the GeoIP database treats the whole network
+    # alike, and under the address itself otherwise.
+    IP_LOCATION_CACHE = LRUCache(max_size=10000)
+
+    # Stored under a /24 network to show that its addresses have to be
+    # cached individually.
+    _SPLIT_NETWORK = object()
+
+    _geoip_reader = None
+    _geoip_lock = threading.Lock()
+
+    GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+    POINT_RE = re.compile(r"^SRID=4326;POINT\((?P<longitude>\S+) (?P<latitude>\S+)\)$")
+
+    # The mean radius of the Earth, in kilometers.
+    EARTH_RADIUS = 6371.0
+
     @classmethod
     def from_geojson(cls, geojson):
         """
@@ -27,16 +55,166 @@ class GeometryUtility:
 
                 'SRID=4326;POINT({longitude} {latitude})'
         """
-        reader = geolite2.reader()  # TODO: Move this instantiation after None check
         if not ip_address:
             return None
 
-        match = reader.get(ip_address)
-        if match is None:
+        cache = cls.IP_LOCATION_CACHE
+        missing = object()
+        network = cls._ipv4_network(ip_address)
+        point = cache.get(network or ip_address, missing)
+        if point is cls._SPLIT_NETWORK:
+            point = cache.get(ip_address, missing)
+        if point is not missing:
+            return point
+
+        match, prefix_len = cls.geoip_reader().get_with_prefix_len(ip_address)
+        point = None
+        if match is not None and "location" in match:
+            latitude, longitude = (
+                match["location"][x] for x in ("latitude", "longitude")
+            )
+            point = cls.point(latitude, longitude)
+
+        if network and prefix_len <= 24:
+            cache.set(network, point)
+        else:
+            if network:
+                cache.set(network, cls._SPLIT_NETWORK)
+            cache.set(ip_address, point)
+        return point
+
+    @classmethod
+    def geoip_reader(cls):
+        """Find this process's reader for the MaxMind GeoIP database,
+        opening it if necessary.
+
+        geolite2.reader() also keeps a single reader, but a forked
+        process would go on using the reader its parent opened. This
+        one is opened again in each process (see
+        _forget_geoip_reader()).
+
+        :return: A maxminddb Reader
+        """
+        if cls._geoip_reader is None:
+            with cls._geoip_lock:
+                if cls._geoip_reader is None:
+                    cls._geoip_reader = maxminddb.open_database(
+                        geolite2.filename, maxminddb.MODE_AUTO
+                    )
+        return cls._geoip_reader
+
+    @classmethod
+    def _forget_geoip_reader(cls):
+        """Make a forked process open its own GeoIP reader rather than
+        share its parent's.
+        """
+        cls._geoip_reader = None
+        cls._geoip_lock = threading.Lock()
+
+    @classmethod
+    def _ipv4_network(cls, ip_address):
+        """Find the /24 network containing an IPv4 address.
+
+        This is only a cache key, so it's done with string manipulation
+        rather than the ipaddress module; the GeoIP reader will reject
+        an invalid address before anything is cached for it.
+
+        :return: A string like "10.0.0.0/24", or None if `ip_address`
+            doesn't look like an IPv4 address.
+        """
+        if ip_address.count(".") != 3:
+            return None
+        return ip_address.rpartition(".")[0] + ".0/24"
+
+    @classmethod
+    def coordinates(cls, point):
+        """Find the latitude and longitude of a point created by point().
+
+        :param point: A string in the format created by point(), or a
+            2-tuple (latitude, longitude).
+        :return: A 2-tuple of floats (latitude, longitude), or None if
+            `point` isn't in a recognized format.
+        """
+        if isinstance(point, tuple):
+            latitude, longitude = point
+        else:
+            match = isinstance(point, str) and cls.POINT_RE.match(point)
+            if not match:
+                return None
+            latitude, longitude = match.group("latitude", "longitude")
+        try:
+            return float(latitude), float(longitude)
+        except ValueError:
             return None
 
-        latitude, longitude = (match["location"][x] for x in ("latitude", "longitude"))
-        return cls.point(latitude, longitude)
+    @classmethod
+    def geohash(cls, latitude, longitude, precision):
+        """Find the geohash cell containing a point.
+
+        Nearby points usually share a geohash cell, and the longer the
+        geohash, the smaller the cell.
+
+        :param precision: The length of the geohash, in characters.
+        :return: A string
+        """
+        ranges = [[-180.0, 180.0], [-90.0, 90.0]]
+        values = [longitude, latitude]
+        characters = []
+        bits = 0
+        for i in range(precision * 5):
+            # Even bits split the range of longitude; odd bits split the
+            # range of latitude.
+            interval = ranges[i % 2]
+            middle = (interval[0] + interval[1]) / 2
+            bits <<= 1
+            if values[i % 2] >= middle:
+                bits |= 1
+                interval[0] = middle
+            else:
+                interval[1] = middle
+            if i % 5 == 4:
+                characters.append(cls.GEOHASH_ALPHABET[bits])
+                bits = 0
+        return "".join(characters)
+
+    @classmethod
+    def geohash_bounds(cls, geohash):
+        """Find the area covered by a geohash cell.
+
+        :return: A 4-tuple (south, west, north, east)
+        """
+        ranges = [[-180.0, 180.0], [-90.0, 90.0]]
+        i = 0
+        for character in geohash:
+            bits = cls.GEOHASH_ALPHABET.index(character)
+            for shift in range(4, -1, -1):
+                interval = ranges[i % 2]
+                middle = (interval[0] + interval[1]) / 2
+                if bits >> shift & 1:
+                    interval[0] = middle
+                else:
+                    interval[1] = middle
+                i += 1
+        (west, east), (south, north) = ranges
+        return south, west, north, east
+
+    @classmethod
+    def distance(cls, point1, point2):
+        """Find the great-circle distance between two points.
+
+        :param point1: A 2-tuple (latitude, longitude)
+        :param point2: A 2-tuple (latitude, longitude)
+        :return: The distance in kilometers.
+        """
+        latitude1, longitude1 = (math.radians(x) for x in point1)
+        latitude2, longitude2 = (math.radians(x) for x in point2)
+        a = (
+            math.sin((latitude2 - latitude1) / 2) ** 2
+            + math.cos(latitude1)
+            * math.cos(latitude2)
+            * math.sin((longitude2 - longitude1) / 2) ** 2
+        )
+        return 2 * cls.EARTH_RADIUS * math.asin(math.sqrt(a))
 
     @classmethod
     def point_from_string(cls, s):
@@ -72,3 +250,6 @@ class GeometryUtility:
         :return: (str) - Formatted string: 'SRID=4326;POINT({longitude} {latitude})'
         """
         return f"SRID=4326;POINT({longitude} {latitude})"
+
+
+os.register_at_fork(after_in_child=GeometryUtility._forget_geoip_reader)
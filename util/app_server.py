@@ -1,8 +1,10 @@
 """Implement logic common to more than one of the Simplified applications."""
+import hashlib
 import logging
 import sys
 import traceback
 from functools import wraps
+from types import GeneratorType
 
 import flask
 from flask import make_response
@@ -16,17 +18,87 @@ from opds import OPDSCatalog
 from util.problem_detail import ProblemDetail
 
 
-def catalog_response(catalog, cache_for=OPDSCatalog.CACHE_TIME):
+class FeedVersion:
+    """Identifies one version of a feed, so that clients who already
+    have that version can be told so without the feed being rebuilt.
+    """
+
+    def __init__(self, last_modified, *parts):
+        """Constructor.
+
+        :param last_modified: A datetime (in UTC) indicating when the
+            feed's contents last changed, or None if this isn't known.
+        :param parts: Any other values that, if changed, should give the
+            feed a different ETag.
+        """
+        self.last_modified = last_modified
+        self.parts = parts
+        digest = hashlib.sha1(repr((last_modified,) + parts).encode("utf8"))
+        self.etag = digest.hexdigest()
+
+    def extend(self, *parts):
+        """Identify a version of a feed that depends on everything this
+        version depends on, and on some other values as well.
+        """
+        return FeedVersion(self.last_modified, *(self.parts + parts))
+
+    def undated(self):
+        """Identify this version of a feed in a way that doesn't give a
+        last modified time.
+
+        This is for feeds whose contents depend on something (such
+        as the client's location) that the last modified time doesn't
+        cover, so If-Modified-Since can't be trusted to find out
+        whether the client's copy of the feed is current.
+        """
+        return FeedVersion(None, *((self.last_modified,) + self.parts))
+
+    def not_modified(self, request=None):
+        """Does the client already have this version of the feed?
+
+        If-None-Match uses the weak comparison, so a compressed
+        representation of this version matches too. If-Modified-Since
+        is only checked if there's no If-None-Match, and only if this
+        version has a last modified time.
+        """
+        request = request or flask.request
+        if request.if_none_match:
+            return request.if_none_match.contains_weak(self.etag)
+        if request.if_modified_since and self.last_modified:
+            # HTTP dates are only precise to the second.
+            last_modified = self.last_modified.replace(microsecond=0)
+            if_modified_since = request.if_modified_since.replace(tzinfo=None)
+            return last_modified <= if_modified_since
+        return False
+
+    def apply(self, response):
+        """Set the ETag and Last-Modified headers on a response."""
+        response.set_etag(self.etag)
+        if self.last_modified:
+            response.last_modified = self.last_modified
+        return response
+
+
+def catalog_response(catalog, cache_for=OPDSCatalog.CACHE_TIME, version=None):
     content_type = OPDSCatalog.OPDS_TYPE
-    return _make_response(catalog, content_type, cache_for)
+    if isinstance(catalog, OPDSCatalog) and catalog.streaming:
+        # Send the catalog out one piece at a time, rather than
+        # building the whole thing in memory.
+        catalog = catalog.chunks()
+    return _make_response(catalog, content_type, cache_for, version)
 
 
-def _make_response(content, content_type, cache_for):
-    if isinstance(content, etree._Element):
-        content = etree.tostring(content)
-    elif not isinstance(content, str):
-        content = str(content)
+def not_modified_response(version, cache_for=OPDSCatalog.CACHE_TIME):
+    """Tell the client that the version of a feed it has is still good.
+
+    :param version: A FeedVersion.
+    """
+    response = flask.Response(status=304)
+    response.headers["Cache-Control"] = _cache_control(cache_for)
+    return version.apply(response)
+
 
+def _cache_control(cache_for):
     if isinstance(cache_for, int):
         # A CDN should hold on to the cached representation only half
         # as long as the end-user.
@@ -38,10 +110,36 @@ def _make_response(content, content_type, cache_for):
         )
     else:
         cache_control = "private, no-cache"
+    return cache_control
 
-    return make_response(
-        content, 200, {"Content-Type": content_type, "Cache-Control": cache_control}
-    )
+
+def _make_response(content, content_type, cache_for, version=None):
+    """Create a response with appropriate caching headers.
+
+    :param content: A string, a bytestring, an lxml Element, or a
+        generator. A generator will be used as the body of a streaming
+        response. Anything else will be converted to a string.
+    :param version: A FeedVersion identifying this version of the content.
+    """
+    streaming = isinstance(content, GeneratorType)
+    if isinstance(content, etree._Element):
+        content = etree.tostring(content)
+    elif streaming:
+        # The generator may need the request context (e.g. to
+        # generate URLs), so keep it around until the generator is
+        # done.
+        content = flask.stream_with_context(content)
+    elif not isinstance(content, (bytes, str)):
+        content = str(content)
+
+    headers = {"Content-Type": content_type, "Cache-Control": _cache_control(cache_for)}
+    if streaming:
+        response = flask.Response(content, 200, headers)
+    else:
+        response = make_response(content, 200, headers)
+    if version:
+        version.apply(response)
+    return response
 
 
 def returns_problem_detail(f):
@@ -0,0 +1,130 @@
+"""A small in-process cache used to avoid recalculating expensive values."""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """A thread-safe mapping that holds at most `max_size` items.
+
+    When the cache is full, the least recently used item is evicted to
+    make room for a new one. Items older than `max_age` seconds are
+    treated as though they were never cached.
+
+    The cache keeps track of how many lookups succeeded and how many
+    failed, so that its effectiveness can be measured.
+    """
+
+    def __init__(self, max_size=1000, max_age=None, sizeof=None):
+        """Constructor.
+
+        :param max_size: The maximum number of items to keep.
+        :param max_age: Items are considered stale this many seconds
+            after they're stored. If this is None, items never go stale.
+        :param sizeof: A function that measures a value (e.g. `len`).
+            If this is set, `max_size` limits the total size of the
+            values rather than the number of items, and a value bigger
+            than `max_size` is never stored.
+        """
+        self.max_size = max_size
+        self.max_age = max_age
+        self.sizeof = sizeof
+        self.total_size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        """Look up an item, marking it as recently used.
+
+        :return: The cached value, or `default` if there is no fresh
+            value for `key`.
+        """
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                value, stored_at, size = item
+                if self.max_age is None or time.time() - stored_at < self.max_age:
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._discard(key)
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        """Store an item, evicting the least recently used items if
+        necessary.
+        """
+        size = self.sizeof(value) if self.sizeof else 1
+        with self._lock:
+            self._discard(key)
+            if size > self.max_size:
+                return value
+            self._items[key] = (value, time.time(), size)
+            self.total_size += size
+            while self.total_size > self.max_size:
+                self._discard(next(iter(self._items)))
+        return value
+
+    def _discard(self, key):
+        """Remove an item. The lock must already be held."""
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.total_size -= item[2]
+
+    def get_or_set(self, key, create):
+        """Look up an item, calling `create` to calculate it if it's
+        not in the cache.
+
+        `create` is called without holding the lock, so two threads
+        may occasionally both calculate the same value. Whichever
+        finishes last wins.
+        """
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = self.set(key, create())
+        return value
+
+    def remove(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.total_size = 0
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    @property
+    def hit_ratio(self):
+        """What fraction of lookups have found a value in the cache?
+
+        :return: A float between 0 and 1, or None if there have been
+            no lookups.
+        """
+        lookups = self.hits + self.misses
+        if not lookups:
+            return None
+        return self.hits / lookups
+
+    @property
+    def stats(self):
+        """Summarize the cache's performance in a dictionary."""
+        return dict(
+            size=len(self),
+            max_size=self.max_size,
+            hits=self.hits,
+            misses=self.misses,
+            hit_ratio=self.hit_ratio,
+        )